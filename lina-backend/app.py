@@ -7,22 +7,41 @@ Versão CORRIGIDA para resolver o problema de debug_info vazando na mensagem.
 import os
 import time
 import json
+from contextlib import nullcontext
 from typing import Dict, Any, Optional, List
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from langserve import add_routes
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import AIMessage, HumanMessage
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.graph import StateGraph, END
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, message_chunk_to_message
+from langgraph.graph import StateGraph, START, END
 from typing_extensions import TypedDict
 from dotenv import load_dotenv
 from pydantic import BaseModel
+from utils.admission import AdmissionController, AdmissionMiddleware, current_queue_wait
+from utils.archive import ThreadArchiver
+from utils.backup import export_sources, iter_export_lines
+from utils.cancellation import (
+    CancellationStats, DisconnectMiddleware, RequestCancelled, current_cancel_token, iter_until_cancelled,
+    raise_if_cancelled
+)
+from utils.checkpointing import LinaSqliteSaver
+from utils.enrichment import EnrichmentStage
+from utils.idempotency import IdempotencyConflict, IdempotencyKeyMiddleware, IdempotencyStore
+from utils.jobs import JobQueue
+from utils.profiling import ProfilingMiddleware, RequestProfiler, profiled_thread
+from utils.routing import ModelRouter, load_tiers_config
+from utils.search import ConversationSearchIndex
+from utils.sharding import ShardedSaver, shard_for_key, shard_paths
+from utils.threads import ThreadMetadataStore, parse_user_id_from_thread_id
+from utils.timing import record_span, start_request_timer, timed
+from utils.tracing import Tracer, load_exporter
 
 # Carrega variáveis de ambiente
 dotenv_path = os.path.join(os.path.dirname(__file__), '..', '.env.keys')
@@ -40,22 +59,26 @@ except json.JSONDecodeError:
     print(f"AVISO: Erro ao decodificar {PRICING_CONFIG_PATH}. O cálculo de custo será 0.")
 
 # Configuração LangSmith
-os.environ["LANGCHAIN_TRACING_V2"] = os.getenv("LANGSMITH_TRACING", "false")
+# O tracing do LangChain não é mais ligado para o processo inteiro: LANGSMITH_TRACING=true
+# faz apenas as requisições sorteadas pelo Tracer rodarem dentro de tracing_v2_enabled
+LANGSMITH_DEEP_TRACING = os.getenv("LANGSMITH_TRACING", "false").lower() == "true"
+os.environ["LANGCHAIN_TRACING_V2"] = "false"
 os.environ["LANGCHAIN_API_KEY"] = os.getenv("LANGSMITH_API_KEY", "")
 os.environ["LANGCHAIN_PROJECT"] = os.getenv("LANGSMITH_PROJECT", "lina-project-default")
 
 # 🗄️ CONFIGURAÇÃO OTIMIZADA DO SQLITE CHECKPOINTER (TAREFA 1.3.1)
 import sqlite3
 
-SQLITE_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'lina_conversations.db'))
+# LINA_DB_PATH troca o diretório de todos os bancos (jobs, arquivo e memória ficam ao lado)
+SQLITE_DB_PATH = os.path.abspath(os.getenv("LINA_DB_PATH") or os.path.join(os.path.dirname(__file__), 'lina_conversations.db'))
 print(f"🗄️ SQLite Database Path: {SQLITE_DB_PATH}")
 
-def setup_optimized_sqlite():
+def setup_optimized_sqlite(db_path: str = SQLITE_DB_PATH):
     """Configuração otimizada do SQLite conforme documentação LangChain"""
     try:
         # Conexão direta com configurações específicas
         conn = sqlite3.connect(
-            SQLITE_DB_PATH,
+            db_path,
             check_same_thread=False,
             isolation_level=None  # WAL mode funciona melhor sem isolation
         )
@@ -76,8 +99,8 @@ def setup_optimized_sqlite():
         
         print("✅ Otimizações SQLite aplicadas")
         
-        # Criar SqliteSaver com conexão otimizada
-        checkpointer = SqliteSaver(conn)
+        # Criar SqliteSaver com conexão otimizada (instrumentado com spans de tempo)
+        checkpointer = LinaSqliteSaver(conn)
         print("✅ SqliteSaver criado com conexão otimizada")
         
         return checkpointer
@@ -86,13 +109,70 @@ def setup_optimized_sqlite():
         print(f"⚠️ Erro ao configurar SQLite otimizado: {e}")
         return None
 
-# Configurar checkpointer otimizado
-checkpointer = setup_optimized_sqlite()
+# Configurar checkpointer otimizado, particionado em LINA_SHARDS arquivos por hash do user_id
+# (o shard 0 é o próprio lina_conversations.db; ao mudar o número rode `python -m utils.sharding rebalance`)
+SHARD_COUNT = max(1, int(os.getenv("LINA_SHARDS", "1")))
+SHARD_DB_PATHS = shard_paths(SQLITE_DB_PATH, SHARD_COUNT)
+shard_savers = [setup_optimized_sqlite(path) for path in SHARD_DB_PATHS]
+checkpointer = ShardedSaver(shard_savers, SHARD_DB_PATHS) if all(shard_savers) else None
 if checkpointer:
-    print(f"✅ Checkpointer otimizado configurado em: {SQLITE_DB_PATH}")
+    print(f"✅ Checkpointer otimizado configurado em: {SQLITE_DB_PATH} ({SHARD_COUNT} shard(s))")
 else:
     print("⚠️ Fallback: Checkpointer desabilitado")
 
+# 📬 FILA DE TAREFAS EM BACKGROUND (trabalho fora do caminho crítico da resposta)
+# Banco próprio para não disputar o lock de escrita do lina_conversations.db
+JOBS_DB_PATH = os.path.join(os.path.dirname(SQLITE_DB_PATH), "lina_jobs.db")
+CHEAP_MODEL_NAME = os.getenv("LINA_CHEAP_MODEL", "google/gemini-2.0-flash-lite-001")  # padrão para jobs com LLM
+job_queue = JobQueue(
+    JOBS_DB_PATH,
+    workers=int(os.getenv("LINA_JOB_WORKERS", "2")),
+    lease_seconds=float(os.getenv("LINA_JOB_LEASE_SECONDS", "120")),
+)
+
+# 🧵 Metadados das threads (título, contagem de mensagens)
+thread_metadata = ThreadMetadataStore(SQLITE_DB_PATH)
+
+# 🧊 ARQUIVAMENTO DE THREADS FRIAS (reidratadas sob demanda pelo checkpointer)
+ARCHIVE_ENABLED = os.getenv("LINA_ARCHIVE_ENABLED", "true").lower() == "true"
+ARCHIVE_DB_PATH = os.path.join(os.path.dirname(SQLITE_DB_PATH), "lina_archive.db")
+ARCHIVE_TTL_SECONDS = float(os.getenv("LINA_ARCHIVE_TTL_HOURS", "24")) * 3600
+ARCHIVE_INTERVAL = float(os.getenv("LINA_ARCHIVE_INTERVAL", "3600"))  # segundos entre varreduras
+ARCHIVE_BATCH = int(os.getenv("LINA_ARCHIVE_BATCH", "200"))
+thread_archivers: List[ThreadArchiver] = []  # um por shard, cada um com seu arquivo
+if checkpointer and ARCHIVE_ENABLED:
+    try:
+        for shard, db_path, archive_path in zip(checkpointer.shards, SHARD_DB_PATHS,
+                                                shard_paths(ARCHIVE_DB_PATH, SHARD_COUNT)):
+            with shard.cursor():
+                pass  # garante que as tabelas do SqliteSaver existem antes do ATTACH
+            shard.archiver = ThreadArchiver(db_path, archive_path, thread_metadata)
+            thread_archivers.append(shard.archiver)
+        print(f"🧊 Arquivamento de threads frias ativo: TTL {ARCHIVE_TTL_SECONDS / 3600:g}h, "
+              f"{sum(len(a.archived_ids) for a in thread_archivers)} threads no arquivo")
+    except Exception as e:
+        thread_archivers = []
+        for shard in checkpointer.shards:
+            shard.archiver = None
+        print(f"⚠️ AVISO: Arquivamento de threads desabilitado: {e}")
+
+# 🔎 ÍNDICE FTS5 DAS CONVERSAS (atualizado em background a cada checkpoint gravado)
+search_index = None
+try:
+    search_index = ConversationSearchIndex(SQLITE_DB_PATH)
+    if checkpointer:
+        def enqueue_search_index(config: dict, checkpoint: dict):
+            thread_id = config.get("configurable", {}).get("thread_id")
+            if thread_id and not config.get("configurable", {}).get("checkpoint_ns"):
+                # Vários checkpoints por turno viram um único job pendente por thread
+                job_queue.enqueue("index_search", {"thread_id": thread_id}, priority=5,
+                                  dedupe_key=f"index_search:{thread_id}")
+
+        checkpointer.add_put_listener(enqueue_search_index)
+    print("✅ Índice de busca FTS5 configurado")
+except sqlite3.OperationalError as e:
+    print(f"⚠️ Busca full-text indisponível (SQLite sem FTS5?): {e}")
+
 # Inicializa FastAPI
 app = FastAPI(
     title="Lina Backend API",
@@ -100,6 +180,99 @@ app = FastAPI(
     description="Backend para o assistente pessoal Lina com respostas estruturadas CORRIGIDO"
 )
 
+# 🚦 CONTROLE DE ADMISSÃO: concorrência global/por usuário + tokens por minuto por modelo
+# Limites de TPM por modelo podem ser definidos em pricing.json ("tokens_per_minute")
+DEFAULT_MODEL_NAME = os.getenv("OPENROUTER_DEFAULT_MODEL", "google/gemini-2.5-flash-preview-05-20")
+
+# 🧭 ROTEAMENTO DE MODELO: tiers (fast/standard/deep) em config/model_tiers.json, escolhidos por turno
+MODEL_TIERS_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config', 'model_tiers.json')
+model_router = ModelRouter(
+    load_tiers_config(MODEL_TIERS_CONFIG_PATH),
+    default_model=DEFAULT_MODEL_NAME,
+    enabled=os.getenv("LINA_MODEL_ROUTING", "true").lower() == "true",
+)
+print(f"🧭 Roteamento de modelo {'ativo' if model_router.enabled else 'desligado'}: "
+      f"{ {tier: info['model'] for tier, info in model_router.describe().items()} }")
+
+def admission_model(payload: dict) -> str:
+    """Modelo provável do turno para o token bucket (sem histórico nem override da thread)"""
+    text = str(payload.get("input") or "")
+    hint, text = model_router.extract_hint(text)
+    return model_router.route(text, hint=payload.get("model_tier") or hint, record=False)["model"]
+
+admission_controller = AdmissionController(
+    max_concurrency=int(os.getenv("LINA_MAX_CONCURRENCY", "8")),
+    max_concurrency_per_user=int(os.getenv("LINA_MAX_CONCURRENCY_PER_USER", "2")),
+    max_queue=int(os.getenv("LINA_ADMISSION_QUEUE_MAX", "32")),
+    max_queue_per_user=int(os.getenv("LINA_ADMISSION_QUEUE_MAX_PER_USER", "4")),
+    queue_timeout=float(os.getenv("LINA_ADMISSION_QUEUE_TIMEOUT", "10")),
+    default_tokens_per_minute=int(os.getenv("LINA_TOKENS_PER_MINUTE", "100000")),
+    model_tokens_per_minute={
+        model: prices["tokens_per_minute"]
+        for model, prices in PRICING_CONFIG.items()
+        if isinstance(prices, dict) and "tokens_per_minute" in prices
+    },
+)
+
+# Adicionado antes do CORS para que as respostas 429 também recebam os headers CORS
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission_controller,
+    paths=("/chat/invoke", "/chat/batch", "/test"),
+    model_resolver=admission_model,
+    history_allowance=int(os.getenv("LINA_ADMISSION_HISTORY_TOKENS", "1000")),
+)
+
+# 🔬 PROFILING SOB DEMANDA: header X-Lina-Profile (ou ?lina_profile=) com chave da allow-list
+PROFILE_ALLOWLIST = [key.strip() for key in os.getenv("LINA_PROFILE_ALLOWLIST", "").split(",") if key.strip()]
+request_profiler = RequestProfiler(
+    output_dir=os.getenv("LINA_PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles")),
+    keep=int(os.getenv("LINA_PROFILE_KEEP", "50")),
+)
+
+# Sem allow-list o middleware nem é instalado (custo zero)
+if PROFILE_ALLOWLIST:
+    app.add_middleware(ProfilingMiddleware, allowlist=PROFILE_ALLOWLIST)
+    print(f"🔬 Profiling sob demanda habilitado ({len(PROFILE_ALLOWLIST)} chave(s))")
+
+# 🔭 TRACING AMOSTRADO: taxa fixa + sempre erros e requisições lentas, exportado em background
+tracer = Tracer(
+    load_exporter(
+        os.getenv("LINA_TRACE_EXPORTER", "file"),
+        default_path=os.path.join(os.path.dirname(__file__), "traces", "traces.ndjson"),
+    ),
+    sample_rate=float(os.getenv("LINA_TRACE_SAMPLE_RATE", "0.1")),
+    slow_ms=float(os.getenv("LINA_TRACE_SLOW_MS", "5000")),
+    max_buffer=int(os.getenv("LINA_TRACE_BUFFER", "1000")),
+    batch_size=int(os.getenv("LINA_TRACE_BATCH", "50")),
+    flush_interval=float(os.getenv("LINA_TRACE_FLUSH_INTERVAL", "2.0")),
+)
+tracer.start()
+print(f"🔭 Tracing amostrado: {tracer.sample_rate:.0%} + erros + lentas (>{tracer.slow_ms:g}ms) "
+      f"-> {type(tracer.exporter).__name__}")
+
+def langsmith_tracing(trace):
+    """tracing_v2_enabled só para requisições sorteadas (e se LANGSMITH_TRACING=true)"""
+    if LANGSMITH_DEEP_TRACING and trace.head_sampled:
+        from langchain_core.tracers.context import tracing_v2_enabled
+        return tracing_v2_enabled(os.environ["LANGCHAIN_PROJECT"])
+    return nullcontext()
+
+# 🔁 IDEMPOTÊNCIA: retries com a mesma Idempotency-Key não repetem a chamada ao LLM
+idempotency_store = IdempotencyStore(
+    ttl=float(os.getenv("LINA_IDEMPOTENCY_TTL", "600")),
+    max_entries=int(os.getenv("LINA_IDEMPOTENCY_MAX_ENTRIES", "10000")),
+)
+app.add_middleware(IdempotencyKeyMiddleware, paths=("/chat/invoke",))
+
+# 🔌 CANCELAMENTO: cliente desconectou -> interromper o streaming do LLM e desfazer o turno
+cancellation_stats = CancellationStats()
+app.add_middleware(DisconnectMiddleware, stats=cancellation_stats, paths=("/chat/invoke", "/chat/batch", "/test"))
+
+@app.exception_handler(IdempotencyConflict)
+async def idempotency_conflict_handler(request: Request, exc: IdempotencyConflict):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -150,6 +323,58 @@ async def serve_frontend_files(file_path: str):
 async def health_check():
     return {"status": "ok", "service": "lina-backend-fixed"}
 
+# 🚦 Estado atual da admissão (vagas ativas, filas, buckets de tokens)
+@app.get("/admission/stats")
+async def admission_stats():
+    return admission_controller.stats()
+
+# 🧊 Contagens e latências de arquivamento/reidratação (def síncrono: consulta SQLite no threadpool)
+@app.get("/archive/stats")
+def archive_stats():
+    if not thread_archivers:
+        return {"enabled": False}
+    shards = [archiver.stats() for archiver in thread_archivers]
+    return {
+        "enabled": True,
+        "ttl_hours": ARCHIVE_TTL_SECONDS / 3600,
+        "archived_threads": sum(stats["archived_threads"] for stats in shards),
+        "archived": sum(stats["archive"]["count"] for stats in shards),
+        "rehydrated": sum(stats["rehydrate"]["count"] for stats in shards),
+        "shards": shards,
+    }
+
+# 🗄️ Distribuição de threads/checkpoints entre os shards (def síncrono: contagem varre cada shard)
+@app.get("/shards/stats")
+def shards_stats():
+    if not checkpointer:
+        return {"shards": []}
+    return {"shard_count": SHARD_COUNT, "shards": checkpointer.stats()}
+
+# 🧭 Tiers configurados e decisões do roteador de modelo
+@app.get("/routing/stats")
+async def routing_stats():
+    return model_router.stats()
+
+# 🔌 Desconexões e trabalho interrompido (antes/durante o LLM, turnos desfeitos)
+@app.get("/cancellation/stats")
+async def cancellation_stats_endpoint():
+    return cancellation_stats.stats()
+
+# 🔁 Chaves de idempotência em andamento/guardadas e quantos retries foram poupados
+@app.get("/idempotency/stats")
+async def idempotency_stats():
+    return idempotency_store.stats()
+
+# 🔭 Contadores de amostragem e exportação de traces
+@app.get("/tracing/stats")
+async def tracing_stats():
+    return tracer.stats()
+
+# 📬 Profundidade e métricas da fila de jobs em background (def síncrono: consulta SQLite)
+@app.get("/jobs/stats")
+def jobs_stats():
+    return job_queue.stats()
+
 # Modelos Pydantic
 class ChatInput(BaseModel):
     input: str
@@ -165,21 +390,39 @@ class DebugInfo(BaseModel):
     thread_id: Optional[str] = None
     message_id: Optional[str] = None
     message_sequence: Optional[int] = None
+    # 🔬 Id do artefato de profiling (apenas quando solicitado)
+    profile_id: Optional[str] = None
+    # 🚦 Tempo de espera na fila de admissão (segundos)
+    queue_wait: float = 0.0
+    # ⏱️ Quebra do tempo por etapa (milissegundos)
+    timings: Dict[str, float] = {}
+    # 🧩 Status e tempo de cada enriquecedor ({nome: {"status", "ms"}})
+    enrichment: Dict[str, Dict[str, Any]] = {}
+    # 🔭 Id do trace quando a requisição foi amostrada
+    trace_id: Optional[str] = None
+    # 🔁 Resposta devolvida do cache de idempotência (retry de uma requisição já processada)
+    idempotent_replay: bool = False
+    # 🧭 Tier de modelo escolhido pelo roteador e o motivo
+    model_tier: Optional[str] = None
+    routing_reason: Optional[str] = None
+    # ⚠️ Erro do turno (provedor, grafo ou cancelamento); respostas com erro não são cacheadas
+    error: Optional[str] = None
 
 class ChatResponse(BaseModel):
     output: str  # APENAS a mensagem da Lina
     debug_info: DebugInfo  # APENAS os dados de debug
 
 # Configuração do modelo LLM
-def get_llm():
+def get_llm(model_name: Optional[str] = None, temperature: float = 0.8):
     """Cria instância do LLM com fallback"""
-    default_model = os.getenv("OPENROUTER_DEFAULT_MODEL", "google/gemini-2.5-flash-preview-05-20")
+    default_model = model_name or DEFAULT_MODEL_NAME
     try:
         return ChatOpenAI(
             model=default_model,
             openai_api_base="https://openrouter.ai/api/v1",
             openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-            temperature=0.8,
+            temperature=temperature,
+            stream_usage=True,  # Uso de tokens também no modo streaming
         )
     except Exception as e:
         print(f"Erro ao configurar LLM principal ({default_model}): {e}")
@@ -189,7 +432,8 @@ def get_llm():
             model=fallback_model,
             openai_api_base="https://openrouter.ai/api/v1",
             openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-            temperature=0.8
+            temperature=temperature,
+            stream_usage=True
         )
 
 # Prompt template - CORRIGIDO para usar MessagesPlaceholder
@@ -206,9 +450,68 @@ Características da sua personalidade:
 - Sempre responde em português brasileiro
 
 Responda de forma clara, útil e concisa."""),
+    # 🧠 Trechos recuperados da memória de longo prazo (opcional)
+    MessagesPlaceholder(variable_name="memory", optional=True),
     MessagesPlaceholder(variable_name="messages")
 ])
 
+# 🧠 MEMÓRIA DE LONGO PRAZO POR RECUPERAÇÃO (Lina-Memory)
+# Índice vetorial NumPy memory-mapped ao lado do lina_conversations.db
+MEMORY_ENABLED = os.getenv("LINA_MEMORY_ENABLED", "true").lower() == "true"
+MEMORY_TOP_K = int(os.getenv("LINA_MEMORY_TOP_K", "4"))
+MEMORY_HISTORY_WINDOW = int(os.getenv("LINA_MEMORY_HISTORY_WINDOW", "12"))  # mensagens recentes enviadas na íntegra
+
+conversation_memory = None
+if MEMORY_ENABLED:
+    try:
+        from utils.memory import ConversationMemory, VectorIndex, load_embedder
+
+        memory_embedder = load_embedder(
+            os.getenv("LINA_MEMORY_EMBEDDER", "hashing"),
+            dim=int(os.getenv("LINA_MEMORY_DIM", "512")),
+        )
+        conversation_memory = ConversationMemory(
+            VectorIndex(os.path.join(os.path.dirname(SQLITE_DB_PATH), "lina_memory"), memory_embedder.dim),
+            memory_embedder,
+            min_score=float(os.getenv("LINA_MEMORY_MIN_SCORE", "0.2")),
+        )
+        print(f"✅ Memória de longo prazo carregada: {len(conversation_memory.index)} trechos indexados")
+    except ImportError as e:
+        print(f"AVISO: Memória de longo prazo desabilitada (dependência ausente: {e})")
+    except Exception as e:
+        print(f"⚠️ Erro ao carregar memória de longo prazo: {e}")
+
+def history_window(messages: list, memory_available: bool = True) -> list:
+    """Com a memória ativa, mensagens antigas já indexadas saem do prompt (são recuperáveis)
+
+    A janela recente vai sempre na íntegra; mensagens ainda não indexadas (conversas anteriores à
+    memória, job pendente) também. Sem a busca na memória no turno (timeout/erro), vai tudo."""
+    if conversation_memory is None or MEMORY_HISTORY_WINDOW <= 0 or not memory_available:
+        return messages
+    cutoff = len(messages) - MEMORY_HISTORY_WINDOW
+    return [
+        m for position, m in enumerate(messages)
+        if position >= cutoff or not conversation_memory.is_indexed(getattr(m, "id", None))
+    ]
+
+def remember_turn(thread_id: Optional[str], user_id: Optional[str], messages: list):
+    """Enfileira a indexação das mensagens do turno na memória de longo prazo"""
+    if conversation_memory is None or not thread_id:
+        return
+    job_queue.enqueue("index_memory", {
+        "thread_id": thread_id,
+        "user_id": user_id,
+        "messages": [
+            {
+                "message_id": m.id,
+                "role": "user" if isinstance(m, HumanMessage) else "assistant",
+                "text": m.content if isinstance(m.content, str) else str(m.content),
+            }
+            for m in messages
+            if getattr(m, "id", None)
+        ],
+    }, priority=5)
+
 # Função de cálculo de custo
 def calculate_cost(model_name: str, prompt_tokens: int, completion_tokens: int, pricing_config: dict) -> float:
     model_prices = pricing_config.get(model_name, {})
@@ -217,6 +520,18 @@ def calculate_cost(model_name: str, prompt_tokens: int, completion_tokens: int,
     cost = (prompt_tokens * input_price) + (completion_tokens * output_price)
     return round(cost, 8)
 
+def extract_token_usage(ai_message: AIMessage) -> tuple[int, int, int]:
+    """Retorna (prompt, completion, total) de response_metadata ou, no streaming, de usage_metadata"""
+    token_usage = (getattr(ai_message, 'response_metadata', None) or {}).get('token_usage') or {}
+    if token_usage:
+        prompt_tokens = token_usage.get('prompt_tokens', 0)
+        completion_tokens = token_usage.get('completion_tokens', 0)
+        return prompt_tokens, completion_tokens, token_usage.get('total_tokens', prompt_tokens + completion_tokens)
+    usage = getattr(ai_message, 'usage_metadata', None) or {}
+    prompt_tokens = usage.get('input_tokens', 0)
+    completion_tokens = usage.get('output_tokens', 0)
+    return prompt_tokens, completion_tokens, usage.get('total_tokens', prompt_tokens + completion_tokens)
+
 # FUNÇÃO CORRIGIDA: Extração limpa do conteúdo da mensagem
 def extract_clean_message_content(llm_output: AIMessage) -> str:
     """
@@ -292,7 +607,63 @@ class AgentState(MessagesState):
     user_id: Optional[str] = None
     current_step: str = "chat"
     debug_info: dict = {}
+    # 🧩 Resultados do estágio de enriquecimento ({nome: resultado}) e tempos por nó
+    enrichment: dict = {}
+    enrichment_report: dict = {}
+    # 🧭 Dica de tier enviada pelo usuário neste turno e a decisão do roteador
+    model_hint: Optional[str] = None
+    routing: dict = {}
+
+# 🧩 ESTÁGIO DE ENRIQUECIMENTO PRÉ-LLM (nós independentes em paralelo, com timeout por nó)
+# Pool próprio por enriquecedor, com uma thread por requisição admitida ao mesmo tempo
+enrichment_stage = EnrichmentStage(
+    max_workers=int(os.getenv("LINA_ENRICH_WORKERS", str(admission_controller.max_concurrency)))
+)
+
+if conversation_memory is not None:
+    @enrichment_stage.register("memory", timeout=float(os.getenv("LINA_MEMORY_TIMEOUT", "0.5")))
+    def memory_enricher(state: dict) -> dict:
+        """Busca trechos relevantes da memória de longo prazo para o turno atual"""
+        messages = state.get("messages", [])
+        recent = history_window(messages)
+        query = recent[-1].content if recent and isinstance(recent[-1].content, str) else ""
+        thread_id = state.get("thread_id")
+        snippets = conversation_memory.retrieve(
+            query,
+            k=MEMORY_TOP_K,
+            user_id=state.get("user_id") or parse_user_id_from_thread_id(thread_id),
+            exclude_message_ids=[m.id for m in recent if getattr(m, "id", None)],
+            thread_id=thread_id,
+        )
+        if not snippets:
+            return {}
+        print(f"[DEBUG] 🧠 MEMÓRIA: {len(snippets)} trechos recuperados (janela de {len(recent)} mensagens)")
+        return {"context": ConversationMemory.format_context(snippets), "snippets": len(snippets)}
 
+@profiled_thread
+def enrichment_node(state: AgentState) -> dict:
+    """Executa os enriquecedores registrados e junta os resultados ao estado"""
+    return enrichment_stage.run(state)
+
+@profiled_thread
+def route_node(state: AgentState) -> dict:
+    """Escolhe o tier de modelo do turno (override da thread > dica do usuário > complexidade)"""
+    with timed("routing"):
+        messages = state.get("messages", [])
+        last_message = messages[-1] if messages else None
+        text = last_message.content if last_message is not None and isinstance(last_message.content, str) else ""
+        override = None
+        try:
+            override = thread_metadata.get_model_tier(state.get("thread_id"))
+        except Exception as e:
+            print(f"[ERROR] Model tier override lookup error: {e}")
+        decision = model_router.route(
+            text, history_size=max(len(messages) - 1, 0), hint=state.get("model_hint"), override=override
+        )
+    print(f"[DEBUG] 🧭 ROTEAMENTO: tier {decision['tier']} ({decision['model']}) - {decision['reason']}")
+    return {"routing": decision}
+
+@profiled_thread
 def chat_node(state: AgentState) -> dict:
     """Nó principal do chat conforme padrão LangChain - CORRIGIDO para usar histórico completo"""
     
@@ -310,27 +681,68 @@ def chat_node(state: AgentState) -> dict:
     
     # 🧠 CORREÇÃO: Passar TODAS as mensagens para o LLM (não só a última)
     try:
-        llm = get_llm()
-        chain = LINA_PROMPT | llm
+        # 🔌 Cliente já foi embora (ex.: desconectou durante a fila ou o enriquecimento)
+        raise_if_cancelled("before_llm")
+        routing = state.get("routing") or {}
+        llm = get_llm(routing.get("model"), temperature=routing.get("temperature", 0.8))
+        thread_id = state.get("thread_id")
+        user_id = state.get("user_id") or parse_user_id_from_thread_id(thread_id)
+        
+        # 🧠 Janela recente + trechos da memória trazidos pelo estágio de enriquecimento
+        memory_status = (state.get("enrichment_report") or {}).get("memory", {}).get("status")
+        prompt_messages = history_window(messages, memory_available=memory_status == "ok")
+        memory_context = (state.get("enrichment") or {}).get("memory", {}).get("context")
+        memory_messages = [SystemMessage(content=memory_context)] if memory_context else []
+        
+        # 🧠 MONTAR PROMPT usando MessagesPlaceholder
+        with timed("prompt_build"):
+            prompt_value = LINA_PROMPT.invoke({"messages": prompt_messages, "memory": memory_messages})
+        
+        # ⏱️ Streaming interno para separar tempo até o primeiro chunk (TTFB) da geração
+        llm_start = time.perf_counter()
+        first_chunk_at = None
+        ai_chunk = None
+        # 🔌 Cliente desconectou (mesmo antes do primeiro chunk): parar de esperar e pagar tokens
+        for chunk in iter_until_cancelled(llm.stream(prompt_value), current_cancel_token()):
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            ai_chunk = chunk if ai_chunk is None else ai_chunk + chunk
+        llm_end = time.perf_counter()
+        record_span("llm_ttfb", llm_start, first_chunk_at or llm_end)
+        record_span("llm_generation", first_chunk_at or llm_end, llm_end)
         
-        # 🧠 INVOCAR COM HISTÓRICO COMPLETO usando MessagesPlaceholder
-        ai_message = chain.invoke({"messages": messages})
+        if ai_chunk is None:
+            raise ValueError("LLM não retornou conteúdo")
+        ai_message = message_chunk_to_message(ai_chunk)
+        if not ai_message.id:
+            ai_message.id = str(uuid.uuid4())
+        
+        # 🧠 Indexar pergunta e resposta para turnos futuros (em background)
+        with timed("memory_index"):
+            try:
+                remember_turn(thread_id, user_id, [last_message, ai_message])
+            except Exception as memory_error:
+                print(f"[ERROR] Memory index error: {memory_error}")
         
         # Extrair metadados para debug
-        metadata = getattr(ai_message, 'response_metadata', {})
-        token_usage = metadata.get('token_usage', {})
+        metadata = getattr(ai_message, 'response_metadata', {}) or {}
+        model_name = metadata.get('model_name') or getattr(llm, 'model_name', 'unknown')
+        prompt_tokens, completion_tokens, total_tokens = extract_token_usage(ai_message)
         
         debug_info = {
-            "tokens_used": token_usage.get('total_tokens', 0),
-            "prompt_tokens": token_usage.get('prompt_tokens', 0),
-            "completion_tokens": token_usage.get('completion_tokens', 0),
-            "model_name": metadata.get('model_name', 'unknown'),
+            "tokens_used": total_tokens,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "model_name": model_name,
             "cost": calculate_cost(
-                metadata.get('model_name', ''), 
-                token_usage.get('prompt_tokens', 0),
-                token_usage.get('completion_tokens', 0), 
+                model_name,
+                prompt_tokens,
+                completion_tokens,
                 PRICING_CONFIG
-            )
+            ),
+            "enrichment": state.get("enrichment_report") or {},
+            "model_tier": routing.get("tier"),
+            "routing_reason": routing.get("reason")
         }
         
         print(f"[DEBUG] Chat node completed - tokens: {debug_info['tokens_used']}")
@@ -342,12 +754,14 @@ def chat_node(state: AgentState) -> dict:
             "debug_info": debug_info
         }
         
+    except RequestCancelled:
+        raise  # tratado no wrapper (nenhuma mensagem da Lina é gravada)
     except Exception as e:
         print(f"[ERROR] Chat node error: {e}")
         error_message = AIMessage(content=f"Erro: {str(e)}")
         return {
             "messages": [error_message],
-            "debug_info": {"error": str(e)}
+            "debug_info": {"error": str(e), "model_name": "error"}
         }
 
 def create_conversation_graph():
@@ -358,11 +772,20 @@ def create_conversation_graph():
     # Criar graph com AgentState
     workflow = StateGraph(AgentState)
     
-    # Adicionar nó principal
+    # Adicionar nó principal e o roteamento de modelo (sempre no primeiro superstep)
+    workflow.add_node("route", route_node)
     workflow.add_node("chat", chat_node)
+    workflow.add_edge(START, "route")
     
-    # Definir entry point e edges
-    workflow.set_entry_point("chat")
+    # Definir edges: enriquecimento em paralelo com o roteamento (mesmo superstep, um checkpoint só)
+    # e o chat espera os dois
+    if enrichment_stage:
+        workflow.add_node("enrich", enrichment_node)
+        workflow.add_edge(START, "enrich")
+        workflow.add_edge(["route", "enrich"], "chat")
+        print(f"🧩 Enriquecimento pré-LLM: {[e.name for e in enrichment_stage.enrichers]}")
+    else:
+        workflow.add_edge("route", "chat")
     workflow.add_edge("chat", END)
     
     # Compilar com checkpointer otimizado
@@ -379,6 +802,51 @@ def create_conversation_graph():
 conversation_graph = create_conversation_graph()
 print(f"🗄️ Conversation graph criado: {conversation_graph is not None}")
 
+# 📬 HANDLERS DOS JOBS EM BACKGROUND
+@job_queue.register("index_search")
+def index_search_job(payload: dict):
+    """Indexa no FTS5 as mensagens novas do checkpoint mais recente da thread"""
+    if search_index and checkpointer:
+        search_index.index_thread(checkpointer, payload["thread_id"])
+
+@job_queue.register("index_memory")
+def index_memory_job(payload: dict):
+    if conversation_memory is not None:
+        conversation_memory.add_messages(payload["thread_id"], payload.get("user_id"), payload["messages"])
+
+@job_queue.register("generate_title", max_attempts=3, backoff=5.0)
+def generate_title_job(payload: dict):
+    """Gera título curto para a thread com o modelo barato"""
+    llm = get_llm(payload.get("model") or CHEAP_MODEL_NAME, temperature=0.3)
+    prompt = (
+        "Crie um título curto (no máximo 6 palavras, sem aspas e sem pontuação final) em português "
+        "para uma conversa que começa assim:\n\n"
+        f"Usuário: {payload['user_message'][:500]}\n"
+        f"Lina: {payload.get('assistant_message', '')[:500]}"
+    )
+    title = llm.invoke(prompt).content.strip().strip('"\'').splitlines()[0][:80]
+    if title:
+        thread_metadata.set_title(payload["thread_id"], title)
+        print(f"[DEBUG] Título gerado para {payload['thread_id']}: {title}")
+
+@job_queue.register("archive_cold_threads", max_attempts=1)
+def archive_cold_threads_job(payload: dict):
+    """Varredura periódica: arquiva threads ociosas e agenda a próxima execução"""
+    try:
+        for archiver in thread_archivers:
+            result = archiver.archive_idle(ARCHIVE_TTL_SECONDS, ARCHIVE_BATCH)
+            print(f"[DEBUG] Arquivamento ({os.path.basename(archiver.db_path)}): "
+                  f"{result['archived']}/{result['candidates']} threads em {result['duration']}s")
+    finally:
+        job_queue.enqueue("archive_cold_threads", {}, priority=-1, delay=ARCHIVE_INTERVAL,
+                          dedupe_key="archive_cold_threads")
+
+if thread_archivers:
+    job_queue.enqueue("archive_cold_threads", {}, priority=-1, delay=60, dedupe_key="archive_cold_threads")
+
+job_queue.start()
+print(f"📬 Fila de jobs iniciada ({job_queue.workers} workers) em: {JOBS_DB_PATH}")
+
 # Chain principal - mantendo compatibilidade
 basic_chain = LINA_PROMPT | get_llm()
 langserve_chain_core = basic_chain | RunnableLambda(format_response_with_debug_info)
@@ -391,8 +859,9 @@ from typing import Optional, Dict, List
 class ThreadManager:
     """Gerenciador de threads de conversação conforme padrão LangChain"""
     
-    def __init__(self, checkpointer):
+    def __init__(self, checkpointer, metadata_store: Optional[ThreadMetadataStore] = None):
         self.checkpointer = checkpointer
+        self.metadata_store = metadata_store
     
     def create_thread(self, user_id: str, metadata: dict = None) -> tuple[str, dict]:
         """Cria nova thread de conversação"""
@@ -418,6 +887,12 @@ class ThreadManager:
             "metadata": thread_metadata
         }
         
+        if self.metadata_store:
+            self.metadata_store.ensure(thread_id, user_id, thread_metadata["title"])
+            # 🧭 Tier fixo escolhido na criação da thread (metadata={"model_tier": "deep"})
+            if model_router.is_tier(thread_metadata.get("model_tier")):
+                self.metadata_store.set_model_tier(thread_id, thread_metadata["model_tier"])
+        
         print(f"[DEBUG] Created new thread: {thread_id} for user: {user_id}")
         return thread_id, config
     
@@ -455,7 +930,7 @@ def generate_thread_id(user_id: str) -> str:
     return f"thread_{user_id}_{timestamp}_{short_uuid}"
 
 # Instância global do ThreadManager
-thread_manager = ThreadManager(checkpointer) if checkpointer else None
+thread_manager = ThreadManager(checkpointer, thread_metadata) if checkpointer else None
 
 # 🧵 CHECKPOINT 1.3: Endpoint para Nova Thread (TAREFA 1.3.1)
 class NewThreadRequest(BaseModel):
@@ -520,16 +995,15 @@ class ListThreadsResponse(BaseModel):
 
 @app.get("/chat/threads/{user_id}", response_model=ListThreadsResponse)
 async def list_user_threads(user_id: str, limit: int = 20):
-    """Lista threads do usuário (implementação futura completa)"""
+    """Lista threads do usuário (mais recentes primeiro) a partir dos metadados"""
     try:
-        # Por enquanto, retorna apenas informação básica
-        # TODO: Implementar busca real no checkpointer
+        threads = thread_metadata.list_by_user(user_id, limit)
         
         return ListThreadsResponse(
             success=True,
-            threads=[],  # Será implementado quando tivermos mais dados
+            threads=threads,
             user_id=user_id,
-            total=0
+            total=len(threads)
         )
         
     except Exception as e:
@@ -541,18 +1015,156 @@ async def list_user_threads(user_id: str, limit: int = 20):
             total=0
         )
 
+# 🧭 Override do tier de modelo por thread (tier null volta ao roteamento automático)
+class ModelTierRequest(BaseModel):
+    tier: Optional[str] = None
+
+class ModelTierResponse(BaseModel):
+    success: bool
+    thread_id: str
+    model_tier: Optional[str] = None
+    model: Optional[str] = None
+    message: str
+
+@app.put("/chat/threads/{thread_id}/model-tier", response_model=ModelTierResponse)
+async def set_thread_model_tier(thread_id: str, request: ModelTierRequest):
+    """Fixa (ou libera) o tier de modelo usado em todos os turnos da thread"""
+    if request.tier is not None and not model_router.is_tier(request.tier):
+        return ModelTierResponse(
+            success=False,
+            thread_id=thread_id,
+            message=f"Tier desconhecido: {request.tier} (disponíveis: {', '.join(model_router.tiers)})"
+        )
+    try:
+        thread_metadata.set_model_tier(thread_id, request.tier)
+        return ModelTierResponse(
+            success=True,
+            thread_id=thread_id,
+            model_tier=request.tier,
+            model=model_router.model_for(request.tier) if request.tier else None,
+            message="Tier fixado na thread" if request.tier else "Thread voltou ao roteamento automático"
+        )
+    except Exception as e:
+        print(f"[ERROR] Set model tier error: {e}")
+        return ModelTierResponse(success=False, thread_id=thread_id, message=f"Erro ao salvar tier: {str(e)}")
+
+# 🔎 Busca full-text nas conversas
+class SearchResponse(BaseModel):
+    success: bool
+    query: str
+    results: List[Dict[str, Any]]
+    total: int
+    limit: int
+    offset: int
+    took_ms: float = 0.0
+    message: Optional[str] = None
+
+# def síncrono: a consulta SQLite (e o lock do índice) roda no threadpool, não no event loop
+@app.get("/chat/search", response_model=SearchResponse)
+def search_conversations(
+    q: str,
+    user_id: str,
+    thread_id: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0
+):
+    """Busca mensagens do usuário por conteúdo (ranqueadas por bm25, com trechos destacados)"""
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    if not search_index:
+        return SearchResponse(success=False, query=q, results=[], total=0, limit=limit, offset=offset,
+                              message="Índice de busca indisponível")
+    try:
+        start = time.perf_counter()
+        results, total = search_index.search(q, user_id=user_id, thread_id=thread_id, limit=limit, offset=offset)
+        took_ms = round((time.perf_counter() - start) * 1000, 2)
+        print(f"[DEBUG] Search '{q[:30]}' -> {total} resultados em {took_ms}ms")
+        return SearchResponse(success=True, query=q, results=results, total=total,
+                              limit=limit, offset=offset, took_ms=took_ms)
+    except Exception as e:
+        print(f"[ERROR] Search error: {e}")
+        return SearchResponse(success=False, query=q, results=[], total=0, limit=limit, offset=offset,
+                              message=f"Erro na busca: {str(e)}")
+
+# 💾 Exportação NDJSON em streaming (uma thread por vez, memória constante)
+@app.get("/chat/export")
+async def export_conversations(user_id: Optional[str] = None):
+    """Exporta threads e mensagens em NDJSON; para backup binário use `python -m utils.backup backup`"""
+    if not checkpointer:
+        return {"success": False, "error": "Checkpointer desabilitado"}
+
+    # Só o shard do usuário quando filtrado; threads arquivadas saem direto do arquivo, sem reidratar
+    shard_indexes = [shard_for_key(user_id, SHARD_COUNT)] if user_id else range(SHARD_COUNT)
+    db_paths = [SHARD_DB_PATHS[index] for index in shard_indexes]
+    archive_paths = [shard_paths(ARCHIVE_DB_PATH, SHARD_COUNT)[index] for index in shard_indexes]
+
+    def generate():
+        # Conexões próprias de leitura por arquivo (não disputa o lock dos savers)
+        yield from iter_export_lines(export_sources(db_paths, archive_paths, user_id))
+
+    filename = f"lina_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.ndjson"
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Canais gravados por cada turno (além das mensagens) e seus valores iniciais
+TURN_STATE_DEFAULTS = {"model_hint": None, "routing": {}, "enrichment": {}, "enrichment_report": {}, "debug_info": {}}
+
+def rollback_cancelled_turn(config: dict, human_message_id: str) -> bool:
+    """Desfaz um turno cancelado (sem resposta), se a pergunta chegou a ser gravada
+
+    Remove a pergunta, devolve roteamento/enriquecimento aos valores do turno anterior e
+    sincroniza o índice de busca na hora."""
+    try:
+        state = conversation_graph.get_state(config)
+        messages = (state.values or {}).get("messages", [])
+        if not any(getattr(m, "id", None) == human_message_id for m in messages):
+            return False
+        # Último checkpoint anterior à pergunta (do mais novo para o mais antigo)
+        previous = {}
+        for snapshot in conversation_graph.get_state_history(config):
+            if not any(getattr(m, "id", None) == human_message_id for m in snapshot.values.get("messages", [])):
+                previous = snapshot.values
+                break
+        update = {key: previous.get(key, default) for key, default in TURN_STATE_DEFAULTS.items()}
+        update["messages"] = [RemoveMessage(id=human_message_id)]
+        conversation_graph.update_state(config, update, as_node="chat")
+        if search_index:
+            search_index.index_thread(checkpointer, config["configurable"]["thread_id"])
+        return True
+    except Exception as e:
+        print(f"[ERROR] Rollback do turno cancelado falhou: {e}")
+        return False
+
 # WRAPPER LANGSERVE COMPATÍVEL COM THREAD ID MANAGEMENT (TAREFA 1.3.1 - CHECKPOINT 1.2)
+# Respostas de erro/canceladas não são guardadas: o retry deve tentar de novo
+@idempotency_store.wrap(
+    cacheable=lambda result: not result.get("debug_info", {}).get("error")
+    and result.get("debug_info", {}).get("model_name") not in ("error", "cancelled")
+)
+@request_profiler.wrap
 def lina_api_wrapper(input_data: dict) -> dict:
     """Wrapper LangServe compatível que usa StateGraph com checkpointing otimizado e thread ID management"""
     start_time = time.time()
+    # ⏱️ Timer da requisição: chat_node e checkpointer registram suas etapas nele
+    timer = start_request_timer()
+    trace = tracer.start_trace(timer)
+    trace_error = None
+    parse_start = time.perf_counter()
 
     # 🧵 EXTRAIR OU GERAR THREAD_ID (CHECKPOINT 1.2)
     thread_id = None
+    user_id = None
+    model_hint = None
     user_message = ""
     
     if isinstance(input_data, dict):
         # Tentar extrair thread_id se fornecido
         thread_id = input_data.get("thread_id")
+        user_id = input_data.get("user_id")
+        model_hint = input_data.get("model_tier")
         
         # Extrair mensagem do usuário
         if "input" in input_data:
@@ -564,6 +1176,10 @@ def lina_api_wrapper(input_data: dict) -> dict:
                 # Também tentar extrair thread_id do input aninhado
                 if not thread_id and "thread_id" in input_data["input"]:
                     thread_id = input_data["input"]["thread_id"]
+                if not user_id and "user_id" in input_data["input"]:
+                    user_id = input_data["input"]["user_id"]
+                if not model_hint and "model_tier" in input_data["input"]:
+                    model_hint = input_data["input"]["model_tier"]
             else:
                 user_message = str(input_data["input"])
         else:
@@ -571,15 +1187,23 @@ def lina_api_wrapper(input_data: dict) -> dict:
     else:
         user_message = str(input_data)
 
+    # 🧭 Dica de tier no início da mensagem ("/detalhado ...") sai do texto enviado ao LLM
+    text_hint, hinted_message = model_router.extract_hint(user_message)
+    if text_hint:
+        model_hint = model_hint or text_hint
+        user_message = hinted_message or user_message
+
     # 🧵 GERAR THREAD_ID AUTOMATICAMENTE SE NÃO FORNECIDO (CHECKPOINT 1.2)
     if not thread_id:
-        thread_id = generate_thread_id()
+        thread_id = generate_thread_id(user_id or "default_user")
         print(f"[DEBUG] Generated new thread_id: {thread_id}")
     else:
         print(f"[DEBUG] Using provided thread_id: {thread_id}")
 
     # 🧵 GERAR MESSAGE_ID ÚNICO (CHECKPOINT 1.2)
     message_id = f"msg_{datetime.now().strftime('%H%M%S')}_{str(uuid.uuid4())[:8]}"
+    record_span("parse_input", parse_start, time.perf_counter())
+    trace.set(thread_id=thread_id, message_id=message_id, user_id=user_id or parse_user_id_from_thread_id(thread_id))
     
     print(f"[DEBUG] Wrapper processing: {user_message[:50]}... (thread: {thread_id[:20]}..., msg: {message_id})")
 
@@ -596,20 +1220,39 @@ def lina_api_wrapper(input_data: dict) -> dict:
         
         print(f"[DEBUG] LangGraph config: {config}")
         
-        # Estado inicial com HumanMessage (MessagesState format)
+        # Estado inicial com HumanMessage (MessagesState format); id explícito para poder desfazer o turno
+        human_message = HumanMessage(content=user_message, id=str(uuid.uuid4()))
         initial_state = {
-            "messages": [HumanMessage(content=user_message)],
+            "messages": [human_message],
             "thread_id": thread_id,
-            "current_step": "chat"
+            "user_id": user_id or parse_user_id_from_thread_id(thread_id),
+            "current_step": "chat",
+            "model_hint": model_hint
         }
         
         print(f"[DEBUG] Invoking StateGraph with thread_id: {thread_id}")
         
         # Executar grafo com checkpointing
-        result = conversation_graph.invoke(initial_state, config=config)
+        raise_if_cancelled("before_llm")
+        with timed("graph_total"), langsmith_tracing(trace):
+            result = conversation_graph.invoke(initial_state, config=config)
         
         print(f"[DEBUG] StateGraph execution successful")
         
+        # 📬 Título da thread gerado em background após o primeiro turno (nunca a partir de um "Erro: ...")
+        try:
+            meta = thread_metadata.record_turn(thread_id, user_id or parse_user_id_from_thread_id(thread_id))
+            turn_failed = bool((result.get("debug_info") or {}).get("error"))
+            if not turn_failed and (not meta.get("title") or meta["title"] == "Nova Conversa"):
+                final_ai = result.get("messages", [])[-1] if result.get("messages") else None
+                job_queue.enqueue("generate_title", {
+                    "thread_id": thread_id,
+                    "user_message": user_message,
+                    "assistant_message": getattr(final_ai, "content", "") if final_ai else "",
+                }, priority=1, dedupe_key=f"generate_title:{thread_id}")
+        except Exception as e:
+            print(f"[ERROR] Thread metadata error: {e}")
+        
         # Extrair resposta do estado final (MessagesState format)
         final_messages = result.get("messages", [])
         if final_messages and len(final_messages) > 0:
@@ -628,15 +1271,32 @@ def lina_api_wrapper(input_data: dict) -> dict:
         print(f"[DEBUG] Extracted output length: {len(output) if output else 0}")
         print(f"[DEBUG] Debug info keys: {list(debug_info_partial.keys()) if debug_info_partial else []}")
         
+    except RequestCancelled as e:
+        print(f"[DEBUG] Requisição cancelada ({e.reason}) em {e.stage}: desfazendo o turno")
+        trace_error = f"RequestCancelled: {e.reason}"
+        cancellation_stats.increment(f"cancelled_{e.stage}")
+        if rollback_cancelled_turn(config, human_message.id):
+            cancellation_stats.increment("turns_rolled_back")
+        output = ""
+        debug_info_partial = {
+            "cost": 0.0,
+            "tokens_used": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "model_name": "cancelled"
+        }
+        
     except Exception as e:
         print(f"[ERROR] StateGraph error: {e}")
+        trace_error = f"{type(e).__name__}: {e}"
         import traceback
         traceback.print_exc()
         
         print(f"[ERROR] Falling back to basic chain")
         # Fallback para chain básico se StateGraph falhar
         try:
-            result_from_chain = langserve_chain_core.invoke({"input": user_message})
+            with timed("fallback_chain"):
+                result_from_chain = langserve_chain_core.invoke({"input": user_message})
             output = result_from_chain["output"]
             debug_info_partial = result_from_chain["debug_info_partial"]
             print(f"[DEBUG] Fallback successful")
@@ -662,6 +1322,8 @@ def lina_api_wrapper(input_data: dict) -> dict:
             "completion_tokens": 0,
             "model_name": "unknown"
         }
+    # Falhas do provedor são capturadas no chat_node e só chegam aqui pelo debug_info
+    trace_error = trace_error or debug_info_partial.get("error")
 
     # 🧵 CHECKPOINT 1.2: Incluir thread_id, message_id e sequence no debug_info final
     # Calcular sequence baseado nas mensagens existentes no thread (futuro)
@@ -678,7 +1340,14 @@ def lina_api_wrapper(input_data: dict) -> dict:
         # 🧵 Thread metadata (CHECKPOINT 1.2)
         thread_id=thread_id,
         message_id=message_id,
-        message_sequence=message_sequence
+        message_sequence=message_sequence,
+        # 🚦 Espera na admissão (registrada pelo AdmissionMiddleware)
+        queue_wait=round(current_queue_wait(), 3),
+        enrichment=debug_info_partial.get("enrichment", {}),
+        # 🧭 Tier escolhido pelo roteador
+        model_tier=debug_info_partial.get("model_tier"),
+        routing_reason=debug_info_partial.get("routing_reason"),
+        error=trace_error
     )
 
     # Garantir que output é string limpa
@@ -686,17 +1355,29 @@ def lina_api_wrapper(input_data: dict) -> dict:
         output = str(output)
 
     # Criar resposta estruturada
-    chat_response_obj = ChatResponse(
-        output=output,
-        debug_info=final_debug_info
-    )
+    with timed("response_serialization"):
+        chat_response_obj = ChatResponse(
+            output=output,
+            debug_info=final_debug_info
+        )
+        response_dict = chat_response_obj.model_dump()
+    
+    # ⏱️ Quebra por etapa (a serialização acima já está incluída)
+    timings = timer.as_dict()
+    timings["total"] = round(timer.elapsed() * 1000, 2)
+    response_dict["debug_info"]["timings"] = timings
     
-    response_dict = chat_response_obj.model_dump()
+    # 🔭 Decisão de amostragem no fim (erros e lentas sempre entram); o envio é em background
+    trace.set(model_name=final_debug_info.model_name, model_tier=final_debug_info.model_tier, tokens_used=final_debug_info.tokens_used,
+              cost=final_debug_info.cost)
+    if tracer.finish_trace(trace, "lina_api_wrapper", error=trace_error):
+        response_dict["debug_info"]["trace_id"] = trace.trace_id
     
     # DEBUGGING FINAL
     print(f"[DEBUG] Response created - output length: {len(response_dict['output'])}")
     print(f"[DEBUG] Duration: {duration_seconds:.3f}s")
     print(f"[DEBUG] Tokens: {final_debug_info.tokens_used}")
+    print(f"[DEBUG] Timings (ms): {timings}")
     
     return response_dict
 
@@ -719,7 +1400,8 @@ async def test_endpoint(request: Request):
         print(f"[DEBUG] Test endpoint received: {data}")
         
         if "input" in data and isinstance(data["input"], str):
-            response_obj = lina_api_wrapper({"input": data["input"]})
+            # Wrapper bloqueante no threadpool: o event loop segue livre para o DisconnectMiddleware
+            response_obj = await run_in_threadpool(lina_api_wrapper, {"input": data["input"]})
             
             return {
                 "success": True, 
@@ -750,7 +1432,7 @@ if __name__ == "__main__":
     
     print("🚀 Iniciando Lina Backend CORRIGIDO...")
     print(f"🔑 OPENROUTER_API_KEY carregada: {'Sim' if os.getenv('OPENROUTER_API_KEY') else 'Não'}")
-    print(f"🛠️ LANGSMITH_TRACING: {os.getenv('LANGCHAIN_TRACING_V2')}")
+    print(f"🛠️ LANGSMITH_TRACING (amostrado): {LANGSMITH_DEEP_TRACING}")
     print(f"📍 Health check: http://localhost:8000/health")
     print("🧪 Test endpoint: POST http://localhost:8000/test")
     print("💬 Chat endpoint: POST http://localhost:8000/chat/invoke")
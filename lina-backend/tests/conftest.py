@@ -0,0 +1,71 @@
+"""
+Testes do backend com pytest (sem servidor e sem chamadas ao OpenRouter).
+
+    cd lina-backend && python -m pytest -q
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import time
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+
+class FakeLLM:
+    """Substitui `app.get_llm`: resposta fixa em chunks, ou erro do provedor"""
+
+    model_name = "fake/lina"
+
+    def __init__(self, reply: str = "Olá, eu sou a Lina!", error: Exception = None, chunk_delay: float = 0.0):
+        self.reply = reply
+        self.error = error
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self.models = []
+
+    def __call__(self, model_name=None, temperature=0.8):
+        self.models.append(model_name)
+        return self
+
+    def stream(self, prompt_value, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        for word in self.reply.split(" "):
+            time.sleep(self.chunk_delay)
+            yield AIMessageChunk(content=word + " ")
+
+
+@pytest.fixture(scope="session")
+def lina_app(tmp_path_factory):
+    """Importa o app uma vez, com todos os bancos num diretório temporário"""
+    data_dir = tmp_path_factory.mktemp("lina")
+    os.environ.update({
+        "OPENROUTER_API_KEY": "test",
+        "LINA_DB_PATH": str(data_dir / "lina_conversations.db"),
+        "LINA_TRACE_EXPORTER": "none",
+        "LINA_TRACE_SAMPLE_RATE": "0",
+        "LINA_TRACE_FLUSH_INTERVAL": "3600",  # traces ficam no buffer para inspeção
+        "LINA_PROFILE_DIR": str(data_dir / "profiles"),
+    })
+    import app
+
+    return app
+
+
+@pytest.fixture
+def fake_llm(lina_app, monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.setattr(lina_app, "get_llm", llm)
+    return llm
+
+
+@pytest.fixture
+def client(lina_app):
+    from fastapi.testclient import TestClient
+
+    return TestClient(lina_app.app)
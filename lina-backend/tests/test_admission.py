@@ -0,0 +1,116 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils.admission import AdmissionController, AdmissionMiddleware
+
+
+def make_client(controller: AdmissionController, model_resolver=None) -> TestClient:
+    app = FastAPI()
+
+    @app.post("/chat/invoke")
+    async def invoke():
+        return {"ok": True}
+
+    @app.post("/chat/batch")
+    async def batch():
+        return {"active": controller.stats()["active"]}
+
+    app.add_middleware(AdmissionMiddleware, controller=controller, paths=("/chat/invoke", "/chat/batch"),
+                       model_resolver=model_resolver, history_allowance=1000)
+    return TestClient(app)
+
+
+def test_token_bucket_exhausted_returns_429_with_retry_after():
+    # 60 tokens/min: a primeira requisição esvazia o bucket, a segunda precisaria esperar ~60s
+    controller = AdmissionController(queue_timeout=1.0, default_tokens_per_minute=60)
+    client = make_client(controller)
+
+    assert client.post("/chat/invoke", json={"input": {"input": "oi"}}).status_code == 200
+    response = client.post("/chat/invoke", json={"input": {"input": "oi"}})
+
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 55
+    assert response.json()["reason"].startswith("rate limit de tokens")
+    assert controller.stats()["rejected"] == 1
+
+
+def test_token_wait_does_not_hold_a_concurrency_slot():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, queue_timeout=5.0, default_tokens_per_minute=600)
+        ticket = await controller.acquire("a", "lento", 600)  # esvazia o bucket do modelo "lento"
+        await controller.release(ticket)
+        assert controller.stats()["active"] == 0
+
+        waiting = asyncio.create_task(controller.acquire("a", "lento", 30))  # ~3s esperando tokens
+        await asyncio.sleep(0.05)
+        assert controller.stats()["active"] == 0  # esperando tokens sem ocupar a única vaga
+
+        # Outro modelo com bucket cheio é admitido na hora
+        other = await asyncio.wait_for(controller.acquire("b", "rapido", 10), timeout=0.5)
+        await controller.release(other)
+        waiting.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_refunds_its_reservation():
+    async def scenario():
+        controller = AdmissionController(queue_timeout=60.0, default_tokens_per_minute=600)
+        ticket = await controller.acquire("a", "m", 600)
+        await controller.release(ticket)
+
+        waiting = asyncio.create_task(controller.acquire("a", "m", 300))
+        await asyncio.sleep(0.05)
+        assert controller.stats()["token_buckets"]["m"] < -250  # reserva a crédito
+        waiting.cancel()
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        assert controller.stats()["token_buckets"]["m"] > -10  # devolvida
+
+    asyncio.run(scenario())
+
+
+def test_batch_takes_one_slot_and_one_bucket_reservation_per_input():
+    controller = AdmissionController(max_concurrency=4, max_concurrency_per_user=3, default_tokens_per_minute=100000)
+    client = make_client(controller, model_resolver=lambda payload: payload.get("model_tier") or "standard")
+    inputs = [{"input": "oi", "user_id": "ana", "model_tier": "fast"},
+              {"input": "oi", "user_id": "ana", "model_tier": "deep"},
+              {"input": "oi", "user_id": "ana", "model_tier": "deep"}]
+
+    response = client.post("/chat/batch", json={"inputs": inputs})
+
+    assert response.status_code == 200
+    assert response.json()["active"] == 3
+    buckets = controller.stats()["token_buckets"]
+    assert 100000 - buckets["deep"] == 2 * (100000 - buckets["fast"]) > 0
+    assert controller.stats()["active"] == 0
+
+
+def test_batch_larger_than_the_user_limit_is_rejected_without_retry_after():
+    controller = AdmissionController(max_concurrency=8, max_concurrency_per_user=2)
+    client = make_client(controller)
+
+    response = client.post("/chat/batch", json={"inputs": [{"input": "oi", "user_id": "ana"}] * 3})
+
+    assert response.status_code == 413
+    assert "retry-after" not in response.headers
+    assert controller.stats()["token_buckets"] == {}
+
+
+def test_batch_waits_until_all_of_its_slots_are_free():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=2, max_concurrency_per_user=2, queue_timeout=5.0)
+        single = await controller.acquire("ana", "m", 10)
+        batch = asyncio.create_task(controller.acquire_many("bruno", [("m", 10), ("m", 10)]))
+        await asyncio.sleep(0.05)
+        assert not batch.done() and controller.stats()["active"] == 1
+        await controller.release(single)
+        ticket = await asyncio.wait_for(batch, timeout=1)
+        assert controller.stats()["active_by_user"] == {"bruno": 2}
+        await controller.release(ticket)
+
+    asyncio.run(scenario())
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import time
+import uuid
+
+
+def _chat(client, message, user_id=None, thread_id=None, headers=None):
+    payload = {"input": message}
+    if user_id:
+        payload["user_id"] = user_id
+    if thread_id:
+        payload["thread_id"] = thread_id
+    response = client.post("/chat/invoke", json={"input": payload}, headers=headers or {})
+    return response
+
+
+def _user():
+    return f"u{uuid.uuid4().hex[:8]}"
+
+
+def test_provider_error_swallowed_by_chat_node_is_traced(lina_app, client, fake_llm):
+    fake_llm.error = RuntimeError("provider down")
+    errors_before = lina_app.tracer.sampled["error"]
+
+    debug_info = _chat(client, "oi", user_id=_user()).json()["output"]["debug_info"]
+
+    assert lina_app.tracer.sample_rate == 0
+    assert lina_app.tracer.sampled["error"] == errors_before + 1
+    [record] = [r for r in lina_app.tracer.buffer if r["trace_id"] == debug_info["trace_id"]]
+    assert record["sample_reason"] == "error"
+    assert record["error"] == "provider down"
+
+
+def test_idempotent_retry_replays_the_stored_response(client, fake_llm):
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    user_id = _user()
+    first = _chat(client, "oi", user_id=user_id, headers=headers).json()["output"]
+    second = _chat(client, "oi", user_id=user_id, headers=headers).json()["output"]
+
+    assert fake_llm.calls == 1
+    assert second["output"] == first["output"]
+    assert second["debug_info"]["message_id"] == first["debug_info"]["message_id"]
+    assert (first["debug_info"]["idempotent_replay"], second["debug_info"]["idempotent_replay"]) == (False, True)
+
+
+def test_idempotency_key_reused_with_another_payload_is_a_conflict(client, fake_llm):
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    user_id = _user()
+    assert _chat(client, "oi", user_id=user_id, headers=headers).status_code == 200
+
+    response = _chat(client, "outra mensagem", user_id=user_id, headers=headers)
+    assert response.status_code == 409
+    assert fake_llm.calls == 1
+
+
+def test_failed_turn_is_not_replayed_on_retry(client, fake_llm):
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    user_id = _user()
+    fake_llm.error = RuntimeError("provider down")
+    failed = _chat(client, "oi", user_id=user_id, headers=headers).json()["output"]
+    assert failed["output"].startswith("Erro:")
+    assert (failed["debug_info"]["model_name"], failed["debug_info"]["error"]) == ("error", "provider down")
+
+    fake_llm.error = None
+    retried = _chat(client, "oi", user_id=user_id, headers=headers).json()["output"]
+    assert fake_llm.calls == 2
+    assert retried["debug_info"]["idempotent_replay"] is False
+    assert retried["debug_info"]["error"] is None
+    assert retried["output"].strip() == fake_llm.reply
+
+
+def _post_then_disconnect(lina_app, payload, disconnect_when, path="/chat/invoke"):
+    """POST direto no ASGI; o cliente desconecta quando `disconnect_when()` for verdadeiro"""
+    body = json.dumps({"input": payload}).encode()
+    scope = {
+        "type": "http", "method": "POST", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "headers": [(b"content-type", b"application/json")],
+        "http_version": "1.1", "scheme": "http", "server": ("test", 80), "client": ("test", 1), "root_path": "",
+    }
+
+    async def run():
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            deadline = time.monotonic() + 5
+            while not disconnect_when() and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        await lina_app.app(scope, receive, send)
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    return time.perf_counter() - started
+
+
+def _indexed_ids(lina_app, thread_id):
+    with lina_app.search_index._lock:
+        rows = lina_app.search_index.conn.execute(
+            "SELECT message_id FROM message_fts_ids WHERE thread_id = ?", (thread_id,)
+        ).fetchall()
+    return {row[0] for row in rows}
+
+
+def test_disconnect_mid_stream_rolls_back_checkpoint_and_search_index(lina_app, client, fake_llm):
+    user_id = _user()
+    thread_id = lina_app.generate_thread_id(user_id)
+    config = {"configurable": {"thread_id": thread_id}}
+    _chat(client, "oi", thread_id=thread_id)
+    before = lina_app.conversation_graph.get_state(config).values
+    lina_app.search_index.index_thread(lina_app.checkpointer, thread_id)
+    assert len(before["messages"]) == 2 and _indexed_ids(lina_app, thread_id) == {m.id for m in before["messages"]}
+
+    fake_llm.reply = " ".join(["palavra"] * 500)
+    fake_llm.chunk_delay = 0.02
+    rolled_back = lina_app.cancellation_stats.stats()["turns_rolled_back"]
+
+    def question_indexed_and_streaming():
+        # Só desconecta depois que a pergunta entrou no checkpoint e no índice de busca
+        return fake_llm.calls == 2 and len(_indexed_ids(lina_app, thread_id)) == 3
+
+    elapsed = _post_then_disconnect(lina_app, {"input": "/detalhado planeje minha semana", "thread_id": thread_id},
+                                    question_indexed_and_streaming)
+
+    assert elapsed < 5  # 500 chunks x 20ms levariam 10s
+    assert lina_app.cancellation_stats.stats()["turns_rolled_back"] == rolled_back + 1
+    after = lina_app.conversation_graph.get_state(config).values
+    assert [m.id for m in after["messages"]] == [m.id for m in before["messages"]]
+    assert after["routing"] == before["routing"] and after["routing"]["tier"] != "deep"
+    assert _indexed_ids(lina_app, thread_id) == {m.id for m in before["messages"]}
+    assert lina_app.search_index.search("semana", thread_id=thread_id)[1] == 0
+
+
+def test_disconnect_before_the_first_token_stops_waiting_for_the_provider(lina_app, fake_llm):
+    thread_id = lina_app.generate_thread_id(_user())
+    fake_llm.chunk_delay = 10  # provedor demorando para começar a responder
+    cancelled = lina_app.cancellation_stats.stats()["cancelled_during_llm"]
+
+    elapsed = _post_then_disconnect(lina_app, {"input": "oi", "thread_id": thread_id}, lambda: fake_llm.calls == 1)
+
+    assert elapsed < 5
+    assert lina_app.cancellation_stats.stats()["cancelled_during_llm"] == cancelled + 1
+    state = lina_app.conversation_graph.get_state({"configurable": {"thread_id": thread_id}})
+    assert not state.values.get("messages")
+
+
+def test_disconnect_on_test_endpoint_cancels_the_wrapper(lina_app, fake_llm):
+    fake_llm.chunk_delay = 10
+    cancelled = lina_app.cancellation_stats.stats()["cancelled_during_llm"]
+
+    # /test recebe {"input": "string"}; o wrapper roda no threadpool e o watcher vê a desconexão
+    elapsed = _post_then_disconnect(lina_app, "oi", lambda: fake_llm.calls == 1, path="/test")
+
+    assert elapsed < 5
+    assert lina_app.cancellation_stats.stats()["cancelled_during_llm"] == cancelled + 1
+
+def test_route_and_enrich_share_one_superstep(lina_app, client, fake_llm):
+    thread_id = lina_app.generate_thread_id(_user())
+    assert _chat(client, "oi", thread_id=thread_id).status_code == 200
+
+    # Além do checkpoint de entrada: início, (route + enrich) e chat
+    history = list(lina_app.conversation_graph.get_state_history({"configurable": {"thread_id": thread_id}}))
+    assert [h.metadata["source"] for h in history] == ["loop", "loop", "loop", "input"]
+    assert set(history[2].next) == {"route", "enrich"}
+    state = history[0].values
+    assert state["routing"]["tier"] and "memory" in state["enrichment_report"]
+
+def test_timings_break_down_the_turn_including_graph_worker_threads(client, fake_llm):
+    fake_llm.chunk_delay = 0.01
+    debug_info = _chat(client, "oi", user_id=_user()).json()["output"]["debug_info"]
+    timings = debug_info["timings"]
+
+    # Spans do wrapper e dos nós/checkpointer, que rodam nas threads do StateGraph
+    for name in ("parse_input", "graph_total", "routing", "prompt_build", "llm_ttfb", "llm_generation",
+                 "checkpoint_load", "checkpoint_write", "response_serialization", "total"):
+        assert name in timings, name
+    assert all(value >= 0 for value in timings.values())
+    assert timings["llm_ttfb"] >= 10 * 0.9  # primeiro chunk chega depois de 10ms
+    assert timings["llm_ttfb"] + timings["llm_generation"] <= timings["graph_total"] <= timings["total"]
+
+
+def test_history_window_only_drops_messages_already_in_memory(lina_app):
+    from langchain_core.messages import HumanMessage
+
+    assert lina_app.conversation_memory is not None
+    window = lina_app.MEMORY_HISTORY_WINDOW
+    thread_id = lina_app.generate_thread_id(_user())
+    messages = [HumanMessage(f"mensagem {i}", id=f"{thread_id}-{i}") for i in range(window + 8)]
+
+    assert lina_app.history_window(messages) == messages  # thread antiga, nada indexado ainda
+
+    lina_app.conversation_memory.add_messages(thread_id, None, [
+        {"message_id": m.id, "role": "user", "text": m.content} for m in messages[:5]
+    ])
+    assert lina_app.history_window(messages) == messages[5:]
+    assert lina_app.history_window(messages, memory_available=False) == messages
+
+
+def test_search_requires_user_id_and_only_returns_that_users_messages(lina_app, client, fake_llm):
+    ana, bruno = _user(), _user()
+    for user_id in (ana, bruno):
+        thread_id = lina_app.generate_thread_id(user_id)
+        _chat(client, "quero uma receita de pamonha", thread_id=thread_id)
+        lina_app.search_index.index_thread(lina_app.checkpointer, thread_id)
+
+    assert client.get("/chat/search", params={"q": "pamonha"}).status_code == 422
+    response = client.get("/chat/search", params={"q": "pamonha", "user_id": ana}).json()
+    assert response["success"] and response["total"] == 1
+    assert {r["thread_id"].split("_")[1] for r in response["results"]} == {ana}
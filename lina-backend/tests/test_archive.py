@@ -0,0 +1,94 @@
+import json
+import sqlite3
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.archive import ThreadArchiver
+from utils.backup import _build_restore_graph, backup_databases, export_sources, iter_export_records
+from utils.checkpointing import LinaSqliteSaver
+from utils.threads import ThreadMetadataStore
+
+THREAD_ID = "thread_ana_1a2b3c4d"
+MESSAGES = [HumanMessage("oi", id="h1"), AIMessage("olá ana", id="a1")]
+
+
+def _archived_thread(tmp_path):
+    db_path = str(tmp_path / "conv.db")
+    graph = _build_restore_graph(db_path)
+    graph.update_state({"configurable": {"thread_id": THREAD_ID}}, {"messages": MESSAGES}, as_node="chat")
+    archiver = ThreadArchiver(db_path, str(tmp_path / "lina_archive.db"), ThreadMetadataStore(db_path))
+    assert archiver.archive_thread(THREAD_ID)
+    return db_path, archiver
+
+
+def _hot_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT count(*) FROM checkpoints WHERE thread_id = ?", (THREAD_ID,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_archive_then_rehydrate_round_trip(tmp_path):
+    db_path, archiver = _archived_thread(tmp_path)
+    assert _hot_rows(db_path) == 0
+    assert archiver.stats()["archived_threads"] == 1
+
+    saver = LinaSqliteSaver(sqlite3.connect(db_path, check_same_thread=False))
+    saver.archiver = archiver
+    restored = saver.get_tuple({"configurable": {"thread_id": THREAD_ID, "checkpoint_ns": ""}})
+    messages = restored.checkpoint["channel_values"]["messages"]
+    assert [(m.id, m.content) for m in messages] == [(m.id, m.content) for m in MESSAGES]
+    assert not archiver.is_archived(THREAD_ID)
+    assert archiver.stats()["archived_threads"] == 0
+    assert _hot_rows(db_path) > 0
+
+
+def test_thread_archived_by_another_process_is_rehydrated(tmp_path):
+    db_path = str(tmp_path / "conv.db")
+    archive_path = str(tmp_path / "lina_archive.db")
+    graph = _build_restore_graph(db_path)
+    graph.update_state({"configurable": {"thread_id": THREAD_ID}}, {"messages": MESSAGES}, as_node="chat")
+
+    # O serviço sobe antes; a CLI (outro processo) arquiva a thread depois
+    service = ThreadArchiver(db_path, archive_path, ThreadMetadataStore(db_path))
+    cli = ThreadArchiver(db_path, archive_path, ThreadMetadataStore(db_path))
+    assert cli.archive_thread(THREAD_ID)
+    assert not service.is_archived(THREAD_ID)  # cache do serviço não sabe do arquivamento
+
+    saver = LinaSqliteSaver(sqlite3.connect(db_path, check_same_thread=False))
+    saver.archiver = service
+    config = {"configurable": {"thread_id": THREAD_ID, "checkpoint_ns": ""}}
+    restored = saver.get_tuple(config)
+    messages = restored.checkpoint["channel_values"]["messages"]
+    assert [(m.id, m.content) for m in messages] == [(m.id, m.content) for m in MESSAGES]
+    assert _hot_rows(db_path) > 0
+    assert service.stats()["archived_threads"] == 0
+
+    # O mesmo vale para list()
+    checkpoints = _hot_rows(db_path)
+    assert cli.archive_thread(THREAD_ID)
+    assert len(list(saver.list(config))) == checkpoints
+    assert _hot_rows(db_path) == checkpoints
+
+def test_export_reads_archived_threads_without_rehydrating(tmp_path):
+    db_path, archiver = _archived_thread(tmp_path)
+
+    records = list(iter_export_records(export_sources([db_path], [archiver.archive_path])))
+    threads = [r for r in records if r["type"] == "thread"]
+    assert [(t["thread_id"], t["archived"], t["message_count"]) for t in threads] == [(THREAD_ID, True, 2)]
+    assert [r["message"]["data"]["content"] for r in records if r["type"] == "message"] == ["oi", "olá ana"]
+    json.dumps(records)  # serializável como NDJSON
+
+    assert archiver.stats()["archived_threads"] == 1
+    assert _hot_rows(db_path) == 0
+
+
+def test_backup_copies_the_archive_with_the_main_database(tmp_path):
+    db_path, archiver = _archived_thread(tmp_path)
+    results = backup_databases([db_path, archiver.archive_path, str(tmp_path / "faltando.db")], str(tmp_path / "bkp"))
+    assert sorted(r["dest_path"] for r in results) == sorted(
+        [str(tmp_path / "bkp" / "conv.db"), str(tmp_path / "bkp" / "lina_archive.db")]
+    )
+    records = list(iter_export_records(export_sources([], [str(tmp_path / "bkp" / "lina_archive.db")])))
+    assert [r["thread_id"] for r in records if r["type"] == "thread"] == [THREAD_ID]
@@ -0,0 +1,53 @@
+import io
+import sqlite3
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.backup import _build_restore_graph, export_sources, import_ndjson, iter_export_lines, online_backup
+
+
+def test_online_backup_finishes_while_another_connection_keeps_writing(tmp_path):
+    src_path = str(tmp_path / "conv.db")
+    conn = sqlite3.connect(src_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, payload BLOB)")
+    conn.executemany("INSERT INTO t (payload) VALUES (?)", [(b"x" * 4000,)] * 2000)
+    conn.commit()
+
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            conn.execute("INSERT INTO t (payload) VALUES (?)", (b"y" * 100,))
+            conn.commit()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        result = online_backup(src_path, str(tmp_path / "backup.db"))
+    finally:
+        stop.set()
+        thread.join()
+
+    copy = sqlite3.connect(result["dest_path"])
+    assert copy.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    assert copy.execute("SELECT count(*) FROM t").fetchone()[0] >= 2000
+
+
+def test_export_then_import_round_trip(tmp_path):
+    source = _build_restore_graph(str(tmp_path / "source.db"))
+    threads = {
+        "thread_ana_1a2b3c4d": [HumanMessage("oi", id="h1"), AIMessage("olá ana", id="a1")],
+        "thread_bruno_5e6f7a8b": [HumanMessage("planeje meu dia", id="h2"), AIMessage("claro", id="a2")],
+    }
+    for thread_id, messages in threads.items():
+        source.update_state({"configurable": {"thread_id": thread_id}}, {"messages": messages}, as_node="chat")
+
+    exported = "".join(iter_export_lines(export_sources([str(tmp_path / "source.db")])))
+
+    target = _build_restore_graph(str(tmp_path / "target.db"))
+    assert import_ndjson(io.StringIO(exported), target) == {"threads": 2, "messages": 4}
+    for thread_id, messages in threads.items():
+        restored = target.get_state({"configurable": {"thread_id": thread_id}}).values["messages"]
+        assert [(m.id, m.type, m.content) for m in restored] == [(m.id, m.type, m.content) for m in messages]
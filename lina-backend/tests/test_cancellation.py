@@ -0,0 +1,41 @@
+import threading
+import time
+
+import pytest
+
+from utils.cancellation import CancelToken, RequestCancelled, iter_until_cancelled
+
+
+def test_cancel_while_waiting_for_a_chunk_raises_and_closes_the_stream():
+    closed = threading.Event()
+
+    def slow_stream():
+        try:
+            time.sleep(0.3)  # provedor ainda não mandou nada
+            yield "primeiro"
+            yield "segundo"
+        finally:
+            closed.set()
+
+    token = CancelToken()
+    threading.Timer(0.05, token.cancel, args=("client_disconnect",)).start()
+    started = time.perf_counter()
+    with pytest.raises(RequestCancelled) as info:
+        list(iter_until_cancelled(slow_stream(), token))
+
+    assert time.perf_counter() - started < 0.25
+    assert (info.value.reason, info.value.stage) == ("client_disconnect", "during_llm")
+    assert closed.wait(2)
+
+
+def test_provider_errors_and_items_pass_through():
+    def failing_stream():
+        yield "a"
+        raise RuntimeError("provider down")
+
+    received = []
+    with pytest.raises(RuntimeError, match="provider down"):
+        for item in iter_until_cancelled(failing_stream(), CancelToken()):
+            received.append(item)
+    assert received == ["a"]
+    assert list(iter_until_cancelled((item for item in ["x", "y"]), None)) == ["x", "y"]
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from utils.enrichment import EnrichmentStage
+from utils.timing import start_request_timer
+
+
+def test_results_are_merged_and_each_enricher_gets_a_span():
+    stage = EnrichmentStage(max_workers=2)
+
+    @stage.register("memory", timeout=1.0)
+    def memory(state):
+        return {"context": f"trechos para {state['user_id']}"}
+
+    @stage.register("profile", timeout=1.0)
+    def profile(state):
+        return None
+
+    timer = start_request_timer()
+    update = stage.run({"user_id": "ana"})
+
+    assert update["enrichment"] == {"memory": {"context": "trechos para ana"}, "profile": {}}
+    assert {name: entry["status"] for name, entry in update["enrichment_report"].items()} == {
+        "memory": "ok", "profile": "ok"
+    }
+    assert {name for name, _, _ in timer.spans} == {"enrich:memory", "enrich:profile"}
+
+
+def test_slow_enricher_is_skipped_and_errors_are_reported():
+    stage = EnrichmentStage(max_workers=2)
+    release = threading.Event()
+
+    @stage.register("slow", timeout=0.1)
+    def slow(state):
+        release.wait(5)
+        return {"late": True}
+
+    @stage.register("broken", timeout=1.0)
+    def broken(state):
+        raise RuntimeError("boom")
+
+    started = time.perf_counter()
+    update = stage.run({})
+    release.set()
+
+    assert time.perf_counter() - started < 1.0
+    assert update["enrichment"] == {}
+    report = update["enrichment_report"]
+    assert (report["slow"]["status"], report["broken"]["status"]) == ("timeout", "error")
+    assert report["slow"]["ms"] >= 100 * 0.9
+
+
+def test_runaway_enricher_does_not_starve_the_others():
+    stage = EnrichmentStage(max_workers=2)
+    release = threading.Event()
+
+    @stage.register("slow", timeout=0.05)
+    def slow(state):
+        release.wait(5)
+        return {}
+
+    @stage.register("fast", timeout=0.5)
+    def fast(state):
+        time.sleep(0.01)
+        return {"ok": True}
+
+    try:
+        statuses = []
+        for _ in range(4):
+            report = stage.run({})["enrichment_report"]
+            statuses.append((report["slow"]["status"], report["fast"]["status"]))
+    finally:
+        release.set()
+
+    # As chamadas presas do "slow" ocupam só o pool dele; depois de 2 ele é pulado sem espera
+    assert statuses == [("timeout", "ok"), ("timeout", "ok"), ("busy", "ok"), ("busy", "ok")]
+
+
+def test_each_enricher_reports_its_own_run_time():
+    stage = EnrichmentStage(max_workers=1)
+
+    @stage.register("slow", timeout=1.0)
+    def slow(state):
+        time.sleep(0.3)
+        return {}
+
+    @stage.register("quick", timeout=2.0)
+    def quick(state):
+        time.sleep(0.02)
+        return {}
+
+    # "quick" só é conferido depois de "slow" (prazo maior), mas já tinha terminado
+    report = stage.run({})["enrichment_report"]
+    assert report["slow"]["ms"] >= 300 * 0.9
+    assert report["quick"]["ms"] < 150
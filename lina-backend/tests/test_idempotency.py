@@ -0,0 +1,21 @@
+import asyncio
+
+from utils.idempotency import IdempotencyKeyMiddleware, current_idempotency_key
+
+
+def test_middleware_restores_the_key_after_the_request():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(current_idempotency_key())
+
+    middleware = IdempotencyKeyMiddleware(app)
+
+    async def run():
+        await middleware({"type": "http", "path": "/chat/invoke", "headers": [(b"idempotency-key", b"k1")]}, None, None)
+        after_first = current_idempotency_key()
+        await middleware({"type": "http", "path": "/chat/invoke", "headers": []}, None, None)
+        return after_first
+
+    assert asyncio.run(run()) is None
+    assert seen == ["k1", None]
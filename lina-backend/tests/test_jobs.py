@@ -0,0 +1,126 @@
+import threading
+import time
+
+from utils.jobs import JobQueue
+
+
+def job_row(queue, job_id):
+    return queue.conn.execute(
+        "SELECT status, attempts, run_after, last_error, locked_by FROM lina_jobs WHERE id = ?", (job_id,)
+    ).fetchone()
+
+
+def make_ready(queue, job_id):
+    """Simula a passagem do tempo até o fim do backoff"""
+    queue.conn.execute("UPDATE lina_jobs SET run_after = 0 WHERE id = ?", (job_id,))
+
+
+def test_failed_job_is_retried_with_exponential_backoff_then_marked_failed(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    calls = []
+
+    @queue.register("flaky", max_attempts=3, backoff=4.0)
+    def flaky(payload):
+        calls.append(payload["n"])
+        raise RuntimeError("provedor fora")
+
+    job_id = queue.enqueue("flaky", {"n": 1})
+
+    before = time.time()
+    assert queue.run_one()
+    status, attempts, run_after, error, _ = job_row(queue, job_id)
+    assert (status, attempts, error) == ("pending", 1, "provedor fora")
+    assert 4.0 <= run_after - before < 5.0  # backoff ** 1
+    assert not queue.run_one()  # ainda dentro do backoff
+
+    make_ready(queue, job_id)
+    before = time.time()
+    assert queue.run_one()
+    status, attempts, run_after, _, _ = job_row(queue, job_id)
+    assert (status, attempts) == ("pending", 2)
+    assert 16.0 <= run_after - before < 17.0  # backoff ** 2
+
+    make_ready(queue, job_id)
+    assert queue.run_one()
+    assert job_row(queue, job_id)[:2] == ("failed", 3)
+    assert calls == [1, 1, 1]
+    assert queue.stats()["retried"] == 2 and queue.stats()["failed"] == 1
+
+
+def test_dedupe_key_reuses_the_pending_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    first = queue.enqueue("index_search", {"thread_id": "t"}, dedupe_key="index_search:t")
+    assert queue.enqueue("index_search", {"thread_id": "t"}, dedupe_key="index_search:t") == first
+
+
+def test_running_job_of_a_live_worker_is_not_rerun_by_another_process(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    owner = JobQueue(db_path, lease_seconds=60)
+    other = JobQueue(db_path, lease_seconds=60)
+    started, release = threading.Event(), threading.Event()
+    runs = []
+
+    def slow(payload):
+        runs.append(threading.current_thread().name)
+        started.set()
+        release.wait(5)
+
+    for queue in (owner, other):
+        queue.register("slow")(slow)
+
+    job_id = owner.enqueue("slow", {})
+    worker = threading.Thread(target=owner.run_one, name="owner")
+    worker.start()
+    assert started.wait(5)
+
+    other.start()  # inicialização de outro processo não rouba o job em andamento
+    try:
+        assert not other.run_one()
+        assert job_row(other, job_id)[0] == "running"
+    finally:
+        other.stop()
+        release.set()
+        worker.join()
+    assert job_row(owner, job_id)[0] == "done"
+    assert runs == ["owner"]
+
+
+def test_job_with_expired_lease_is_taken_over(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    crashed = JobQueue(db_path, lease_seconds=60)
+    survivor = JobQueue(db_path, lease_seconds=60)
+    done = []
+    survivor.register("title")(lambda payload: done.append(payload["thread_id"]))
+
+    job_id = crashed.enqueue("title", {"thread_id": "t1"})
+    assert crashed._claim()[0] == job_id  # processo morre logo depois de pegar o job
+    assert not survivor.run_one()  # lease ainda válido
+
+    survivor.conn.execute("UPDATE lina_jobs SET locked_until = ? WHERE id = ?", (time.time() - 1, job_id))
+    assert survivor.run_one()
+    status, attempts, _, _, locked_by = job_row(survivor, job_id)
+    assert (status, attempts, locked_by) == ("done", 2, None)
+    assert done == ["t1"]
+
+    # O processo antigo "volta" e tenta fechar o job: não sobrescreve o resultado
+    crashed._finish(job_id, "failed", "tarde demais")
+    assert job_row(survivor, job_id)[0] == "done"
+
+
+def test_expired_lease_without_attempts_left_is_marked_failed(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    queue = JobQueue(db_path, lease_seconds=60)
+    done = []
+    queue.register("poison", max_attempts=2)(lambda payload: done.append(payload))
+
+    job_id = queue.enqueue("poison", {"n": 1})
+    for _ in range(2):  # o job derruba o worker nas duas tentativas
+        assert queue._claim()[0] == job_id
+        queue.conn.execute("UPDATE lina_jobs SET locked_until = ? WHERE id = ?", (time.time() - 1, job_id))
+
+    assert not queue.run_one()
+    status, attempts, _, last_error, locked_by = job_row(queue, job_id)
+    assert (status, attempts, locked_by) == ("failed", 2, None)
+    assert "lease expirado" in last_error
+    assert done == []
+    assert queue.failed == 1
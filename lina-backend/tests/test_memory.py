@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils import memory as memory_module
+from utils.backup import _build_restore_graph
+from utils.memory import ConversationMemory, HashingEmbedder, VectorIndex
+
+
+@pytest.fixture
+def embedder():
+    return HashingEmbedder(dim=256)
+
+
+def _memory(tmp_path, embedder, min_score=0.1):
+    return ConversationMemory(VectorIndex(str(tmp_path / "lina_memory"), embedder.dim), embedder, min_score=min_score)
+
+
+def test_hashing_embedder_is_deterministic_normalized_and_lexical(embedder):
+    vectors = embedder.embed(["receita de bolo de cenoura", "bolo de cenoura com chocolate", "horário do trem", ""])
+    assert vectors.dtype == np.float32 and vectors.shape == (4, 256)
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1.0) and not vectors[3].any()
+    assert np.array_equal(vectors, HashingEmbedder(dim=256).embed(
+        ["receita de bolo de cenoura", "bolo de cenoura com chocolate", "horário do trem", ""]))
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+def test_vector_index_appends_and_reloads(tmp_path, embedder):
+    index = VectorIndex(str(tmp_path / "idx"), embedder.dim)
+    index.add(embedder.embed(["um", "dois"]), [{"message_id": "m1"}, {"message_id": "m2"}])
+    index.add(embedder.embed(["três"]), [{"message_id": "m3"}])
+
+    reloaded = VectorIndex(str(tmp_path / "idx"), embedder.dim)
+    assert len(reloaded) == 3 and reloaded.message_ids() == {"m1", "m2", "m3"}
+    [hit] = reloaded.search(embedder.embed(["três"])[0], k=1)
+    assert hit["message_id"] == "m3" and hit["score"] == pytest.approx(1.0, abs=1e-4)
+
+
+@pytest.mark.parametrize("truncate", ["vectors", "metadata"])
+def test_vector_index_keeps_only_rows_present_in_both_files(tmp_path, embedder, truncate):
+    index = VectorIndex(str(tmp_path / "idx"), embedder.dim)
+    index.add(embedder.embed(["um", "dois", "três"]), [{"message_id": f"m{i}"} for i in range(3)])
+    if truncate == "vectors":
+        # Escrita interrompida no meio da terceira linha
+        with open(index.vectors_path, "r+b") as f:
+            f.truncate(os.path.getsize(index.vectors_path) - 10)
+    else:
+        with open(index.meta_path, encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(index.meta_path, "w", encoding="utf-8") as f:
+            f.writelines(lines[:2])
+
+    reloaded = VectorIndex(str(tmp_path / "idx"), embedder.dim)
+    assert reloaded.message_ids() == {"m0", "m1"}
+    assert {hit["message_id"] for hit in reloaded.search(embedder.embed(["três"])[0], k=3)} <= {"m0", "m1"}
+
+
+def test_retrieve_scopes_to_the_user_and_skips_excluded_messages(tmp_path, embedder):
+    memory = _memory(tmp_path, embedder)
+    memory.add_messages("thread_ana_1", "ana", [{"message_id": "a1", "role": "user", "text": "meu gato se chama Tom"},
+                                                {"message_id": "a2", "role": "user", "text": "o gato Tom gosta de peixe"}])
+    memory.add_messages("thread_bruno_1", "bruno", [{"message_id": "b1", "role": "user", "text": "meu gato se chama Rex"}])
+
+    assert [s["message_id"] for s in memory.retrieve("como se chama meu gato", user_id="ana")] == ["a1", "a2"]
+    assert [s["message_id"] for s in memory.retrieve("como se chama meu gato", user_id="ana",
+                                                      exclude_message_ids=["a1"])] == ["a2"]
+    assert memory.retrieve("previsão do tempo amanhã", user_id="ana") == []  # abaixo do min_score
+    assert memory.add_messages("thread_ana_1", "ana", [{"message_id": "a1", "text": "meu gato se chama Tom"}]) == 0
+
+
+def test_retrieve_without_user_id_only_sees_its_own_thread(tmp_path, embedder):
+    memory = _memory(tmp_path, embedder)
+    memory.add_messages("conversa-livre-1", None, [{"message_id": "x1", "text": "minha senha do wifi é abacaxi"}])
+    memory.add_messages("conversa-livre-2", None, [{"message_id": "y1", "text": "a senha do wifi do escritório"}])
+
+    assert [s["message_id"] for s in memory.retrieve("senha do wifi", thread_id="conversa-livre-2")] == ["y1"]
+    assert memory.retrieve("senha do wifi") == []
+
+
+def test_backfill_cli_indexes_existing_threads_once(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "lina_conversations.db")
+    graph = _build_restore_graph(db_path)
+    graph.update_state({"configurable": {"thread_id": "thread_ana_1a2b3c4d"}},
+                       {"messages": [HumanMessage("meu gato se chama Tom", id="h1"), AIMessage("que nome lindo", id="a1")]},
+                       as_node="chat")
+
+    monkeypatch.delenv("LINA_MEMORY_EMBEDDER", raising=False)
+    memory_module.main(["backfill", "--db", db_path, "--dim", "256"])
+    memory_module.main(["backfill", "--db", db_path, "--dim", "256"])
+
+    memory = _memory(tmp_path, HashingEmbedder(dim=256))
+    assert len(memory.index) == 2
+    [hit] = memory.retrieve("gato Tom", user_id="ana", k=1)
+    assert (hit["message_id"], hit["role"], hit["thread_id"]) == ("h1", "user", "thread_ana_1a2b3c4d")
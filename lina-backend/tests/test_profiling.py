@@ -0,0 +1,35 @@
+import os
+import threading
+
+from utils import profiling
+from utils.profiling import ProfileSession
+
+
+def busy():
+    return sum(i * i for i in range(20000))
+
+
+def test_single_profiler_mode_keeps_one_cprofile_and_samples_other_threads(tmp_path, monkeypatch):
+    # Simula o Python 3.12+: só um cProfile ativo por processo
+    monkeypatch.setattr(profiling, "_SINGLE_PROFILER", True)
+    session = ProfileSession(str(tmp_path), sample_interval=0.001)
+    session.start()
+
+    def node():
+        with session.profile_current_thread():
+            busy()
+
+    with session.profile_current_thread():
+        worker = threading.Thread(target=node)
+        worker.start()
+        worker.join()
+        busy()
+
+    artifact_id = session.stop_and_write()
+
+    assert len(session.profiles) == 1  # a thread do nó ficou só com o sampler, sem ValueError
+    assert os.path.exists(os.path.join(str(tmp_path), artifact_id + ".pstats"))
+    assert os.path.exists(os.path.join(str(tmp_path), artifact_id + ".collapsed"))
+    # A vaga do profiler foi liberada para a próxima requisição
+    assert profiling._active_profiler_lock.acquire(blocking=False)
+    profiling._active_profiler_lock.release()
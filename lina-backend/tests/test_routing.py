@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from utils.routing import ModelRouter, load_tiers_config
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "config", "model_tiers.json")
+DEFAULT_MODEL = "google/gemini-2.5-flash-preview-05-20"
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(load_tiers_config(CONFIG_PATH), default_model=DEFAULT_MODEL)
+
+
+@pytest.mark.parametrize("text, history_size, tier", [
+    ("oi", 0, "fast"),
+    ("ok, valeu", 100, "fast"),
+    ("Me conta um pouco sobre a história do café no Brasil e como ele chegou a ser tão importante "
+     "para a economia do país durante o século XIX, e também quais regiões mais produziam na época, por favor.",
+     0, "standard"),
+    ("Pode montar um plano passo a passo para minha semana?", 0, "standard"),
+    ("Me ajude a planejar a arquitetura do meu projeto, passo a passo", 40, "deep"),
+    ("Por que isso falha?\n```python\ndef soma(a, b):\n    return a + b\n```", 0, "deep"),
+])
+def test_score_picks_tier_by_complexity(router, text, history_size, tier):
+    decision = router.route(text, history_size)
+    assert decision["tier"] == tier, decision["reason"]
+
+
+def test_deep_tier_is_never_weaker_than_the_default_model(router):
+    assert router.model_for("standard") == DEFAULT_MODEL
+    assert router.model_for("deep") == DEFAULT_MODEL
+    assert router.route("/detalhado oi", hint="deep")["model"] == DEFAULT_MODEL
+
+
+def test_precedence_is_override_then_hint_then_score(router):
+    planning = "Me ajude a planejar a arquitetura do meu projeto, passo a passo"
+    assert router.route("oi", hint="deep")["tier"] == "deep"
+    assert router.route(planning, hint="fast")["tier"] == "fast"
+    assert router.route(planning, hint="fast", override="standard")["tier"] == "standard"
+    assert router.route("oi", hint="inexistente", override="inexistente")["tier"] == "fast"
+    assert router.stats()["sources"] == {"override": 1, "hint": 2, "score": 1, "disabled": 0}
+
+
+def test_extract_hint_strips_the_longest_matching_prefix(router):
+    assert router.extract_hint("/detalhado  planeje minha semana") == ("deep", "planeje minha semana")
+    assert router.extract_hint("/padrão oi") == ("standard", "oi")
+    assert router.extract_hint("/rapidoxyz oi") == (None, "/rapidoxyz oi")
+    assert router.extract_hint("oi /detalhado") == (None, "oi /detalhado")
+
+
+def test_disabled_router_always_uses_the_default_tier():
+    router = ModelRouter(load_tiers_config(CONFIG_PATH), default_model=DEFAULT_MODEL, enabled=False)
+    decision = router.route("oi", hint="deep", override="fast")
+    assert (decision["tier"], decision["model"]) == ("standard", DEFAULT_MODEL)
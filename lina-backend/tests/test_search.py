@@ -0,0 +1,79 @@
+import sqlite3
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, MessagesState, StateGraph
+
+from utils.search import ConversationSearchIndex
+
+THREAD = "thread_ana_1a2b3c4d"
+
+
+def hits(index, query):
+    results, _ = index.search(query)
+    return sorted(result["message_id"] for result in results)
+
+
+def test_rolled_back_message_leaves_the_index_even_if_count_grows(tmp_path):
+    index = ConversationSearchIndex(str(tmp_path / "conv.db"))
+    h1, a1 = HumanMessage("olá lina", id="h1"), AIMessage("olá ana", id="a1")
+    cancelled = HumanMessage("pergunta abacaxi cancelada", id="h2")
+
+    index.index_thread_messages(THREAD, [h1, a1, cancelled])
+    assert hits(index, "abacaxi") == ["h2"]
+
+    # Turno desfeito e um novo turno completo: o histórico fica MAIOR que o indexado
+    h3, a3 = HumanMessage("falar de morango", id="h3"), AIMessage("morango é ótimo", id="a3")
+    assert index.index_thread_messages(THREAD, [h1, a1, h3, a3]) == 2
+
+    assert hits(index, "abacaxi") == []
+    assert hits(index, "morango") == ["a3", "h3"]
+    assert hits(index, "olá") == ["a1", "h1"]  # nada duplicado
+
+
+def test_replaced_message_with_same_count_is_indexed(tmp_path):
+    index = ConversationSearchIndex(str(tmp_path / "conv.db"))
+    h1, a1 = HumanMessage("olá", id="h1"), AIMessage("oi", id="a1")
+    index.index_thread_messages(THREAD, [h1, a1, HumanMessage("banana", id="h2")])
+    index.index_thread_messages(THREAD, [h1, a1, HumanMessage("laranja", id="h3")])
+
+    assert hits(index, "banana") == []
+    assert hits(index, "laranja") == ["h3"]
+
+
+def test_rows_from_counter_based_index_are_not_duplicated(tmp_path):
+    db_path = str(tmp_path / "conv.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE VIRTUAL TABLE message_fts USING fts5(content, thread_id UNINDEXED, user_id UNINDEXED, "
+        "message_id UNINDEXED, role UNINDEXED, created_at UNINDEXED, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    conn.execute("CREATE TABLE message_fts_state (thread_id TEXT PRIMARY KEY, indexed_count INTEGER NOT NULL, "
+                 "updated_at TEXT NOT NULL)")
+    conn.execute("INSERT INTO message_fts VALUES ('kiwi antigo', ?, 'ana', 'h1', 'user', '2025-01-01')", (THREAD,))
+    conn.commit()
+    conn.close()
+
+    index = ConversationSearchIndex(db_path)
+    assert index.index_thread_messages(THREAD, [HumanMessage("kiwi antigo", id="h1")]) == 0
+    assert hits(index, "kiwi") == ["h1"]
+
+
+def test_backfill_dates_messages_by_their_first_checkpoint(tmp_path):
+    db_path = str(tmp_path / "conv.db")
+    saver = SqliteSaver(sqlite3.connect(db_path, check_same_thread=False))
+    workflow = StateGraph(MessagesState)
+    workflow.add_node("chat", lambda state: {"messages": [AIMessage(f"eco {len(state['messages'])}")]})
+    workflow.set_entry_point("chat")
+    workflow.add_edge("chat", END)
+    graph = workflow.compile(checkpointer=saver)
+    config = {"configurable": {"thread_id": THREAD}}
+    graph.invoke({"messages": [HumanMessage("primeira pergunta", id="h1")]}, config)
+    graph.invoke({"messages": [HumanMessage("segunda pergunta", id="h2")]}, config)
+
+    index = ConversationSearchIndex(db_path)
+    assert index.backfill(saver) == {"threads": 1, "messages": 4}
+
+    results, _ = index.search("pergunta")
+    created = {result["message_id"]: result["created_at"] for result in results}
+    assert created["h1"] < created["h2"]
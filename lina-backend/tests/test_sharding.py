@@ -0,0 +1,143 @@
+import io
+import os
+import sqlite3
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils import backup, search
+from utils.archive import ThreadArchiver
+from utils.backup import _build_restore_graph, export_sources, import_ndjson, iter_export_lines
+from utils.search import ConversationSearchIndex
+from utils.checkpointing import LinaSqliteSaver
+from utils.sharding import rebalance, shard_for_key, shard_index, shard_paths
+from utils.threads import ThreadMetadataStore
+
+USERS = ["ana", "bruno", "carla", "davi", "elis", "fabio"]
+
+
+def _threads_in(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")}
+    finally:
+        conn.close()
+
+
+def _write_threads(graph, users):
+    thread_ids = []
+    for user in users:
+        for suffix in ("1a2b3c4d", "5e6f7a8b"):
+            thread_id = f"thread_{user}_{suffix}"
+            graph.update_state(
+                {"configurable": {"thread_id": thread_id}},
+                {"messages": [HumanMessage(f"oi, sou {user}", id=f"h-{thread_id}"),
+                              AIMessage(f"olá {user}", id=f"a-{thread_id}")]},
+                as_node="chat",
+            )
+            thread_ids.append(thread_id)
+    return thread_ids
+
+
+def _archived_in(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[0] for row in conn.execute("SELECT thread_id FROM archived_threads")}
+    except sqlite3.OperationalError:
+        return set()  # arquivo deste shard ainda sem tabelas
+    finally:
+        conn.close()
+
+
+def _restored_messages(db_path, archive_path, shards, thread_id):
+    """Lê a thread pelo shard atual, reidratando do arquivo como o app faria"""
+    index = shard_index(thread_id, shards)
+    shard_path = shard_paths(db_path, shards)[index]
+    saver = LinaSqliteSaver(sqlite3.connect(shard_path, check_same_thread=False))
+    saver.archiver = ThreadArchiver(shard_path, shard_paths(archive_path, shards)[index], ThreadMetadataStore(db_path))
+    restored = saver.get_tuple({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}})
+    return [m.id for m in restored.checkpoint["channel_values"]["messages"]]
+
+
+def _assert_placed(db_path, archive_path, shards, thread_ids, archived_ids):
+    db_paths, archive_paths = shard_paths(db_path, shards), shard_paths(archive_path, shards)
+    for thread_id in thread_ids:
+        expected = shard_index(thread_id, shards)
+        hot = [thread_id in _threads_in(path) for path in db_paths if os.path.exists(path)]
+        cold = [thread_id in _archived_in(path) for path in archive_paths if os.path.exists(path)]
+        if thread_id in archived_ids:
+            assert cold == [index == expected for index in range(len(cold))] and not any(hot)
+        else:
+            assert hot == [index == expected for index in range(len(hot))] and not any(cold)
+
+
+def test_shard_routing_keeps_each_user_on_one_stable_shard():
+    assert shard_paths("/dados/lina.db", 3) == ["/dados/lina.db", "/dados/lina.shard1.db", "/dados/lina.shard2.db"]
+    assert shard_index("thread_ana_1a2b3c4d", 1) == 0
+    for user in USERS:
+        expected = shard_for_key(user, 4)
+        assert {shard_index(f"thread_{user}_{suffix}", 4) for suffix in ("1a2b3c4d", "ffff0000")} == {expected}
+    assert len({shard_for_key(user, 4) for user in USERS}) > 1
+
+
+def test_import_places_each_thread_on_its_users_shard(tmp_path):
+    source_path = str(tmp_path / "source.db")
+    thread_ids = _write_threads(_build_restore_graph(source_path), USERS)
+    exported = "".join(iter_export_lines(export_sources([source_path])))
+
+    target_path = str(tmp_path / "lina_conversations.db")
+    target = _build_restore_graph(target_path, shards=3)
+    assert import_ndjson(io.StringIO(exported), target) == {"threads": len(thread_ids), "messages": 2 * len(thread_ids)}
+
+    paths = shard_paths(target_path, 3)
+    for thread_id in thread_ids:
+        expected = shard_index(thread_id, 3)
+        assert [thread_id in _threads_in(path) for path in paths] == [index == expected for index in range(3)]
+        restored = target.get_state({"configurable": {"thread_id": thread_id}}).values["messages"]
+        assert [m.id for m in restored] == [f"h-{thread_id}", f"a-{thread_id}"]
+
+
+def test_backup_export_and_backfill_clis_cover_every_shard(tmp_path):
+    db_path = str(tmp_path / "lina_conversations.db")
+    thread_ids = _write_threads(_build_restore_graph(db_path, shards=3), USERS)
+
+    backup.main(["backup", str(tmp_path / "bkp"), "--db", db_path, "--shards", "3"])
+    copies = [os.path.join(tmp_path, "bkp", os.path.basename(path)) for path in shard_paths(db_path, 3)]
+    assert set().union(*(_threads_in(path) for path in copies)) == set(thread_ids)
+
+    out_path = str(tmp_path / "export.ndjson")
+    backup.main(["export", out_path, "--db", db_path, "--shards", "3"])
+    with open(out_path, encoding="utf-8") as f:
+        exported = [line for line in f if '"type": "thread"' in line]
+    assert len(exported) == len(thread_ids)
+
+    search.main(["backfill", db_path, "--shards", "3"])
+    results, total = ConversationSearchIndex(db_path).search("olá", user_id="bruno")
+    assert total == 2 and {r["thread_id"] for r in results} == {"thread_bruno_1a2b3c4d", "thread_bruno_5e6f7a8b"}
+
+
+def test_rebalance_grows_then_shrinks_keeping_hot_and_archived_histories(tmp_path):
+    db_path = str(tmp_path / "lina_conversations.db")
+    archive_path = str(tmp_path / "lina_archive.db")
+    thread_ids = _write_threads(_build_restore_graph(db_path), USERS)
+    archived_ids = set(thread_ids[::3])
+    archiver = ThreadArchiver(db_path, archive_path, ThreadMetadataStore(db_path))
+    for thread_id in archived_ids:
+        assert archiver.archive_thread(thread_id)
+    archiver.conn.close()
+
+    # Crescer: 1 -> 3 shards
+    assert rebalance(db_path, 3, archive_base_path=archive_path, dry_run=True)["threads"] > 0
+    assert _threads_in(db_path) == set(thread_ids) - archived_ids  # dry run não move nada
+    moved = rebalance(db_path, 3, archive_base_path=archive_path)
+    assert 0 < moved["threads"] + moved["archived"] < len(thread_ids)
+    _assert_placed(db_path, archive_path, 3, thread_ids, archived_ids)
+
+    # Reduzir: 3 -> 2 shards; o shard2 fica vazio
+    rebalance(db_path, 2, from_shards=3, archive_base_path=archive_path)
+    _assert_placed(db_path, archive_path, 2, thread_ids, archived_ids)
+    assert _threads_in(shard_paths(db_path, 3)[2]) == set()
+    assert _archived_in(shard_paths(archive_path, 3)[2]) == set()
+    assert rebalance(db_path, 2, archive_base_path=archive_path) == {"threads": 0, "archived": 0}
+
+    for thread_id in thread_ids:
+        assert _restored_messages(db_path, archive_path, 2, thread_id) == [f"h-{thread_id}", f"a-{thread_id}"]
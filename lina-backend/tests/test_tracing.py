@@ -0,0 +1,60 @@
+import json
+
+from utils.timing import RequestTimer
+from utils.tracing import FileExporter, NullExporter, Tracer
+
+
+def _finish(tracer, name="chat", error=None, elapsed=0.0, **attributes):
+    timer = RequestTimer()
+    timer.started_at -= elapsed  # simula uma requisição que durou `elapsed` segundos
+    timer.record("llm_generation", timer.started_at, timer.started_at + elapsed)
+    context = tracer.start_trace(timer)
+    context.set(**attributes)
+    return tracer.finish_trace(context, name, error)
+
+
+def test_head_sampling_keeps_every_trace_at_rate_one():
+    tracer = Tracer(NullExporter(), sample_rate=1.0)
+    assert [_finish(tracer) for _ in range(3)] == ["rate", "rate", "rate"]
+    assert tracer.stats()["sampled"] == {"rate": 3, "error": 0, "slow": 0}
+
+    unsampled = Tracer(NullExporter(), sample_rate=0.0)
+    assert _finish(unsampled) is None
+    assert unsampled.stats()["buffered"] == 0
+
+
+def test_slow_and_failed_requests_are_kept_regardless_of_rate():
+    tracer = Tracer(NullExporter(), sample_rate=0.0, slow_ms=500)
+    assert _finish(tracer, elapsed=0.1) is None
+    assert _finish(tracer, elapsed=0.6) == "slow"
+    assert _finish(tracer, error="boom") == "error"
+    assert tracer.stats()["sampled"] == {"rate": 0, "error": 1, "slow": 1}
+
+
+def test_full_buffer_drops_the_oldest_trace():
+    tracer = Tracer(NullExporter(), sample_rate=1.0, max_buffer=2)
+    for n in range(3):
+        _finish(tracer, message_id=f"m{n}")
+    assert tracer.stats()["dropped"] == 1
+    assert [record["message_id"] for record in tracer.buffer] == ["m1", "m2"]
+
+
+def test_flush_exports_in_batches_to_file(tmp_path):
+    path = tmp_path / "traces" / "lina.ndjson"
+    exporter = FileExporter(str(path))
+    batches = []
+    original_export = exporter.export
+    exporter.export = lambda records: (batches.append(len(records)), original_export(records))
+
+    tracer = Tracer(exporter, sample_rate=1.0, batch_size=2)
+    for n in range(5):
+        _finish(tracer, thread_id="thread_ana_1", message_id=f"m{n}")
+    tracer.flush()
+
+    assert batches == [2, 2, 1]
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [line["message_id"] for line in lines] == ["m0", "m1", "m2", "m3", "m4"]
+    assert lines[0]["thread_id"] == "thread_ana_1"
+    assert lines[0]["spans"][0]["name"] == "llm_generation"
+    assert tracer.stats()["exported"] == 5
+    assert tracer.stats()["buffered"] == 0
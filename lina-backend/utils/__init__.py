@@ -0,0 +1 @@
+"""Utilitários e helpers do backend da Lina."""
@@ -0,0 +1,365 @@
+"""
+Controle de admissão para os endpoints de chat.
+
+Limita quantas chamadas a `lina_api_wrapper` rodam ao mesmo tempo (global e por
+usuário), aplica token buckets por modelo dimensionados pelos tokens de prompt
+esperados e mantém filas de espera limitadas com deadline. Quando não há como
+atender dentro do prazo, responde 429 imediatamente com Retry-After.
+
+Um `/chat/batch` ocupa uma vaga por entrada (o LangServe roda todas ao mesmo
+tempo), concedidas juntas, e cada entrada reserva tokens no bucket do seu modelo.
+Lotes maiores que o limite de concorrência do usuário nunca caberiam: 413.
+"""
+
+import asyncio
+import json
+import math
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.threads import parse_user_id_from_thread_id
+
+# Tempo de fila (segundos) da requisição corrente, lido pelo lina_api_wrapper
+_queue_wait: ContextVar[float] = ContextVar("lina_admission_queue_wait", default=0.0)
+
+
+def current_queue_wait() -> float:
+    """Retorna quanto tempo a requisição atual esperou na admissão"""
+    return _queue_wait.get()
+
+
+class AdmissionRejected(Exception):
+    """Requisição recusada pela admissão (vira HTTP 429)"""
+
+    def __init__(self, reason: str, retry_after: float, status: int = 429):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.status = status
+
+
+class TokenBucket:
+    """Token bucket por minuto; reservas podem deixar o saldo negativo (dívida)"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def reserve(self, amount: int, max_wait: float) -> Tuple[bool, float]:
+        """Reserva `amount` tokens; retorna (reservado, segundos até ficar disponível)"""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            deficit = amount - self.tokens
+            wait = deficit / self.rate if deficit > 0 else 0.0
+            if wait > max_wait:
+                return False, wait
+            self.tokens -= amount
+            return True, wait
+
+    def refund(self, amount: int):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + min(float(amount), self.capacity))
+
+
+class AdmissionTicket:
+    """Vagas concedidas pela admissão (uma por entrada); devem ser devolvidas com `release`"""
+
+    def __init__(self, user_id: str, reservations: List[Tuple[str, int]]):
+        self.user_id = user_id
+        self.reservations = reservations  # (modelo, tokens) de cada entrada
+        self.slots = len(reservations)
+        self.queue_wait = 0.0
+        self.started_at = 0.0
+
+
+class AdmissionController:
+    """Limites de concorrência global/por usuário e rate limiting por modelo"""
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_concurrency_per_user: int = 2,
+        max_queue: int = 32,
+        max_queue_per_user: int = 4,
+        queue_timeout: float = 10.0,
+        default_tokens_per_minute: int = 100000,
+        model_tokens_per_minute: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_user = max_concurrency_per_user
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.default_tokens_per_minute = default_tokens_per_minute
+        self.model_tokens_per_minute = model_tokens_per_minute or {}
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._active = 0
+        self._active_by_user: Dict[str, int] = {}
+        self._waiting = 0
+        self._waiting_by_user: Dict[str, int] = {}
+        self._condition: Optional[asyncio.Condition] = None
+        self._avg_service_time = 2.0  # EWMA em segundos, usado no Retry-After
+
+        self.admitted = 0
+        self.rejected = 0
+        self.total_queue_wait = 0.0
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def _get_bucket(self, model: str) -> TokenBucket:
+        bucket = self._buckets.get(model)
+        if bucket is None:
+            tpm = self.model_tokens_per_minute.get(model, self.default_tokens_per_minute)
+            bucket = self._buckets[model] = TokenBucket(tpm)
+        return bucket
+
+    def _has_slot(self, user_id: str, slots: int = 1) -> bool:
+        return (
+            self._active + slots <= self.max_concurrency
+            and self._active_by_user.get(user_id, 0) + slots <= self.max_concurrency_per_user
+        )
+
+    def _retry_after_for_queue(self) -> float:
+        return self._avg_service_time * (self._waiting + 1) / max(1, self.max_concurrency)
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected += 1
+        print(f"[DEBUG] Admission rejected: {reason} (retry_after={retry_after:.2f}s)")
+        raise AdmissionRejected(reason, retry_after)
+
+    async def acquire(self, user_id: str, model: str, tokens: int) -> AdmissionTicket:
+        """Aguarda vaga respeitando o deadline; levanta AdmissionRejected se não couber"""
+        return await self.acquire_many(user_id, [(model, tokens)])
+
+    async def acquire_many(self, user_id: str, reservations: List[Tuple[str, int]]) -> AdmissionTicket:
+        """Uma vaga por (modelo, tokens), concedidas juntas; cada uma reserva no bucket do seu modelo"""
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+        slots = len(reservations)
+        limit = min(self.max_concurrency, self.max_concurrency_per_user)
+        if slots > limit:
+            self.rejected += 1
+            raise AdmissionRejected(f"lote com {slots} entradas excede o limite de {limit} simultâneas", 0, status=413)
+
+        reserved: List[Tuple[TokenBucket, int]] = []
+        token_wait = 0.0
+        try:
+            for model, tokens in reservations:
+                bucket = self._get_bucket(model)
+                ok, wait = bucket.reserve(tokens, self.queue_timeout)
+                if not ok:
+                    self._reject(f"rate limit de tokens para {model}", wait)
+                reserved.append((bucket, tokens))
+                token_wait = max(token_wait, wait)
+
+            # Tokens reservados "a crédito": esperar o bucket repor ANTES de ocupar vaga,
+            # para não segurar concorrência global/do usuário parado
+            if token_wait > 0:
+                await asyncio.sleep(token_wait)
+            await self._acquire_slot(user_id, deadline, slots)
+        except BaseException:
+            # Rejeição, timeout ou cancelamento (cliente desconectou): devolver as reservas
+            for bucket, tokens in reserved:
+                bucket.refund(tokens)
+            raise
+
+        ticket = AdmissionTicket(user_id, reservations)
+        ticket.started_at = time.monotonic()
+        ticket.queue_wait = ticket.started_at - start
+        self.admitted += 1
+        self.total_queue_wait += ticket.queue_wait
+        return ticket
+
+    async def _acquire_slot(self, user_id: str, deadline: float, slots: int = 1):
+        condition = self._get_condition()
+        async with condition:
+            if not self._has_slot(user_id, slots):
+                if self._waiting >= self.max_queue:
+                    self._reject("fila global cheia", self._retry_after_for_queue())
+                if self._waiting_by_user.get(user_id, 0) >= self.max_queue_per_user:
+                    self._reject(f"fila do usuário {user_id} cheia", self._retry_after_for_queue())
+
+                self._waiting += 1
+                self._waiting_by_user[user_id] = self._waiting_by_user.get(user_id, 0) + 1
+                try:
+                    while not self._has_slot(user_id, slots):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject("tempo máximo de fila excedido", self._retry_after_for_queue())
+                        try:
+                            await asyncio.wait_for(condition.wait(), timeout=remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    self._waiting -= 1
+                    self._waiting_by_user[user_id] -= 1
+                    if not self._waiting_by_user[user_id]:
+                        del self._waiting_by_user[user_id]
+
+            self._active += slots
+            self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + slots
+
+    async def release(self, ticket: AdmissionTicket):
+        service_time = time.monotonic() - ticket.started_at
+        self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+
+        condition = self._get_condition()
+        async with condition:
+            self._active -= ticket.slots
+            self._active_by_user[ticket.user_id] -= ticket.slots
+            if not self._active_by_user[ticket.user_id]:
+                del self._active_by_user[ticket.user_id]
+            condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "waiting": self._waiting,
+            "active_by_user": dict(self._active_by_user),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_queue_wait": round(self.total_queue_wait / self.admitted, 4) if self.admitted else 0.0,
+            "avg_service_time": round(self._avg_service_time, 3),
+            "token_buckets": {
+                model: round(bucket.tokens, 1) for model, bucket in self._buckets.items()
+            },
+        }
+
+
+def estimate_prompt_tokens(text: str, history_allowance: int = 1000) -> int:
+    """Estimativa barata de tokens de prompt (~4 caracteres por token + histórico)"""
+    return len(text or "") // 4 + history_allowance
+
+
+def _iter_chat_inputs(body: Any) -> Iterable[Dict[str, Any]]:
+    """Normaliza os payloads de /chat/invoke, /chat/batch e /test em dicts"""
+    if not isinstance(body, dict):
+        return
+    inputs: List[Any] = body.get("inputs") if isinstance(body.get("inputs"), list) else [body.get("input")]
+    for item in inputs:
+        if isinstance(item, dict):
+            yield item
+        elif item is not None:
+            yield {"input": str(item)}
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI que aplica o AdmissionController antes de chamar o app"""
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        paths: Iterable[str] = ("/chat/invoke", "/chat/batch", "/test"),
+        model_resolver: Optional[Callable[[Dict[str, Any]], str]] = None,
+        history_allowance: int = 1000,
+    ):
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+        self.model_resolver = model_resolver or (lambda payload: "default")
+        self.history_allowance = history_allowance
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST" or scope.get("path") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        # Ler o corpo inteiro para decidir a admissão e depois reapresentá-lo ao app
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        raw_body = b"".join(chunks)
+
+        try:
+            body = json.loads(raw_body or b"{}")
+        except (ValueError, UnicodeDecodeError):
+            body = {}
+
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        payloads = list(_iter_chat_inputs(body))
+        user_id = headers.get("x-user-id") or self._resolve_user_id(body, payloads)
+        # Uma vaga por entrada, no bucket do modelo que aquela entrada vai usar
+        reservations = [
+            (self.model_resolver(p), estimate_prompt_tokens(str(p.get("input", "")), self.history_allowance))
+            for p in payloads
+        ] or [(self.model_resolver({}), self.history_allowance)]
+
+        try:
+            ticket = await self.controller.acquire_many(user_id, reservations)
+        except AdmissionRejected as e:
+            await self._send_rejection(send, e)
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": raw_body, "more_body": False}
+            return await receive()
+
+        token = _queue_wait.set(ticket.queue_wait)
+        try:
+            await self.app(scope, replay_receive, send)
+        finally:
+            _queue_wait.reset(token)
+            await self.controller.release(ticket)
+
+    @staticmethod
+    def _resolve_user_id(body: Any, payloads: List[Dict[str, Any]]) -> str:
+        if isinstance(body, dict) and isinstance(body.get("user_id"), str):
+            return body["user_id"]
+        for payload in payloads:
+            if isinstance(payload.get("user_id"), str):
+                return payload["user_id"]
+            user_id = parse_user_id_from_thread_id(payload.get("thread_id"))
+            if user_id:
+                return user_id
+        return "anonymous"
+
+    @staticmethod
+    async def _send_rejection(send, error: AdmissionRejected):
+        retryable = error.status == 429
+        body: Dict[str, Any] = {
+            "success": False,
+            "error": "Too Many Requests" if retryable else "Payload Too Large",
+            "reason": error.reason,
+        }
+        if retryable:
+            body["retry_after"] = error.retry_after
+        payload = json.dumps(body).encode("utf-8")
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode("latin-1")),
+        ]
+        if retryable:
+            headers.append((b"retry-after", str(error.retry_after).encode("latin-1")))
+        await send({
+            "type": "http.response.start",
+            "status": error.status,
+            "headers": headers,
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,363 @@
+"""
+Arquivamento de threads frias com reidratação transparente.
+
+Threads sem atividade há mais que um TTL (pelo `updated_at` de `thread_metadata`)
+têm seus checkpoints e writes movidos das tabelas quentes do
+`lina_conversations.db` (ou do shard) para `lina_archive.db`, com as colunas BLOB comprimidas
+(zlib). O arquivo é anexado (ATTACH) à conexão do arquivador, então mover uma
+thread é um INSERT ... SELECT seguido de DELETE na mesma transação.
+
+Quando um thread_id arquivado volta a ser usado, `LinaSqliteSaver` chama
+`rehydrate` antes da leitura e a thread volta inteira para as tabelas quentes.
+O conjunto `archived_ids` é só um cache do processo: se a leitura não encontra
+nada, o saver confere `archived_threads` no arquivo, que pode ter sido escrito
+pela CLI ou por outro worker.
+Os metadados (título, contagem) continuam no banco quente, então a listagem de
+threads e a busca não mudam. `open_archive_reader` lê o arquivo sem reidratar
+(exportação NDJSON), e `python -m utils.backup backup` copia o arquivo junto com
+o banco principal.
+
+Uso pela linha de comando:
+
+    python -m utils.archive run   [--ttl-hours 24] [--limit 200] [--shards N]
+    python -m utils.archive stats [--shards N]
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Set
+from urllib.parse import quote
+
+from utils.threads import ThreadMetadataStore, parse_user_id_from_thread_id
+
+DEFAULT_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "lina_conversations.db"))
+ARCHIVED_TABLES = ("checkpoints", "writes")
+
+
+def _zip(value):
+    return zlib.compress(value, 6) if isinstance(value, bytes) else value
+
+
+def _unzip(value):
+    return zlib.decompress(value) if isinstance(value, bytes) else value
+
+
+class LatencyStats:
+    """Contagem e latência (média/máxima) de uma operação"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 2) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class ThreadArchiver:
+    """Move threads ociosas para o arquivo comprimido e as traz de volta sob demanda"""
+
+    def __init__(self, db_path: str, archive_path: str, metadata_store: ThreadMetadataStore):
+        self.db_path = db_path
+        self.archive_path = archive_path
+        self.metadata_store = metadata_store
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self.conn.create_function("lina_zip", 1, _zip, deterministic=True)
+        self.conn.create_function("lina_unzip", 1, _unzip, deterministic=True)
+        self.conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        # Com shards, os metadados ficam no banco principal e não no arquivo deste shard
+        self.meta = "main"
+        if os.path.abspath(metadata_store.db_path) != os.path.abspath(db_path):
+            self.conn.execute("ATTACH DATABASE ? AS meta", (metadata_store.db_path,))
+            self.meta = "meta"
+        self.conn.execute("PRAGMA archive.journal_mode=WAL")
+        self._lock = threading.Lock()
+        self.columns: Dict[str, List[str]] = {}
+        self.blob_columns: Dict[str, Set[str]] = {}
+
+        self.archived = LatencyStats()
+        self.rehydrated = LatencyStats()
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.setup()
+        self.archived_ids: Set[str] = {
+            row[0] for row in self.conn.execute("SELECT thread_id FROM archive.archived_threads")
+        }
+
+    def setup(self):
+        with self._lock:
+            for table in ARCHIVED_TABLES:
+                info = self.conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+                if not info:
+                    raise RuntimeError(f"tabela '{table}' não existe em {self.db_path} (checkpointer não inicializado?)")
+                self.columns[table] = [col[1] for col in info]
+                self.blob_columns[table] = {col[1] for col in info if col[2].upper() == "BLOB"}
+                primary_key = [col[1] for col in sorted(info, key=lambda c: c[5]) if col[5]]
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+                self.conn.execute(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_archive_{table} ON {table} ({', '.join(primary_key)})"
+                )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS archive.archived_threads (
+                    thread_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    last_activity TEXT,
+                    archived_at TEXT NOT NULL,
+                    checkpoints INTEGER NOT NULL,
+                    writes INTEGER NOT NULL,
+                    raw_bytes INTEGER NOT NULL,
+                    stored_bytes INTEGER NOT NULL
+                )
+                """
+            )
+
+    def _select_list(self, table: str, func: str) -> str:
+        return ", ".join(
+            f"{func}({col})" if col in self.blob_columns[table] else col for col in self.columns[table]
+        )
+
+    def _blob_bytes(self, schema: str, table: str, thread_id: str) -> int:
+        blobs = self.blob_columns[table]
+        if not blobs:
+            return 0
+        expr = " + ".join(f"coalesce(length({col}), 0)" for col in blobs)
+        return self.conn.execute(
+            f"SELECT coalesce(sum({expr}), 0) FROM {schema}.{table} WHERE thread_id = ?", (thread_id,)
+        ).fetchone()[0]
+
+    def is_archived(self, thread_id: str, refresh: bool = False) -> bool:
+        """Consulta o cache do processo; com `refresh`, confere o arquivo num cache miss
+        (a thread pode ter sido arquivada pela CLI ou por outro worker)"""
+        if thread_id in self.archived_ids:
+            return True
+        if not refresh:
+            return False
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM archive.archived_threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            if row:
+                self.archived_ids.add(thread_id)
+        return row is not None
+
+    def archive_thread(self, thread_id: str, cutoff: Optional[str] = None) -> bool:
+        """Move a thread para o arquivo; com `cutoff`, só se ainda estiver ociosa"""
+        start = time.perf_counter()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    f"SELECT updated_at FROM {self.meta}.thread_metadata WHERE thread_id = ?", (thread_id,)
+                ).fetchone()
+                last_activity = row[0] if row else None
+                # Reconferir dentro da transação: a thread pode ter voltado a ser usada
+                if cutoff and (last_activity is None or last_activity >= cutoff):
+                    self.conn.execute("ROLLBACK")
+                    return False
+
+                counts: Dict[str, int] = {}
+                raw_bytes = stored_bytes = 0
+                for table in ARCHIVED_TABLES:
+                    columns = ", ".join(self.columns[table])
+                    raw_bytes += self._blob_bytes("main", table, thread_id)
+                    counts[table] = self.conn.execute(
+                        f"INSERT OR REPLACE INTO archive.{table} ({columns}) "
+                        f"SELECT {self._select_list(table, 'lina_zip')} FROM main.{table} WHERE thread_id = ?",
+                        (thread_id,),
+                    ).rowcount
+                    stored_bytes += self._blob_bytes("archive", table, thread_id)
+                    self.conn.execute(f"DELETE FROM main.{table} WHERE thread_id = ?", (thread_id,))
+
+                if not counts["checkpoints"]:
+                    self.conn.execute("ROLLBACK")
+                    return False
+
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO archive.archived_threads "
+                    "(thread_id, user_id, last_activity, archived_at, checkpoints, writes, raw_bytes, stored_bytes) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, parse_user_id_from_thread_id(thread_id), last_activity, datetime.now().isoformat(),
+                     counts["checkpoints"], counts["writes"], raw_bytes, stored_bytes),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.archived_ids.add(thread_id)
+            self.archived.add(time.perf_counter() - start)
+        return True
+
+    def rehydrate(self, thread_id: str) -> bool:
+        """Traz a thread de volta para as tabelas quentes (no-op se não estiver arquivada)"""
+        if thread_id not in self.archived_ids:
+            return False
+        start = time.perf_counter()
+        with self._lock:
+            if thread_id not in self.archived_ids:
+                return False  # outra requisição reidratou enquanto esperávamos o lock
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ARCHIVED_TABLES:
+                    columns = ", ".join(self.columns[table])
+                    # OR IGNORE: checkpoints gravados depois do arquivamento têm prioridade
+                    self.conn.execute(
+                        f"INSERT OR IGNORE INTO main.{table} ({columns}) "
+                        f"SELECT {self._select_list(table, 'lina_unzip')} FROM archive.{table} WHERE thread_id = ?",
+                        (thread_id,),
+                    )
+                    self.conn.execute(f"DELETE FROM archive.{table} WHERE thread_id = ?", (thread_id,))
+                self.conn.execute("DELETE FROM archive.archived_threads WHERE thread_id = ?", (thread_id,))
+                self.conn.execute(
+                    f"UPDATE {self.meta}.thread_metadata SET updated_at = ? WHERE thread_id = ?",
+                    (datetime.now().isoformat(), thread_id),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.archived_ids.discard(thread_id)
+            self.rehydrated.add(time.perf_counter() - start)
+        print(f"[DEBUG] Thread reidratada do arquivo: {thread_id} ({(time.perf_counter() - start) * 1000:.1f}ms)")
+        return True
+
+    def archive_idle(self, ttl_seconds: float, limit: int = 200) -> Dict[str, Any]:
+        """Arquiva até `limit` threads sem atividade há mais de `ttl_seconds`"""
+        start = time.perf_counter()
+        # Threads antigas sem metadados começam a contar o TTL a partir de agora
+        with self._lock:
+            untracked = [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT c.thread_id FROM main.checkpoints c "
+                f"LEFT JOIN {self.meta}.thread_metadata m ON m.thread_id = c.thread_id WHERE m.thread_id IS NULL"
+            )]
+        for thread_id in untracked:
+            self.metadata_store.ensure(thread_id)
+
+        cutoff = (datetime.now() - timedelta(seconds=ttl_seconds)).isoformat()
+        with self._lock:
+            candidates = [row[0] for row in self.conn.execute(
+                f"SELECT m.thread_id FROM {self.meta}.thread_metadata m WHERE m.updated_at < ? "
+                "AND EXISTS (SELECT 1 FROM main.checkpoints c WHERE c.thread_id = m.thread_id) "
+                "ORDER BY m.updated_at LIMIT ?",
+                (cutoff, limit),
+            )]
+
+        archived = 0
+        for thread_id in candidates:
+            try:
+                if self.archive_thread(thread_id, cutoff):
+                    archived += 1
+            except sqlite3.Error as e:
+                print(f"[ERROR] Falha ao arquivar {thread_id}: {e}")
+
+        self.last_run = {
+            "at": datetime.now().isoformat(),
+            "candidates": len(candidates),
+            "archived": archived,
+            "seeded": len(untracked),
+            "duration": round(time.perf_counter() - start, 3),
+        }
+        return self.last_run
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            threads, raw_bytes, stored_bytes = self.conn.execute(
+                "SELECT count(*), coalesce(sum(raw_bytes), 0), coalesce(sum(stored_bytes), 0) "
+                "FROM archive.archived_threads"
+            ).fetchone()
+        return {
+            "archived_threads": threads,
+            "raw_bytes": raw_bytes,
+            "stored_bytes": stored_bytes,
+            "compression_ratio": round(raw_bytes / stored_bytes, 2) if stored_bytes else 0.0,
+            "archive": self.archived.as_dict(),
+            "rehydrate": self.rehydrated.as_dict(),
+            "last_run": self.last_run,
+        }
+
+
+def open_archive_reader(archive_path: str):
+    """SqliteSaver somente leitura sobre o arquivo (BLOBs descomprimidos), sem reidratar nada
+
+    Views temporárias `checkpoints`/`writes` sobre o arquivo anexado em modo ro sombreiam as
+    tabelas vazias que o SqliteSaver cria no banco em memória. Retorna None se não houver arquivo."""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    if not os.path.exists(archive_path):
+        return None
+    conn = sqlite3.connect("file::memory:", uri=True, check_same_thread=False)
+    conn.create_function("lina_unzip", 1, _unzip, deterministic=True)
+    conn.execute("ATTACH DATABASE ? AS archive", (f"file:{quote(os.path.abspath(archive_path))}?mode=ro",))
+    saver = SqliteSaver(conn)
+    with saver.cursor():
+        pass  # setup() antes das views
+    for table in ARCHIVED_TABLES:
+        if not conn.execute("SELECT 1 FROM archive.sqlite_master WHERE name = ?", (table,)).fetchone():
+            conn.close()
+            return None  # arquivo sem threads arquivadas ainda
+        # Tipos do esquema do saver: o CREATE TABLE AS do arquivo não preserva "BLOB"
+        info = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+        select = ", ".join(
+            f"lina_unzip({col[1]}) AS {col[1]}" if col[2].upper() == "BLOB" else col[1] for col in info
+        )
+        conn.execute(f"CREATE TEMP VIEW {table} AS SELECT {select} FROM archive.{table}")
+    return saver
+
+
+def iter_archived_thread_ids(conn: sqlite3.Connection, user_id: Optional[str] = None) -> Iterator[str]:
+    """thread_ids do arquivo (conexão de `open_archive_reader`), opcionalmente de um usuário"""
+    query = "SELECT thread_id FROM archive.archived_threads"
+    params: tuple = ()
+    if user_id:
+        query += " WHERE user_id = ?"
+        params = (user_id,)
+    for (thread_id,) in conn.execute(query + " ORDER BY thread_id", params).fetchall():
+        yield thread_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Arquivamento de threads frias da Lina")
+    parser.add_argument("command", choices=["run", "stats"])
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--archive", default=None, help="padrão: lina_archive.db ao lado do banco")
+    parser.add_argument("--ttl-hours", type=float, default=24.0)
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=int(os.getenv("LINA_SHARDS", "1")))
+    args = parser.parse_args(argv)
+
+    from utils.sharding import shard_paths
+
+    archive_path = args.archive or os.path.join(os.path.dirname(os.path.abspath(args.db)), "lina_archive.db")
+    metadata_store = ThreadMetadataStore(args.db)  # metadados ficam sempre no banco principal
+    for index, (db_path, shard_archive_path) in enumerate(
+        zip(shard_paths(args.db, args.shards), shard_paths(archive_path, args.shards))
+    ):
+        if not os.path.exists(db_path):
+            continue
+        archiver = ThreadArchiver(db_path, shard_archive_path, metadata_store)
+        if args.command == "run":
+            result = archiver.archive_idle(args.ttl_hours * 3600, args.limit)
+            print(f"✅ shard {index}: arquivadas {result['archived']} de {result['candidates']} threads ociosas "
+                  f"em {result['duration']}s")
+        stats = archiver.stats()
+        print(f"🧊 shard {index}: {stats['archived_threads']} threads no arquivo "
+              f"({stats['raw_bytes']} -> {stats['stored_bytes']} bytes, {stats['compression_ratio']}x)")
+
+
+if __name__ == "__main__":
+    main()
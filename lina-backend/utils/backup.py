@@ -0,0 +1,245 @@
+"""
+Backup online e exportação/importação NDJSON do banco de conversas.
+
+- `online_backup`: cópia consistente de `lina_conversations.db` com a API de
+  backup do SQLite em um único passo. Em modo WAL a cópia roda numa transação
+  de leitura que não bloqueia os escritores; em passos pequenos, cada escrita
+  de outra conexão reiniciaria a cópia e, com o serviço ocupado, ela poderia
+  nunca terminar.
+- `backup_databases`: o mesmo para o banco principal (checkpoints quentes,
+  metadados e índice de busca) e o `lina_archive.db` (threads frias), num
+  diretório de destino.
+- `iter_export_lines` / `import_ndjson`: exportação e restauração em NDJSON
+  processando uma thread por vez (memória constante em relação ao tamanho total).
+  Threads arquivadas são lidas direto do arquivo, sem reidratar; na importação
+  elas voltam como threads quentes.
+
+Os comandos percorrem todos os shards (`--shards`, padrão LINA_SHARDS) e a
+importação grava cada thread no shard do seu usuário.
+
+Uso pela linha de comando (com o serviço rodando):
+
+    python -m utils.backup backup  diretorio_destino/
+    python -m utils.backup export  conversas.ndjson [--user-id USER]
+    python -m utils.backup import  conversas.ndjson
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from langchain_core.messages import message_to_dict, messages_from_dict
+
+from utils.archive import iter_archived_thread_ids, open_archive_reader
+from utils.threads import parse_user_id_from_thread_id
+
+DEFAULT_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "lina_conversations.db"))
+EXPORT_FORMAT_VERSION = 1
+
+
+def online_backup(src_path: str, dest_path: str) -> Dict[str, Any]:
+    """Copia o banco em um único passo (snapshot de leitura); grava em .partial e troca no final"""
+    start = time.perf_counter()
+    partial_path = dest_path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    progress_state = {"total": 0, "steps": 0}
+
+    def progress(status, remaining, total):
+        progress_state["total"] = total
+        progress_state["steps"] += 1
+
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(partial_path)
+    try:
+        src.execute("PRAGMA busy_timeout=30000")
+        src.backup(dst, pages=-1, progress=progress)
+    finally:
+        dst.close()
+        src.close()
+    os.replace(partial_path, dest_path)
+
+    return {
+        "dest_path": dest_path,
+        "pages": progress_state["total"],
+        "steps": progress_state["steps"],
+        "duration": round(time.perf_counter() - start, 3),
+        "size_bytes": os.path.getsize(dest_path),
+    }
+
+
+def backup_databases(paths: Iterable[str], dest_dir: str) -> List[Dict[str, Any]]:
+    """Backup online de cada arquivo existente em `dest_dir`, com o mesmo nome"""
+    os.makedirs(dest_dir, exist_ok=True)
+    return [
+        online_backup(path, os.path.join(dest_dir, os.path.basename(path)))
+        for path in paths
+        if os.path.exists(path)
+    ]
+
+
+def iter_thread_ids(conn: sqlite3.Connection, user_id: Optional[str] = None, page_size: int = 500) -> Iterator[str]:
+    """Percorre os thread_ids em páginas (keyset) sem carregar a lista inteira"""
+    last = ""
+    while True:
+        rows = conn.execute(
+            "SELECT DISTINCT thread_id FROM checkpoints WHERE checkpoint_ns = '' AND thread_id > ? "
+            "ORDER BY thread_id LIMIT ?",
+            (last, page_size),
+        ).fetchall()
+        if not rows:
+            return
+        for (thread_id,) in rows:
+            if user_id is None or parse_user_id_from_thread_id(thread_id) == user_id:
+                yield thread_id
+        last = rows[-1][0]
+
+
+def export_sources(
+    db_paths: Iterable[str],
+    archive_paths: Iterable[str] = (),
+    user_id: Optional[str] = None,
+) -> Iterator[Tuple[Any, Iterator[str], bool]]:
+    """(checkpointer, thread_ids, arquivada) de cada banco, com conexões próprias de leitura
+
+    Os bancos quentes são lidos com um SqliteSaver simples e o arquivo com
+    `open_archive_reader`: exportar não reidrata nem disputa o lock dos savers do app."""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    for path in db_paths:
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path, check_same_thread=False)
+        try:
+            yield SqliteSaver(conn), iter_thread_ids(conn, user_id), False
+        finally:
+            conn.close()
+    for path in archive_paths:
+        reader = open_archive_reader(path)
+        if reader is None:
+            continue
+        try:
+            yield reader, iter_archived_thread_ids(reader.conn, user_id), True
+        finally:
+            reader.conn.close()
+
+
+def iter_export_records(sources: Iterable[Tuple[Any, Iterable[str], bool]]) -> Iterator[Dict[str, Any]]:
+    """Gera registros `thread` seguidos dos `message` daquela thread"""
+    yield {"type": "header", "format_version": EXPORT_FORMAT_VERSION, "exported_at": time.time()}
+    for checkpointer, thread_ids, archived in sources:
+        for thread_id in thread_ids:
+            config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+            checkpoint_tuple = checkpointer.get_tuple(config)
+            if checkpoint_tuple is None:
+                continue
+            messages = checkpoint_tuple.checkpoint.get("channel_values", {}).get("messages") or []
+            yield {
+                "type": "thread",
+                "thread_id": thread_id,
+                "user_id": parse_user_id_from_thread_id(thread_id),
+                "checkpoint_id": checkpoint_tuple.checkpoint.get("id"),
+                "message_count": len(messages),
+                "archived": archived,
+            }
+            for position, message in enumerate(messages):
+                yield {"type": "message", "thread_id": thread_id, "position": position,
+                       "message": message_to_dict(message)}
+
+
+def iter_export_lines(sources: Iterable[Tuple[Any, Iterable[str], bool]]) -> Iterator[str]:
+    for record in iter_export_records(sources):
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def import_ndjson(lines: TextIO, graph, as_node: str = "chat") -> Dict[str, int]:
+    """Restaura threads exportadas via `graph.update_state` (mensagens com mesmo id são substituídas)"""
+    stats = {"threads": 0, "messages": 0}
+    current_thread: Optional[str] = None
+    pending = []
+
+    def flush():
+        if current_thread and pending:
+            config = {"configurable": {"thread_id": current_thread, "checkpoint_ns": ""}}
+            graph.update_state(config, {"messages": messages_from_dict(pending)}, as_node=as_node)
+            stats["threads"] += 1
+            stats["messages"] += len(pending)
+
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        record_type = record.get("type")
+        if record_type == "thread":
+            flush()
+            current_thread, pending = record["thread_id"], []
+        elif record_type == "message" and record.get("thread_id") == current_thread:
+            pending.append(record["message"])
+    flush()
+    return stats
+
+
+def _build_restore_graph(db_path: str, shards: int = 1):
+    """Grafo mínimo (mesmo canal `messages` do app) apenas para gravar checkpoints
+
+    O checkpointer é particionado como o do app: cada thread vai para o shard do seu usuário."""
+    from langgraph.graph import END, MessagesState, StateGraph
+
+    from utils.sharding import open_sharded_saver, shard_paths
+
+    workflow = StateGraph(MessagesState)
+    workflow.add_node("chat", lambda state: {})
+    workflow.set_entry_point("chat")
+    workflow.add_edge("chat", END)
+    return workflow.compile(checkpointer=open_sharded_saver(shard_paths(db_path, shards)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backup e export/import do banco de conversas da Lina")
+    parser.add_argument("command", choices=["backup", "export", "import"])
+    parser.add_argument("path", help="diretório do backup, arquivo NDJSON de saída ou de entrada ('-' = stdio)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--archive", default=None, help="padrão: lina_archive.db ao lado do banco")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("LINA_SHARDS", "1")))
+    parser.add_argument("--user-id", default=None)
+    args = parser.parse_args(argv)
+
+    from utils.sharding import shard_for_key, shard_paths
+
+    archive_path = args.archive or os.path.join(os.path.dirname(os.path.abspath(args.db)), "lina_archive.db")
+    db_paths = shard_paths(args.db, args.shards)
+    archive_paths = shard_paths(archive_path, args.shards)
+
+    if args.command == "backup":
+        for result in backup_databases(db_paths + archive_paths, args.path):
+            print(f"✅ Backup concluído: {result['pages']} páginas, {result['duration']}s -> {result['dest_path']}")
+    elif args.command == "export":
+        out = sys.stdout if args.path == "-" else open(args.path, "w", encoding="utf-8")
+        try:
+            if args.user_id:
+                index = shard_for_key(args.user_id, args.shards)
+                db_paths, archive_paths = [db_paths[index]], [archive_paths[index]]
+            for line in iter_export_lines(export_sources(db_paths, archive_paths, args.user_id)):
+                out.write(line)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f"✅ Exportação concluída -> {args.path}", file=sys.stderr)
+    else:
+        source = sys.stdin if args.path == "-" else open(args.path, "r", encoding="utf-8")
+        try:
+            stats = import_ndjson(source, _build_restore_graph(args.db, args.shards))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        print(f"✅ Importação concluída: {stats['messages']} mensagens em {stats['threads']} threads")
+        print("ℹ️ Rode 'python -m utils.search backfill' para indexar as threads importadas")
+
+
+if __name__ == "__main__":
+    main()
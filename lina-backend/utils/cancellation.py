@@ -0,0 +1,195 @@
+"""
+Cancelamento de requisições de chat quando o cliente desconecta.
+
+O `DisconnectMiddleware` cria um CancelToken por requisição (visível via
+ContextVar no wrapper e nos nós do StateGraph) e, depois de entregar o corpo ao
+app, fica escutando o `http.disconnect` do ASGI. Se o cliente fecha a aba ou o
+frontend aborta o fetch, o token é cancelado. O `chat_node` consome o
+streaming do LLM por `iter_until_cancelled`, que confere o token também enquanto
+espera o primeiro chunk, fecha o stream (encerrando a conexão HTTP com o
+provedor) e levanta `RequestCancelled`, que o wrapper usa para desfazer o turno
+incompleto.
+"""
+
+import asyncio
+import contextvars
+import queue
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+_cancel_token: ContextVar[Optional["CancelToken"]] = ContextVar("lina_cancel_token", default=None)
+
+
+class RequestCancelled(Exception):
+    """Requisição abandonada pelo cliente; `stage` indica onde o trabalho parou"""
+
+    def __init__(self, reason: str, stage: str = "before_llm"):
+        super().__init__(reason)
+        self.reason = reason
+        self.stage = stage
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._kept_alive = False
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str):
+        if not self._event.is_set() and not self._kept_alive:
+            self.reason = reason
+            self._event.set()
+
+    def keep_alive(self):
+        """Outra requisição depende deste resultado (ex.: retry com a mesma Idempotency-Key): não cancelar"""
+        self._kept_alive = True
+        self._event.clear()
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+    return _cancel_token.get()
+
+
+def raise_if_cancelled(stage: str = "before_llm"):
+    token = _cancel_token.get()
+    if token is not None and token.cancelled:
+        raise RequestCancelled(token.reason or "cancelled", stage)
+
+
+def iter_until_cancelled(stream: Iterator, token: Optional[CancelToken], stage: str = "during_llm",
+                         poll_interval: float = 0.05) -> Iterator:
+    """Repassa os itens de `stream`, levantando `RequestCancelled` assim que o token for cancelado
+
+    O stream é consumido numa thread auxiliar para que a espera pela resposta do provedor
+    (inclusive antes do primeiro chunk) não impeça de conferir o token. Ao cancelar, a thread
+    auxiliar para no próximo chunk e fecha o stream."""
+    if token is None:
+        try:
+            yield from stream
+        finally:
+            stream.close()
+        return
+
+    items: "queue.Queue" = queue.Queue()  # (terminou, item ou erro)
+    stop = threading.Event()
+
+    def pump():
+        error = None
+        try:
+            for item in stream:
+                if stop.is_set():
+                    break
+                items.put((False, item))
+        except BaseException as e:
+            error = e
+        finally:
+            stream.close()  # fecha a conexão HTTP com o provedor se saímos no meio
+            items.put((True, error))
+
+    # Mesmo contexto (timer, trace, token) na thread auxiliar
+    threading.Thread(target=contextvars.copy_context().run, args=(pump,), name="lina-llm-stream",
+                     daemon=True).start()
+    try:
+        while True:
+            if token.cancelled:
+                raise RequestCancelled(token.reason or "cancelled", stage)
+            try:
+                finished, value = items.get(timeout=poll_interval)
+            except queue.Empty:
+                continue
+            if finished:
+                if value is not None:
+                    raise value
+                return
+            yield value
+    finally:
+        stop.set()
+
+
+class CancellationStats:
+    """Contadores de desconexões e do trabalho interrompido por elas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {
+            "disconnects": 0,
+            "cancelled_before_llm": 0,
+            "cancelled_during_llm": 0,
+            "turns_rolled_back": 0,
+        }
+
+    def increment(self, name: str):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counts)
+
+
+class DisconnectMiddleware:
+    """Middleware ASGI que cancela o CancelToken da requisição quando o cliente desconecta"""
+
+    def __init__(self, app, stats: CancellationStats, paths: Iterable[str] = ("/chat/invoke", "/chat/batch", "/test")):
+        self.app = app
+        self.stats = stats
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST" or scope.get("path") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        token = CancelToken()
+        context_token = _cancel_token.set(token)
+        try:
+            await self._handle(scope, receive, send, token)
+        finally:
+            _cancel_token.reset(context_token)
+
+    async def _handle(self, scope, receive, send, token: CancelToken):
+        # Ler o corpo aqui para poder continuar escutando `receive` enquanto o app trabalha
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                self.stats.increment("disconnects")
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        raw_body = b"".join(chunks)
+
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    token.cancel("client_disconnect")
+                    self.stats.increment("disconnects")
+                    disconnected.set()
+                    print("[DEBUG] Cliente desconectou: cancelando a requisição em andamento")
+                    return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": raw_body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await self.app(scope, replay_receive, send)
+        finally:
+            watcher.cancel()
@@ -0,0 +1,68 @@
+"""
+SqliteSaver instrumentado usado pelo StateGraph de conversação.
+"""
+
+from typing import Callable, List, Optional
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from utils.timing import timed
+
+
+class LinaSqliteSaver(SqliteSaver):
+    """SqliteSaver que registra leituras e escritas de checkpoint no timer da requisição,
+    notifica listeners (ex.: índice de busca) a cada checkpoint gravado e reidrata
+    threads arquivadas antes de lê-las"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_listeners: List[Callable[[dict, dict], None]] = []
+        self.archiver = None  # utils.archive.ThreadArchiver (opcional)
+
+    def add_put_listener(self, listener: Callable[[dict, dict], None]):
+        """listener(config, checkpoint) é chamado após cada `put` bem-sucedido"""
+        self.put_listeners.append(listener)
+
+    def _rehydrate_if_archived(self, config: Optional[dict], refresh: bool = False) -> bool:
+        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+        if self.archiver is not None and thread_id and self.archiver.is_archived(thread_id, refresh=refresh):
+            with timed("rehydrate"):
+                return self.archiver.rehydrate(thread_id)
+        return False
+
+    def get_tuple(self, config):
+        self._rehydrate_if_archived(config)
+        with timed("checkpoint_load"):
+            result = super().get_tuple(config)
+        # Nada no banco quente: a thread pode ter sido arquivada por outro processo
+        if result is None and self._rehydrate_if_archived(config, refresh=True):
+            with timed("checkpoint_load"):
+                result = super().get_tuple(config)
+        return result
+
+    def list(self, config, *args, **kwargs):
+        self._rehydrate_if_archived(config)
+        items = super().list(config, *args, **kwargs)
+        first = next(items, None)
+        if first is None:
+            if self._rehydrate_if_archived(config, refresh=True):
+                yield from super().list(config, *args, **kwargs)
+            return
+        yield first
+        yield from items
+
+    def put(self, config, checkpoint, metadata, new_versions, *args, **kwargs):
+        self._rehydrate_if_archived(config)
+        with timed("checkpoint_write"):
+            next_config = super().put(config, checkpoint, metadata, new_versions, *args, **kwargs)
+        with timed("checkpoint_listeners"):
+            for listener in self.put_listeners:
+                try:
+                    listener(config, checkpoint)
+                except Exception as e:
+                    print(f"[ERROR] Checkpoint listener error: {e}")
+        return next_config
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs):
+        with timed("checkpoint_write"):
+            return super().put_writes(config, writes, task_id, *args, **kwargs)
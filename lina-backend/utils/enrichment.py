@@ -0,0 +1,128 @@
+"""
+Estágio de enriquecimento pré-LLM do StateGraph.
+
+Enriquecedores independentes (busca na memória, pré-carregamento de ferramentas,
+perfil do usuário...) são registrados com um timeout próprio e executados em
+paralelo por um único nó `enrich`, antes do `chat`. Quem estourar o prazo é
+ignorado naquele turno em vez de segurar a resposta; o resultado de cada um
+fica em `state["enrichment"][nome]` e os tempos em `state["enrichment_report"]`.
+
+Cada enriquecedor tem o próprio pool limitado (dimensionado pela concorrência da
+admissão): uma chamada que estourou o prazo continua rodando até terminar
+(`future.cancel()` não interrompe uma thread), mas só ocupa o pool dela. Com
+todas as vagas do pool presas, o enriquecedor é pulado na hora ("busy") em vez de
+entrar numa fila, e o prazo conta a partir do início real da execução.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.timing import record_span
+
+
+class _Call:
+    """Uma execução agendada: future + instantes em que começou e terminou no worker"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.start = 0.0
+        self.end = 0.0
+        self.future = None
+
+
+class Enricher:
+    """Função state -> dict com nome, timeout (segundos) e pool próprio"""
+
+    def __init__(self, name: str, func: Callable[[dict], Dict[str, Any]], timeout: float, max_workers: int):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"lina-enrich-{name}")
+        self._lock = threading.Lock()
+        self.in_flight = 0  # inclui chamadas que já estouraram o prazo e ainda rodam
+
+    def try_submit(self, state: dict) -> Optional[_Call]:
+        """Agenda a chamada se houver worker livre; None se o pool estiver todo ocupado"""
+        with self._lock:
+            if self.in_flight >= self.max_workers:
+                return None
+            self.in_flight += 1
+        call = _Call()
+        # Cada tarefa roda numa cópia do contexto (timer da requisição, profiling...)
+        call.future = self.executor.submit(copy_context().run, self._run, state, call)
+        return call
+
+    def _run(self, state: dict, call: _Call):
+        call.start = time.perf_counter()
+        call.started.set()
+        try:
+            return self.func(state)
+        finally:
+            call.end = time.perf_counter()
+            self._release()
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def abandon(self, call: _Call):
+        """Desiste da chamada; se ainda não tinha começado, devolve a vaga na hora"""
+        if call.future.cancel():
+            self._release()
+
+
+class EnrichmentStage:
+    """Registro de enriquecedores, cada um com seu pool de `max_workers` threads"""
+
+    def __init__(self, max_workers: int = 4):
+        self.enrichers: List[Enricher] = []
+        self.max_workers = max_workers
+
+    def register(self, name: str, timeout: float = 1.0):
+        """Decorator para registrar um enriquecedor"""
+
+        def decorator(func):
+            self.enrichers.append(Enricher(name, func, timeout, self.max_workers))
+            return func
+
+        return decorator
+
+    def __bool__(self) -> bool:
+        return bool(self.enrichers)
+
+    def run(self, state: dict) -> Dict[str, Any]:
+        """Executa todos em paralelo; retorna o update de estado com resultados e relatório"""
+        calls = [(enricher, enricher.try_submit(state)) for enricher in self.enrichers]
+
+        results: Dict[str, Any] = {}
+        report: Dict[str, Dict[str, Any]] = {}
+        for enricher, call in sorted(calls, key=lambda item: item[0].timeout):
+            task_start = time.perf_counter()
+            if call is None:
+                status = "busy"
+                print(f"[DEBUG] Enricher '{enricher.name}' pulado: pool ocupado por chamadas anteriores")
+            else:
+                try:
+                    # O worker livre foi garantido no try_submit; o prazo conta do início real
+                    if not call.started.wait(enricher.timeout):
+                        raise FutureTimeoutError()
+                    task_start = call.start
+                    remaining = task_start + enricher.timeout - time.perf_counter()
+                    results[enricher.name] = call.future.result(timeout=max(0.0, remaining)) or {}
+                    status = "ok"
+                except FutureTimeoutError:
+                    enricher.abandon(call)  # a thread que já começou segue até o fim, no pool dela
+                    status = "timeout"
+                    print(f"[DEBUG] Enricher '{enricher.name}' ignorado: excedeu {enricher.timeout}s")
+                except Exception as e:
+                    status = "error"
+                    print(f"[ERROR] Enricher '{enricher.name}' error: {e}")
+            task_end = call.end if status == "ok" else time.perf_counter()
+            report[enricher.name] = {"status": status, "ms": round((task_end - task_start) * 1000, 2)}
+            record_span(f"enrich:{enricher.name}", task_start, task_end)
+
+        return {"enrichment": results, "enrichment_report": report}
@@ -0,0 +1,204 @@
+"""
+Chaves de idempotência para o /chat/invoke.
+
+Quando o frontend (ou um proxy) repete uma requisição que estourou o tempo, a
+mesma mensagem rodaria de novo no StateGraph: outra completion paga e um turno
+duplicado na thread. Com um header `Idempotency-Key` (ou o campo
+`idempotency_key` no input), a primeira requisição vira a dona da chave; cópias
+que chegam enquanto ela roda esperam pelo mesmo resultado, e as que chegam
+depois recebem a resposta guardada, sem tocar no LLM nem no checkpointer.
+As entradas expiram após `ttl` segundos.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from utils.cancellation import current_cancel_token
+
+_idempotency_key: ContextVar[Optional[str]] = ContextVar("lina_idempotency_key", default=None)
+
+
+def current_idempotency_key() -> Optional[str]:
+    return _idempotency_key.get()
+
+
+class IdempotencyConflict(ValueError):
+    """Mesma chave reutilizada com um payload diferente"""
+
+
+class _Entry:
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.cancel_token = current_cancel_token()  # da requisição dona da chave
+
+
+class IdempotencyStore:
+    """Resultados em andamento/concluídos por chave, limitados por TTL e tamanho"""
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 10000, wait_timeout: float = 180.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.executed = 0
+        self.replayed = 0
+        self.joined = 0
+        self.conflicts = 0
+
+    def _prune(self):
+        now = time.monotonic()
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            expired = now - entry.created_at > self.ttl
+            if not expired and len(self.entries) <= self.max_entries:
+                break
+            if not entry.done.is_set() and not expired:
+                break  # não descartar chamadas ainda em andamento por causa do tamanho
+            self.entries.popitem(last=False)
+
+    def run(self, key: str, fingerprint: str, func: Callable[[], Dict[str, Any]],
+            cacheable: Callable[[Dict[str, Any]], bool] = lambda result: True) -> Dict[str, Any]:
+        """Executa `func` uma única vez por chave; duplicatas esperam ou recebem o resultado guardado"""
+        while True:
+            with self._lock:
+                self._prune()
+                entry = self.entries.get(key)
+                if entry is None:
+                    entry = self.entries[key] = _Entry(fingerprint)
+                    owner = True
+                else:
+                    if entry.fingerprint != fingerprint:
+                        self.conflicts += 1
+                        raise IdempotencyConflict(f"Idempotency-Key '{key}' já usada com outro payload")
+                    owner = False
+                    in_flight = not entry.done.is_set()
+
+            if owner:
+                break
+
+            if in_flight:
+                self.joined += 1
+                if entry.cancel_token is not None:
+                    # O cliente da original pode ter desistido, mas a cópia ainda quer a resposta
+                    entry.cancel_token.keep_alive()
+                print(f"[DEBUG] Idempotency-Key {key}: aguardando a requisição em andamento")
+                if not entry.done.wait(self.wait_timeout):
+                    raise TimeoutError(f"Requisição original da Idempotency-Key '{key}' não terminou")
+            if entry.result is not None:
+                self.replayed += 1
+                return self._as_replay(entry.result)
+            # A dona falhou (entrada removida): tentar de novo, possivelmente virando a dona
+
+        try:
+            result = func()
+        except BaseException:
+            self._discard(key, entry)
+            raise
+        self.executed += 1
+        if cacheable(result):
+            entry.result = copy.deepcopy(result)
+            entry.done.set()
+        else:
+            self._discard(key, entry)
+        return result
+
+    def _discard(self, key: str, entry: _Entry):
+        with self._lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+        entry.done.set()
+
+    @staticmethod
+    def _as_replay(result: Dict[str, Any]) -> Dict[str, Any]:
+        replay = copy.deepcopy(result)
+        if isinstance(replay.get("debug_info"), dict):
+            replay["debug_info"]["idempotent_replay"] = True
+        return replay
+
+    def wrap(self, cacheable: Callable[[Dict[str, Any]], bool] = lambda result: True):
+        """Decorator para o wrapper do LangServe: chave do header (via middleware) ou do input"""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(input_data, *args, **kwargs):
+                key = current_idempotency_key() or extract_input_key(input_data)
+                if not key:
+                    return func(input_data, *args, **kwargs)
+                return self.run(key, fingerprint(input_data), lambda: func(input_data, *args, **kwargs), cacheable)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = sum(1 for entry in self.entries.values() if not entry.done.is_set())
+            size = len(self.entries)
+        return {
+            "entries": size,
+            "in_flight": in_flight,
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "joined": self.joined,
+            "conflicts": self.conflicts,
+            "ttl": self.ttl,
+        }
+
+
+def extract_input_key(input_data: Any) -> Optional[str]:
+    if not isinstance(input_data, dict):
+        return None
+    nested = input_data.get("input")
+    if isinstance(nested, dict) and nested.get("idempotency_key"):
+        return str(nested["idempotency_key"])
+    key = input_data.get("idempotency_key")
+    return str(key) if key else None
+
+
+def fingerprint(input_data: Any) -> str:
+    """Hash do payload sem a própria chave (detecta reuso da chave com outra mensagem)"""
+
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if k != "idempotency_key"}
+        return value
+
+    encoded = json.dumps(strip(input_data), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class IdempotencyKeyMiddleware:
+    """Middleware ASGI que expõe o header Idempotency-Key ao wrapper via ContextVar"""
+
+    def __init__(self, app, paths=("/chat/invoke",), header: str = "idempotency-key"):
+        self.app = app
+        self.paths = set(paths)
+        self.header = header.encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = None
+        for name, value in scope.get("headers", []):
+            if name.lower() == self.header:
+                key = value.decode("latin-1").strip()[:200] or None
+                break
+        # Sempre definir (e restaurar): uma requisição sem header não pode herdar a chave de outra
+        token = _idempotency_key.set(key)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _idempotency_key.reset(token)
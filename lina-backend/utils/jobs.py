@@ -0,0 +1,291 @@
+"""
+Fila de tarefas em background, durável em SQLite.
+
+Trabalho que não precisa terminar antes da resposta (título da thread, indexação
+de busca e memória...) é enfileirado em uma tabela `lina_jobs` e executado por
+threads workers do próprio processo. Tarefas têm prioridade (maior primeiro),
+novas tentativas com backoff exponencial e podem ser deduplicadas por chave
+enquanto pendentes.
+
+Cada job em execução tem um lease (`locked_by`/`locked_until`) renovado pelo
+processo dono enquanto ele vive. Se o processo cai, o lease expira e qualquer
+worker (deste ou de outro processo usando o mesmo arquivo) retoma o job; jobs de
+workers vivos nunca são executados em dobro.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+
+class JobHandler:
+    def __init__(self, kind: str, func: Callable[[Dict[str, Any]], None], max_attempts: int, backoff: float):
+        self.kind = kind
+        self.func = func
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+
+class JobQueue:
+    """Fila de jobs persistida em SQLite com workers em threads"""
+
+    def __init__(self, db_path: str, workers: int = 2, poll_interval: float = 1.0, keep_done_seconds: float = 3600,
+                 lease_seconds: float = 120.0):
+        self.db_path = db_path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.keep_done_seconds = keep_done_seconds
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.handlers: Dict[str, JobHandler] = {}
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        self.setup()
+
+    def setup(self):
+        with self._lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lina_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    dedupe_key TEXT,
+                    run_after REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    last_error TEXT,
+                    locked_by TEXT,
+                    locked_until REAL
+                )
+                """
+            )
+            # Filas criadas antes dos leases
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(lina_jobs)")}
+            for column, column_type in (("locked_by", "TEXT"), ("locked_until", "REAL")):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE lina_jobs ADD COLUMN {column} {column_type}")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_lina_jobs_ready ON lina_jobs (status, priority DESC, run_after, id)"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_lina_jobs_dedupe ON lina_jobs (dedupe_key, status)"
+            )
+
+    def register(self, kind: str, max_attempts: int = 3, backoff: float = 2.0):
+        """Decorator: registra o handler de um tipo de job (recebe o payload)"""
+
+        def decorator(func):
+            self.handlers[kind] = JobHandler(kind, func, max_attempts, backoff)
+            return func
+
+        return decorator
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: Dict[str, Any],
+        priority: int = 0,
+        delay: float = 0.0,
+        dedupe_key: Optional[str] = None,
+    ) -> int:
+        """Enfileira um job; com dedupe_key, reaproveita um job igual ainda pendente"""
+        handler = self.handlers.get(kind)
+        max_attempts = handler.max_attempts if handler else 3
+        now = time.time()
+        with self._lock:
+            if dedupe_key:
+                row = self.conn.execute(
+                    "SELECT id FROM lina_jobs WHERE dedupe_key = ? AND status = 'pending' LIMIT 1", (dedupe_key,)
+                ).fetchone()
+                if row:
+                    return row[0]
+            cursor = self.conn.execute(
+                "INSERT INTO lina_jobs (kind, payload, priority, max_attempts, dedupe_key, run_after, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), priority, max_attempts, dedupe_key, now + delay, now, now),
+            )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def _claim(self) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT id, kind, payload, attempts, max_attempts, created_at FROM lina_jobs "
+                    "WHERE status = 'pending' AND run_after <= ? ORDER BY priority DESC, run_after, id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    # Lease vencido sem tentativas sobrando: o job derrubou o worker vezes demais
+                    exhausted = self.conn.execute(
+                        "UPDATE lina_jobs SET status = 'failed', last_error = 'lease expirado após ' || attempts "
+                        "|| ' tentativa(s)', updated_at = ?, locked_by = NULL, locked_until = NULL "
+                        "WHERE status = 'running' AND (locked_until IS NULL OR locked_until < ?) "
+                        "AND attempts >= max_attempts",
+                        (now, now),
+                    ).rowcount
+                    if exhausted:
+                        self.failed += exhausted
+                        print(f"[ERROR] {exhausted} job(s) com lease vencido falharam definitivamente (tentativas esgotadas)")
+                    # Job de um worker que morreu (lease vencido; sem lease = versão anterior da fila)
+                    row = self.conn.execute(
+                        "SELECT id, kind, payload, attempts, max_attempts, created_at FROM lina_jobs "
+                        "WHERE status = 'running' AND (locked_until IS NULL OR locked_until < ?) "
+                        "AND attempts < max_attempts ORDER BY priority DESC, id LIMIT 1",
+                        (now,),
+                    ).fetchone()
+                    if row:
+                        print(f"[DEBUG] Job #{row[0]} com lease vencido retomado por {self.worker_id}")
+                if row:
+                    self.conn.execute(
+                        "UPDATE lina_jobs SET status = 'running', attempts = attempts + 1, updated_at = ?, "
+                        "locked_by = ?, locked_until = ? WHERE id = ?",
+                        (now, self.worker_id, now + self.lease_seconds, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _finish(self, job_id: int, status: str, error: Optional[str] = None, run_after: Optional[float] = None):
+        now = time.time()
+        with self._lock:
+            # Só o dono do lease fecha o job (se ele venceu, outro worker já o retomou)
+            self.conn.execute(
+                "UPDATE lina_jobs SET status = ?, last_error = ?, run_after = COALESCE(?, run_after), updated_at = ?, "
+                "locked_by = NULL, locked_until = NULL WHERE id = ? AND locked_by = ?",
+                (status, error, run_after, now, job_id, self.worker_id),
+            )
+
+    def run_one(self) -> bool:
+        """Executa o próximo job pronto; retorna False se a fila estiver vazia"""
+        row = self._claim()
+        if row is None:
+            return False
+        job_id, kind, payload, attempts, max_attempts, created_at = row
+        attempts += 1
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f"nenhum handler registrado para '{kind}'")
+            handler.func(json.loads(payload))
+            self._finish(job_id, "done")
+            self.processed += 1
+            self.total_latency += time.time() - created_at
+        except Exception as e:
+            if handler is not None and attempts < max_attempts:
+                self.retried += 1
+                self._finish(job_id, "pending", str(e), time.time() + handler.backoff ** attempts)
+                print(f"[DEBUG] Job {kind}#{job_id} falhou (tentativa {attempts}/{max_attempts}): {e}")
+            else:
+                self.failed += 1
+                self._finish(job_id, "failed", str(e))
+                print(f"[ERROR] Job {kind}#{job_id} falhou definitivamente: {e}")
+        return True
+
+    def _worker_loop(self):
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                if self.run_one():
+                    continue
+                if time.time() - last_prune > 60:
+                    self.prune()
+                    last_prune = time.time()
+            except Exception as e:
+                print(f"[ERROR] Job worker error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def prune(self):
+        """Remove jobs concluídos antigos (falhas ficam para inspeção)"""
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM lina_jobs WHERE status = 'done' AND updated_at < ?",
+                (time.time() - self.keep_done_seconds,),
+            )
+
+    def renew_leases(self) -> int:
+        """Estende o lease dos jobs que este processo está executando"""
+        now = time.time()
+        with self._lock:
+            return self.conn.execute(
+                "UPDATE lina_jobs SET locked_until = ? WHERE status = 'running' AND locked_by = ?",
+                (now + self.lease_seconds, self.worker_id),
+            ).rowcount
+
+    def _lease_loop(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew_leases()
+            except Exception as e:
+                print(f"[ERROR] Job lease renewal error: {e}")
+
+    def start(self):
+        # Jobs "running" de outros processos só são retomados quando o lease deles vence (_claim)
+        with self._lock:
+            expired = self.conn.execute(
+                "SELECT count(*) FROM lina_jobs WHERE status = 'running' AND (locked_until IS NULL OR locked_until < ?)",
+                (time.time(),),
+            ).fetchone()[0]
+        if expired:
+            print(f"[DEBUG] {expired} job(s) com lease vencido serão retomados")
+        lease_thread = threading.Thread(target=self._lease_loop, name="lina-jobs-lease", daemon=True)
+        lease_thread.start()
+        self._threads.append(lease_thread)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"lina-jobs-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            by_status = dict(self.conn.execute("SELECT status, count(*) FROM lina_jobs GROUP BY status").fetchall())
+            pending_by_kind = dict(self.conn.execute(
+                "SELECT kind, count(*) FROM lina_jobs WHERE status = 'pending' GROUP BY kind"
+            ).fetchall())
+            oldest = self.conn.execute("SELECT min(created_at) FROM lina_jobs WHERE status = 'pending'").fetchone()[0]
+        return {
+            "depth": by_status.get("pending", 0),
+            "running": by_status.get("running", 0),
+            "by_status": by_status,
+            "pending_by_kind": pending_by_kind,
+            "oldest_pending_age": round(time.time() - oldest, 3) if oldest else 0.0,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "avg_latency": round(self.total_latency / self.processed, 3) if self.processed else 0.0,
+            "workers": self.workers,
+            "worker_id": self.worker_id,
+        }
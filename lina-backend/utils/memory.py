@@ -0,0 +1,284 @@
+"""
+Memória de longo prazo por recuperação (Lina-Memory).
+
+As mensagens já trocadas são convertidas em vetores por um embedder local
+plugável e guardadas em um índice vetorial NumPy persistido em disco ao lado
+de `lina_conversations.db`:
+
+- `<prefixo>.f32`: matriz float32 (linhas x dim), lida via memory-map
+- `<prefixo>.meta.jsonl`: uma linha de metadados por vetor (thread, usuário, texto)
+
+Antes de cada chamada ao LLM o chat_node busca os trechos mais relevantes
+(desta e de outras threads do mesmo usuário) e envia só uma janela recente do
+histórico, mantendo o prompt pequeno. Mensagens antigas só saem do prompt
+depois de indexadas; para indexar as conversas que já existiam antes da memória,
+rode com o serviço parado (o índice é de um único processo):
+
+    python -m utils.memory backfill [--shards N]
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from utils.threads import parse_user_id_from_thread_id
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder:
+    """Interface dos embedders: recebe textos e devolve matriz float32 normalizada"""
+
+    dim: int = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """Embedder local sem modelo: feature hashing de unigramas e bigramas"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _bucket(self, feature: str):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if (value >> 63) & 1 else -1.0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall((text or "").lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                index, sign = self._bucket(feature)
+                vectors[row, index] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+def load_embedder(spec: str, dim: int = 512) -> Embedder:
+    """`hashing` ou caminho `modulo:Classe` de um Embedder customizado"""
+    if not spec or spec == "hashing":
+        return HashingEmbedder(dim)
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class VectorIndex:
+    """Índice vetorial append-only em arquivo float32 memory-mapped"""
+
+    def __init__(self, path_prefix: str, dim: int):
+        self.vectors_path = f"{path_prefix}.f32"
+        self.meta_path = f"{path_prefix}.meta.jsonl"
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.memmap] = None
+        self._metadata: List[Dict[str, Any]] = []
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self._metadata = [json.loads(line) for line in f if line.strip()]
+        rows = self._rows_on_disk()
+        if rows != len(self._metadata):
+            # Escrita interrompida: manter só as linhas presentes nos dois arquivos
+            rows = min(rows, len(self._metadata))
+            self._metadata = self._metadata[:rows]
+            print(f"AVISO: índice de memória inconsistente, usando {rows} vetores")
+        self._remap(rows)
+
+    def _rows_on_disk(self) -> int:
+        if not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * 4)
+
+    def _remap(self, rows: int):
+        if rows == 0:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def __len__(self) -> int:
+        return len(self._metadata)
+
+    def message_ids(self) -> set:
+        return {item.get("message_id") for item in self._metadata}
+
+    def add(self, vectors: np.ndarray, metadata: List[Dict[str, Any]]):
+        if not metadata:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.meta_path, "a", encoding="utf-8") as f:
+                for item in metadata:
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self._metadata.extend(metadata)
+            self._remap(len(self._metadata))
+
+    def search(self, query: np.ndarray, k: int, predicate=None, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        with self._lock:
+            matrix, metadata = self._matrix, self._metadata
+        if matrix is None or k <= 0:
+            return []
+
+        scores = matrix @ query.astype(np.float32)
+        # Pré-seleção parcial (argpartition) e ordenação completa só se o filtro descartar demais
+        candidates = min(len(scores), max(k * 16, 64))
+        order = np.argpartition(-scores, candidates - 1)[:candidates]
+        order = order[np.argsort(-scores[order])]
+        results = self._collect(order, scores, metadata, k, predicate, min_score)
+        if len(results) < k and candidates < len(scores):
+            results = self._collect(np.argsort(-scores), scores, metadata, k, predicate, min_score)
+        return results
+
+    @staticmethod
+    def _collect(order, scores, metadata, k, predicate, min_score) -> List[Dict[str, Any]]:
+        results = []
+        for row in order:
+            score = float(scores[row])
+            if score < min_score:
+                break
+            item = metadata[row]
+            if predicate is None or predicate(item):
+                results.append({**item, "score": round(score, 4)})
+                if len(results) >= k:
+                    break
+        return results
+
+
+class ConversationMemory:
+    """Indexa mensagens das conversas e recupera trechos relevantes para o prompt"""
+
+    def __init__(self, index: VectorIndex, embedder: Embedder, min_score: float = 0.2, max_chars: int = 800):
+        self.index = index
+        self.embedder = embedder
+        self.min_score = min_score
+        self.max_chars = max_chars
+        self._indexed_ids = index.message_ids()
+
+    def is_indexed(self, message_id: Optional[str]) -> bool:
+        return bool(message_id) and message_id in self._indexed_ids
+
+    def add_messages(self, thread_id: str, user_id: Optional[str], messages: Iterable[Dict[str, str]]):
+        """messages: dicts com message_id, role e text"""
+        fresh = [
+            m for m in messages
+            if m.get("text") and m.get("message_id") not in self._indexed_ids
+        ]
+        if not fresh:
+            return 0
+
+        texts = [m["text"][: self.max_chars] for m in fresh]
+        now = datetime.now().isoformat()
+        metadata = [
+            {
+                "thread_id": thread_id,
+                "user_id": user_id,
+                "message_id": m["message_id"],
+                "role": m.get("role", "user"),
+                "text": text,
+                "created_at": now,
+            }
+            for m, text in zip(fresh, texts)
+        ]
+        self.index.add(self.embedder.embed(texts), metadata)
+        self._indexed_ids.update(m["message_id"] for m in fresh)
+        return len(fresh)
+
+    def retrieve(
+        self,
+        query: str,
+        k: int = 4,
+        user_id: Optional[str] = None,
+        exclude_message_ids: Iterable[str] = (),
+        thread_id: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Trechos do mesmo usuário; sem user_id (thread_id fora do padrão), só da própria thread"""
+        if not query or len(self.index) == 0 or not (user_id or thread_id):
+            return []
+        excluded = set(exclude_message_ids)
+
+        def predicate(item):
+            if item.get("message_id") in excluded:
+                return False
+            if user_id:
+                return item.get("user_id") == user_id
+            return item.get("thread_id") == thread_id
+
+        query_vector = self.embedder.embed([query])[0]
+        return self.index.search(query_vector, k, predicate=predicate, min_score=self.min_score)
+
+    def backfill(self, checkpointer, thread_ids: Iterable[str]) -> Dict[str, int]:
+        """Indexa as mensagens do checkpoint mais recente de cada thread (as já indexadas são puladas)"""
+        threads = messages = 0
+        for thread_id in thread_ids:
+            config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+            checkpoint_tuple = checkpointer.get_tuple(config)
+            if checkpoint_tuple is None:
+                continue
+            history = checkpoint_tuple.checkpoint.get("channel_values", {}).get("messages") or []
+            messages += self.add_messages(thread_id, parse_user_id_from_thread_id(thread_id), [
+                {
+                    "message_id": m.id,
+                    "role": "user" if m.type == "human" else "assistant",
+                    "text": m.content if isinstance(m.content, str) else str(m.content),
+                }
+                for m in history
+                if getattr(m, "id", None) and m.type in ("human", "ai")
+            ])
+            threads += 1
+        return {"threads": threads, "messages": messages}
+
+    @staticmethod
+    def format_context(snippets: List[Dict[str, Any]]) -> str:
+        lines = ["Trechos relevantes de conversas anteriores (use apenas se ajudarem):"]
+        for snippet in snippets:
+            speaker = "Usuário" if snippet.get("role") == "user" else "Lina"
+            lines.append(f"- [{snippet.get('created_at', '')[:10]}] {speaker}: {snippet['text']}")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    from utils.backup import export_sources
+    from utils.sharding import shard_paths
+
+    default_db = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "lina_conversations.db"))
+    parser = argparse.ArgumentParser(description="Memória de longo prazo da Lina")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--db", default=default_db)
+    parser.add_argument("--shards", type=int, default=int(os.getenv("LINA_SHARDS", "1")))
+    parser.add_argument("--embedder", default=os.getenv("LINA_MEMORY_EMBEDDER", "hashing"))
+    parser.add_argument("--dim", type=int, default=int(os.getenv("LINA_MEMORY_DIM", "512")))
+    args = parser.parse_args(argv)
+
+    embedder = load_embedder(args.embedder, dim=args.dim)
+    memory = ConversationMemory(
+        VectorIndex(os.path.join(os.path.dirname(os.path.abspath(args.db)), "lina_memory"), embedder.dim), embedder
+    )
+    archive_path = os.path.join(os.path.dirname(os.path.abspath(args.db)), "lina_archive.db")
+    threads = messages = 0
+    # Leitura direta dos shards e do arquivo (threads frias também), sem reidratar
+    for checkpointer, thread_ids, _ in export_sources(shard_paths(args.db, args.shards),
+                                                     shard_paths(archive_path, args.shards)):
+        stats = memory.backfill(checkpointer, thread_ids)
+        threads += stats["threads"]
+        messages += stats["messages"]
+    print(f"✅ Backfill da memória: {messages} mensagens novas de {threads} threads ({len(memory.index)} no índice)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Profiling sob demanda por requisição.
+
+Uma requisição só é perfilada quando traz o header `X-Lina-Profile` (ou o query
+param `lina_profile`) com uma chave presente na allow-list. Nesse caso a
+chamada a `lina_api_wrapper` roda sob cProfile (determinístico) e um sampler
+de pilhas; os artefatos (`.pstats` e `.collapsed`) vão para um diretório
+rotativo e o id do artefato volta em `DebugInfo.profile_id`.
+
+Desligado (sem allow-list ou sem header), o custo é uma leitura de ContextVar.
+"""
+
+import cProfile
+import functools
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Iterable, List, Optional
+from urllib.parse import parse_qs
+
+_profile_requested: ContextVar[bool] = ContextVar("lina_profile_requested", default=False)
+_current_session: ContextVar[Optional["ProfileSession"]] = ContextVar("lina_profile_session", default=None)
+
+# Até o 3.11 cada thread pode ter seu próprio cProfile ativo; a partir do 3.12 (sys.monitoring)
+# só um profiler fica ativo por processo e um segundo enable() levanta ValueError. Nesse caso a
+# primeira thread fica com o cProfile e as demais (e requisições simultâneas) só com o sampler.
+_SINGLE_PROFILER = sys.version_info >= (3, 12)
+_active_profiler_lock = threading.Lock()
+
+
+class ProfileSession:
+    """Profiling de uma requisição: cProfile por thread (quando o Python permite) + sampler de pilhas"""
+
+    def __init__(self, output_dir: str, sample_interval: float = 0.005):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.artifact_id = f"prof_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        self.thread_ids: set = set()
+        self.profiles: List[cProfile.Profile] = []
+        self.stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    @contextmanager
+    def profile_current_thread(self):
+        """Ativa cProfile na thread atual (se possível) e a inclui na amostragem"""
+        profile = self._enable_profile()
+        thread_id = threading.get_ident()
+        with self._lock:
+            self.thread_ids.add(thread_id)
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                if _SINGLE_PROFILER:
+                    _active_profiler_lock.release()
+            with self._lock:
+                self.thread_ids.discard(thread_id)
+
+    def _enable_profile(self) -> Optional[cProfile.Profile]:
+        """cProfile ligado nesta thread, ou None quando outro profiler já ocupa o processo"""
+        if _SINGLE_PROFILER and not _active_profiler_lock.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Outra ferramenta (debugger, coverage) já usa o profiler: fica só o sampler
+            if _SINGLE_PROFILER:
+                _active_profiler_lock.release()
+            return None
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def start(self):
+        self._sampler = threading.Thread(target=self._sample_loop, name="lina-profile-sampler", daemon=True)
+        self._sampler.start()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            frames = sys._current_frames()
+            with self._lock:
+                thread_ids = list(self.thread_ids)
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def stop_and_write(self) -> str:
+        """Encerra a amostragem e grava os artefatos; retorna o id do artefato"""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1.0)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, self.artifact_id)
+
+        stats = None
+        for profile in self.profiles:
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is not None:
+            stats.dump_stats(base + ".pstats")
+
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        return self.artifact_id
+
+
+class RequestProfiler:
+    """Cria sessões de profiling e mantém apenas os `keep` artefatos mais recentes"""
+
+    def __init__(self, output_dir: str, keep: int = 50, sample_interval: float = 0.005):
+        self.output_dir = output_dir
+        self.keep = keep
+        self.sample_interval = sample_interval
+
+    def _rotate(self):
+        try:
+            artifact_ids = sorted({
+                name.rsplit(".", 1)[0] for name in os.listdir(self.output_dir) if name.startswith("prof_")
+            })
+        except FileNotFoundError:
+            return
+        # Ids começam com o timestamp, então a ordem lexicográfica é cronológica
+        for artifact_id in artifact_ids[:-self.keep] if self.keep > 0 else artifact_ids:
+            for suffix in (".pstats", ".collapsed"):
+                try:
+                    os.remove(os.path.join(self.output_dir, artifact_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def wrap(self, func):
+        """Decorator: perfila a chamada se a requisição atual pediu profiling"""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _profile_requested.get():
+                return func(*args, **kwargs)
+
+            session = ProfileSession(self.output_dir, self.sample_interval)
+            token = _current_session.set(session)
+            session.start()
+            start = time.perf_counter()
+            try:
+                with session.profile_current_thread():
+                    result = func(*args, **kwargs)
+            finally:
+                _current_session.reset(token)
+                artifact_id = session.stop_and_write()
+                self._rotate()
+                print(f"[DEBUG] Profile gravado: {artifact_id} ({time.perf_counter() - start:.3f}s)")
+
+            if isinstance(result, dict) and isinstance(result.get("debug_info"), dict):
+                result["debug_info"]["profile_id"] = artifact_id
+            return result
+
+        return wrapper
+
+
+def profiled_thread(func):
+    """Decorator: inclui a thread que executa `func` (ex.: nó do LangGraph) na sessão ativa"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _current_session.get()
+        if session is None:
+            return func(*args, **kwargs)
+        with session.profile_current_thread():
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+class ProfilingMiddleware:
+    """Middleware ASGI que marca a requisição para profiling se a chave estiver na allow-list"""
+
+    def __init__(self, app, allowlist: Iterable[str], header: str = "x-lina-profile", query_param: str = "lina_profile"):
+        self.app = app
+        self.allowlist = {key for key in allowlist if key}
+        self.header = header.encode("latin-1")
+        self.query_param = query_param
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_allowed(scope):
+            await self.app(scope, receive, send)
+            return
+
+        token = _profile_requested.set(True)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _profile_requested.reset(token)
+
+    def _is_allowed(self, scope) -> bool:
+        for name, value in scope.get("headers", []):
+            if name.lower() == self.header:
+                return value.decode("latin-1") in self.allowlist
+        query_string = scope.get("query_string", b"")
+        if query_string:
+            values = parse_qs(query_string.decode("latin-1")).get(self.query_param, [])
+            return any(value in self.allowlist for value in values)
+        return False
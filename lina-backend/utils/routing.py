@@ -0,0 +1,160 @@
+"""
+Roteamento de modelo por complexidade do turno.
+
+Antes do `chat_node`, cada turno recebe uma pontuação calculada só com sinais
+locais e baratos (tamanho da mensagem, tamanho do histórico, trechos de código
+e palavras-chave de planejamento/análise) e vai para um dos tiers definidos em
+`config/model_tiers.json`, ao lado do `pricing.json`. Um "oi" cai no tier
+`fast`; um pedido longo de planejamento cai no `deep`.
+
+Precedência: override da thread > dica explícita do usuário (prefixo como
+`/detalhado` na mensagem ou campo `model_tier` no input) > pontuação.
+"""
+
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_RULES: Dict[str, Any] = {
+    "fast_max_chars": 160,
+    "long_chars": 1200,
+    "long_history": 30,
+    "thresholds": {"standard": 1, "deep": 3},
+    "code_markers": ["```"],
+    "keywords": [],
+    "hints": {},
+}
+
+
+def load_tiers_config(path: str) -> Dict[str, Any]:
+    """Lê o model_tiers.json; sem arquivo, um único tier padrão (roteamento desligado na prática)"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"AVISO: Arquivo de tiers não encontrado em {path}. Todos os turnos usarão o modelo padrão.")
+    except json.JSONDecodeError:
+        print(f"AVISO: Erro ao decodificar {path}. Todos os turnos usarão o modelo padrão.")
+    return {"default_tier": "standard", "tiers": {"standard": {"model": None}}}
+
+
+class ModelRouter:
+    """Escolhe o tier (modelo + temperatura) de cada turno e conta as decisões"""
+
+    def __init__(self, config: Dict[str, Any], default_model: str, enabled: bool = True):
+        self.tiers: Dict[str, Dict[str, Any]] = config.get("tiers") or {"standard": {}}
+        self.default_tier = config.get("default_tier", "standard")
+        if self.default_tier not in self.tiers:
+            self.default_tier = next(iter(self.tiers))
+        self.default_model = default_model
+        self.enabled = enabled
+        self.rules = {**DEFAULT_RULES, **(config.get("rules") or {})}
+        self.code_markers = [marker.lower() for marker in self.rules["code_markers"]]
+        self.keywords = [keyword.lower() for keyword in self.rules["keywords"]]
+        # Dicas mais longas primeiro ("/padrão" não pode ser engolida por um prefixo menor)
+        self.hints = sorted(
+            ((hint.lower(), tier) for hint, tier in self.rules["hints"].items() if tier in self.tiers),
+            key=lambda item: -len(item[0]),
+        )
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {tier: 0 for tier in self.tiers}
+        self.sources: Dict[str, int] = {"override": 0, "hint": 0, "score": 0, "disabled": 0}
+
+    def model_for(self, tier: str) -> str:
+        return self.tiers.get(tier, {}).get("model") or self.default_model
+
+    def is_tier(self, tier: Optional[str]) -> bool:
+        return bool(tier) and tier in self.tiers
+
+    def extract_hint(self, text: str) -> Tuple[Optional[str], str]:
+        """Separa a dica de tier no início da mensagem: ('deep', resto) ou (None, texto)"""
+        stripped = (text or "").lstrip()
+        lowered = stripped.lower()
+        for hint, tier in self.hints:
+            if lowered.startswith(hint) and (len(lowered) == len(hint) or lowered[len(hint)].isspace()):
+                return tier, stripped[len(hint):].strip()
+        return None, text
+
+    def score(self, text: str, history_size: int = 0) -> Tuple[int, List[str]]:
+        """Pontuação de complexidade e os sinais que contribuíram"""
+        text = text or ""
+        lowered = text.lower()
+        points = 0
+        reasons: List[str] = []
+
+        if len(text) >= self.rules["long_chars"]:
+            points += 2
+            reasons.append(f"mensagem longa ({len(text)} chars)")
+        elif len(text) > self.rules["fast_max_chars"]:
+            points += 1
+            reasons.append(f"mensagem média ({len(text)} chars)")
+
+        if any(marker in lowered for marker in self.code_markers):
+            points += 2
+            reasons.append("código")
+
+        matched = [keyword for keyword in self.keywords if keyword in lowered]
+        if matched:
+            points += 2
+            reasons.append(f"palavras-chave: {', '.join(matched[:3])}")
+
+        # Histórico longo só pesa se o turno já não for trivial ("ok, valeu" continua rápido)
+        if points and history_size >= self.rules["long_history"]:
+            points += 1
+            reasons.append(f"histórico longo ({history_size} mensagens)")
+
+        return points, reasons
+
+    def route(self, text: str, history_size: int = 0, hint: Optional[str] = None,
+              override: Optional[str] = None, record: bool = True) -> Dict[str, Any]:
+        """Decide o tier do turno; retorna {"tier", "model", "temperature", "reason", "score"}
+
+        `record=False` para estimativas (ex.: admissão) que não devem entrar nas estatísticas."""
+        points = 0
+        if not self.enabled:
+            tier, source, reason = self.default_tier, "disabled", "roteamento desligado"
+        elif self.is_tier(override):
+            tier, source, reason = override, "override", f"override da thread ({override})"
+        elif self.is_tier(hint):
+            tier, source, reason = hint, "hint", f"pedido do usuário ({hint})"
+        else:
+            points, reasons = self.score(text, history_size)
+            thresholds = self.rules["thresholds"]
+            if points >= thresholds.get("deep", 3) and "deep" in self.tiers:
+                tier = "deep"
+            elif points >= thresholds.get("standard", 1) and "standard" in self.tiers:
+                tier = "standard"
+            elif "fast" in self.tiers:
+                tier = "fast"
+            else:
+                tier = self.default_tier
+            source = "score"
+            reason = f"score {points}: {'; '.join(reasons)}" if reasons else f"score {points}: turno curto"
+
+        if record:
+            with self._lock:
+                self.counts[tier] = self.counts.get(tier, 0) + 1
+                self.sources[source] += 1
+        return {
+            "tier": tier,
+            "model": self.model_for(tier),
+            "temperature": self.tiers.get(tier, {}).get("temperature", 0.8),
+            "reason": reason,
+            "score": points,
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            name: {"model": self.model_for(name), "description": tier.get("description")}
+            for name, tier in self.tiers.items()
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "default_tier": self.default_tier,
+                "tiers": self.describe(),
+                "routed": dict(self.counts),
+                "sources": dict(self.sources),
+            }
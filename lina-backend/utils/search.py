@@ -0,0 +1,274 @@
+"""
+Busca full-text nas conversas com um índice SQLite FTS5.
+
+O índice (`message_fts`) vive no próprio `lina_conversations.db` e guarda o texto
+de cada mensagem com thread_id, user_id e message_id. A tabela `message_fts_ids`
+mapeia (thread_id, message_id) para a linha do FTS: a cada checkpoint gravado, as
+mensagens que ainda não estão no índice são inseridas e as que saíram do
+histórico (ex.: turno cancelado desfeito) são removidas. `created_at` é o
+horário do primeiro checkpoint em que a mensagem aparece. Para dados antigos:
+
+    python -m utils.search backfill [caminho/do/lina_conversations.db]
+"""
+
+import argparse
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils.threads import parse_user_id_from_thread_id
+
+_QUERY_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def message_role(message) -> str:
+    message_type = getattr(message, "type", "")
+    return {"human": "user", "ai": "assistant"}.get(message_type, message_type or "unknown")
+
+
+def message_text(message) -> str:
+    content = getattr(message, "content", "")
+    if isinstance(content, str):
+        return content
+    # Conteúdo multimodal: juntar apenas as partes de texto
+    parts = [part.get("text", "") if isinstance(part, dict) else str(part) for part in content or []]
+    return " ".join(p for p in parts if p)
+
+
+def build_match_query(query: str) -> str:
+    """Converte texto livre em consulta FTS5 segura (termos entre aspas, prefixo no último)"""
+    tokens = _QUERY_TOKEN_RE.findall(query or "")
+    if not tokens:
+        return ""
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+class ConversationSearchIndex:
+    """Índice FTS5 de mensagens, mantido incrementalmente por thread"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self._lock = threading.Lock()
+        self.setup()
+
+    def setup(self):
+        with self._lock:
+            self.conn.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+                    content,
+                    thread_id UNINDEXED,
+                    user_id UNINDEXED,
+                    message_id UNINDEXED,
+                    role UNINDEXED,
+                    created_at UNINDEXED,
+                    tokenize = 'unicode61 remove_diacritics 2'
+                )
+                """
+            )
+            created = not self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts_ids'"
+            ).fetchone()
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS message_fts_ids (
+                    thread_id TEXT NOT NULL,
+                    message_id TEXT NOT NULL,
+                    fts_rowid INTEGER NOT NULL,
+                    PRIMARY KEY (thread_id, message_id)
+                )
+                """
+            )
+            if created:
+                # Índices criados pela versão com contador: mapear as linhas já existentes uma única vez
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO message_fts_ids (thread_id, message_id, fts_rowid) "
+                    "SELECT thread_id, message_id, rowid FROM message_fts"
+                )
+            self.conn.execute("DROP TABLE IF EXISTS message_fts_state")
+
+    def index_thread_messages(
+        self,
+        thread_id: str,
+        messages: List[Any],
+        user_id: Optional[str] = None,
+        created_at: Optional[str] = None,
+        message_times: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """Sincroniza o índice da thread com `messages` por message_id; retorna quantas foram inseridas
+
+        `created_at` é o horário das mensagens novas (o do checkpoint); `message_times` permite
+        informar o horário de cada mensagem (backfill)."""
+        user_id = user_id or parse_user_id_from_thread_id(thread_id)
+        created_at = created_at or datetime.now().isoformat()
+        message_times = message_times or {}
+        current = {}
+        for message in messages:
+            message_id = getattr(message, "id", None)
+            if message_id and message_text(message):
+                current[message_id] = message
+
+        with self._lock:
+            indexed = dict(self.conn.execute(
+                "SELECT message_id, fts_rowid FROM message_fts_ids WHERE thread_id = ?", (thread_id,)
+            ).fetchall())
+
+            self.conn.execute("BEGIN")
+            try:
+                # Mensagens que saíram do histórico (RemoveMessage) deixam de ser encontradas
+                for message_id in indexed.keys() - current.keys():
+                    self.conn.execute("DELETE FROM message_fts WHERE rowid = ?", (indexed[message_id],))
+                    self.conn.execute(
+                        "DELETE FROM message_fts_ids WHERE thread_id = ? AND message_id = ?", (thread_id, message_id)
+                    )
+                inserted = 0
+                for message_id, message in current.items():
+                    if message_id in indexed:
+                        continue
+                    cursor = self.conn.execute(
+                        "INSERT INTO message_fts (content, thread_id, user_id, message_id, role, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (message_text(message), thread_id, user_id, message_id, message_role(message),
+                         message_times.get(message_id, created_at)),
+                    )
+                    self.conn.execute(
+                        "INSERT INTO message_fts_ids (thread_id, message_id, fts_rowid) VALUES (?, ?, ?)",
+                        (thread_id, message_id, cursor.lastrowid),
+                    )
+                    inserted += 1
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def index_thread(self, checkpointer, thread_id: str, full_history: bool = False) -> int:
+        """Sincroniza o índice com o checkpoint mais recente da thread
+
+        Com `full_history`, percorre os checkpoints anteriores para datar cada mensagem pelo
+        primeiro checkpoint em que ela aparece (usado no backfill)."""
+        config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        checkpoint_tuple = checkpointer.get_tuple(config)
+        if checkpoint_tuple is None:
+            return 0
+        checkpoint = checkpoint_tuple.checkpoint
+        messages = checkpoint.get("channel_values", {}).get("messages") or []
+
+        message_times: Dict[str, str] = {}
+        if full_history:
+            for older in checkpointer.list(config):  # do mais novo para o mais antigo
+                for message in older.checkpoint.get("channel_values", {}).get("messages") or []:
+                    message_id = getattr(message, "id", None)
+                    if message_id:
+                        message_times[message_id] = older.checkpoint.get("ts") or message_times.get(message_id)
+        return self.index_thread_messages(
+            thread_id, messages, created_at=checkpoint.get("ts"), message_times=message_times
+        )
+
+    def search(
+        self,
+        query: str,
+        user_id: Optional[str] = None,
+        thread_id: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """Busca ranqueada (bm25) com snippets destacados; retorna (resultados, total)"""
+        match = build_match_query(query)
+        if not match:
+            return [], 0
+
+        filters = ""
+        params: List[Any] = [match]
+        if user_id:
+            filters += " AND user_id = ?"
+            params.append(user_id)
+        if thread_id:
+            filters += " AND thread_id = ?"
+            params.append(thread_id)
+
+        with self._lock:
+            total = self.conn.execute(
+                f"SELECT count(*) FROM message_fts WHERE message_fts MATCH ?{filters}", params
+            ).fetchone()[0]
+            rows = self.conn.execute(
+                f"""
+                SELECT thread_id, user_id, message_id, role, created_at,
+                       snippet(message_fts, 0, '<mark>', '</mark>', '…', 16),
+                       bm25(message_fts)
+                FROM message_fts
+                WHERE message_fts MATCH ?{filters}
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+                """,
+                params + [limit, offset],
+            ).fetchall()
+
+        results = [
+            {
+                "thread_id": r[0],
+                "user_id": r[1],
+                "message_id": r[2],
+                "role": r[3],
+                "created_at": r[4],
+                "snippet": r[5],
+                "score": round(-r[6], 4),  # bm25 é negativo: maior = mais relevante
+            }
+            for r in rows
+        ]
+        return results, total
+
+    def iter_thread_ids(self) -> Iterable[str]:
+        cursor = self.conn.execute("SELECT DISTINCT thread_id FROM checkpoints WHERE checkpoint_ns = ''")
+        for (thread_id,) in cursor:
+            yield thread_id
+
+    def backfill(self, checkpointer, thread_ids: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """Indexa cada thread já existente (por padrão, as do banco do índice)
+
+        Com shards, passe os thread_ids de todos eles (`ShardedSaver.iter_thread_ids`)."""
+        threads = messages = 0
+        for thread_id in list(self.iter_thread_ids() if thread_ids is None else thread_ids):
+            messages += self.index_thread(checkpointer, thread_id, full_history=True)
+            threads += 1
+        return {"threads": threads, "messages": messages}
+
+
+def main(argv=None):
+    import os
+
+    from utils.sharding import open_sharded_saver, shard_paths
+
+    default_db = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "lina_conversations.db"))
+    parser = argparse.ArgumentParser(description="Índice FTS5 das conversas da Lina")
+    parser.add_argument("command", choices=["backfill", "search"])
+    parser.add_argument("db_path", nargs="?", default=default_db)
+    parser.add_argument("--query", "-q", default="")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("LINA_SHARDS", "1")))
+    args = parser.parse_args(argv)
+
+    index = ConversationSearchIndex(args.db_path)
+    if args.command == "backfill":
+        start = time.perf_counter()
+        # O índice fica no banco principal; as threads são lidas de todos os shards
+        checkpointer = open_sharded_saver(shard_paths(args.db_path, args.shards))
+        stats = index.backfill(checkpointer, checkpointer.iter_thread_ids())
+        print(f"✅ Backfill concluído: {stats['messages']} mensagens de {stats['threads']} threads "
+              f"em {time.perf_counter() - start:.2f}s")
+    else:
+        results, total = index.search(args.query)
+        print(f"🔎 {total} resultado(s) para '{args.query}'")
+        for result in results:
+            print(f"- [{result['thread_id']}] {result['role']}: {result['snippet']}")
+
+
+if __name__ == "__main__":
+    main()
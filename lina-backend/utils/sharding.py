@@ -0,0 +1,276 @@
+"""
+Checkpointer particionado em vários arquivos SQLite.
+
+O SQLite aceita um único escritor por arquivo; com vários usuários simultâneos
+as escritas de checkpoint disputam o mesmo lock. `ShardedSaver` distribui as
+threads entre N arquivos (cada um com sua conexão e seu LinaSqliteSaver),
+escolhendo o shard por hash do user_id embutido no thread_id. Assim todas as
+threads de um usuário ficam no mesmo arquivo e usuários diferentes escrevem em
+paralelo.
+
+O shard 0 é o próprio `lina_conversations.db` (com LINA_SHARDS=1 nada muda);
+os demais ficam ao lado dele como `lina_conversations.shard1.db`, ... Ao mudar
+o número de shards, rode o rebalanceamento com o serviço parado:
+
+    python -m utils.sharding rebalance --shards 4 [--from-shards 8] [--dry-run]
+    python -m utils.sharding list [--shards 4] [--user-id USER]
+    python -m utils.sharding stats [--shards 4]
+"""
+
+import argparse
+import copy
+import hashlib
+import os
+import sqlite3
+from itertools import chain, islice
+from typing import Any, Dict, Iterator, List, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from utils.backup import iter_thread_ids as iter_shard_thread_ids
+from utils.threads import parse_user_id_from_thread_id
+
+DEFAULT_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "lina_conversations.db"))
+CHECKPOINT_TABLES = ("checkpoints", "writes")
+ARCHIVE_TABLES = ("checkpoints", "writes", "archived_threads")
+
+
+def shard_paths(base_path: str, count: int) -> List[str]:
+    """[base, base.shard1, ...]: o shard 0 mantém o nome original"""
+    root, ext = os.path.splitext(base_path)
+    return [base_path] + [f"{root}.shard{index}{ext}" for index in range(1, count)]
+
+
+def shard_for_key(key: str, count: int) -> int:
+    if count <= 1:
+        return 0
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def shard_index(thread_id: str, count: int) -> int:
+    """Shard estável por user_id (ou pelo próprio thread_id, se não houver user_id nele)"""
+    return shard_for_key(parse_user_id_from_thread_id(thread_id) or thread_id, count)
+
+
+class ShardedSaver(BaseCheckpointSaver):
+    """Encaminha cada operação para o LinaSqliteSaver do shard da thread"""
+
+    def __init__(self, shards: List[Any], paths: List[str]):
+        super().__init__(serde=shards[0].serde)
+        self.shards = shards
+        self.paths = paths
+
+    def shard_for(self, config: Optional[dict]):
+        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+        return self.shards[shard_index(str(thread_id), len(self.shards))]
+
+    def add_put_listener(self, listener):
+        for shard in self.shards:
+            shard.add_put_listener(listener)
+
+    def get_tuple(self, config):
+        return self.shard_for(config).get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        if config is not None and config.get("configurable", {}).get("thread_id"):
+            return self.shard_for(config).list(config, filter=filter, before=before, limit=limit)
+        # Sem thread_id: percorre todos os shards
+        merged = chain.from_iterable(
+            shard.list(config, filter=filter, before=before, limit=limit) for shard in self.shards
+        )
+        return islice(merged, limit) if limit is not None else merged
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self.shard_for(config).put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        return self.shard_for(config).put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id):
+        self.shards[shard_index(str(thread_id), len(self.shards))].delete_thread(thread_id)
+
+    def get_delta_channel_history(self, *, config, channels):
+        return self.shard_for(config).get_delta_channel_history(config=config, channels=channels)
+
+    def get_next_version(self, current, channel):
+        return self.shards[0].get_next_version(current, channel)
+
+    def with_allowlist(self, extra_allowlist):
+        clone = copy.copy(self)
+        clone.shards = [shard.with_allowlist(extra_allowlist) for shard in self.shards]
+        clone.serde = clone.shards[0].serde
+        return clone
+
+    def iter_thread_ids(self, user_id: Optional[str] = None) -> Iterator[str]:
+        """Listagem entre shards (só o shard do usuário quando `user_id` é dado)"""
+        if user_id:
+            indexes = [shard_for_key(user_id, len(self.paths))]
+        else:
+            indexes = range(len(self.paths))
+        for index in indexes:
+            # Conexão própria de leitura: não disputa o lock do saver durante a iteração
+            conn = sqlite3.connect(self.paths[index], check_same_thread=False)
+            try:
+                yield from iter_shard_thread_ids(conn, user_id)
+            finally:
+                conn.close()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return shard_stats(self.paths)
+
+
+def shard_stats(paths: List[str]) -> List[Dict[str, Any]]:
+    stats = []
+    for index, path in enumerate(paths):
+        entry: Dict[str, Any] = {"shard": index, "path": os.path.basename(path), "threads": 0, "checkpoints": 0}
+        if os.path.exists(path):
+            conn = sqlite3.connect(path)
+            try:
+                entry["threads"], entry["checkpoints"] = conn.execute(
+                    "SELECT count(DISTINCT thread_id), count(*) FROM checkpoints"
+                ).fetchone()
+            except sqlite3.OperationalError:
+                pass  # shard ainda sem tabelas
+            finally:
+                conn.close()
+            entry["size_bytes"] = os.path.getsize(path)
+        stats.append(entry)
+    return stats
+
+
+def open_sharded_saver(paths: List[str]) -> ShardedSaver:
+    """ShardedSaver com SqliteSavers simples, para as CLIs (fora do app, sem arquivamento)"""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    return ShardedSaver([SqliteSaver(_open_shard(path)) for path in paths], paths)
+
+
+def _open_shard(path: str) -> sqlite3.Connection:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    SqliteSaver(conn).setup()  # garante as tabelas no shard de destino
+    return conn
+
+
+def _existing_tables(conn: sqlite3.Connection, schema: str, tables) -> List[str]:
+    names = {row[0] for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table'")}
+    return [table for table in tables if table in names]
+
+
+def _move_thread(conn: sqlite3.Connection, target_schema: str, tables: List[str], thread_id: str):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in tables:
+            # Colunas da origem: o destino pode ter colunas novas (ex.: writes.task_path) com default
+            columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+            conn.execute(
+                f"INSERT OR IGNORE INTO {target_schema}.{table} ({columns}) "
+                f"SELECT {columns} FROM main.{table} WHERE thread_id = ?",
+                (thread_id,),
+            )
+            conn.execute(f"DELETE FROM main.{table} WHERE thread_id = ?", (thread_id,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _ensure_target_tables(conn: sqlite3.Connection, schema: str, tables: List[str]):
+    """Cria no arquivo de destino as tabelas que faltam, com o mesmo esquema da origem"""
+    missing = set(tables) - set(_existing_tables(conn, schema, tables))
+    for table in missing:
+        create_sql = conn.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()[0]
+        conn.execute(create_sql.replace(f"CREATE TABLE {table}", f"CREATE TABLE {schema}.{table}", 1))
+
+
+def rebalance(
+    base_path: str,
+    shards: int,
+    from_shards: Optional[int] = None,
+    archive_base_path: Optional[str] = None,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """Move cada thread (quente e arquivada) para o shard que o hash indica com `shards` arquivos.
+
+    `from_shards` maior que `shards` esvazia os arquivos que deixam de existir."""
+    source_count = max(shards, from_shards or shards)
+    groups = [("threads", base_path, CHECKPOINT_TABLES)]
+    if archive_base_path:
+        groups.append(("archived", archive_base_path, ARCHIVE_TABLES))
+
+    moved: Dict[str, int] = {}
+    for label, path, tables in groups:
+        moved[label] = 0
+        targets = shard_paths(path, shards)
+        for source_path in shard_paths(path, source_count):
+            if not os.path.exists(source_path):
+                continue
+            conn = sqlite3.connect(source_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            try:
+                source_tables = _existing_tables(conn, "main", tables)
+                if "checkpoints" not in source_tables:
+                    continue
+                thread_ids = [row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+                attached = set()
+                for thread_id in thread_ids:
+                    target_index = shard_index(thread_id, shards)
+                    if targets[target_index] == source_path:
+                        continue
+                    moved[label] += 1
+                    if dry_run:
+                        continue
+                    schema = f"shard{target_index}"
+                    if target_index not in attached:
+                        if label == "threads":
+                            _open_shard(targets[target_index]).close()
+                        conn.execute(f"ATTACH DATABASE ? AS {schema}", (targets[target_index],))
+                        _ensure_target_tables(conn, schema, source_tables)
+                        attached.add(target_index)
+                    _move_thread(conn, schema, source_tables, thread_id)
+            finally:
+                conn.close()
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shards do banco de conversas da Lina")
+    parser.add_argument("command", choices=["rebalance", "list", "stats"])
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--shards", type=int, default=int(os.getenv("LINA_SHARDS", "1")))
+    parser.add_argument("--from-shards", type=int, default=None, help="número anterior de shards, se for reduzir")
+    parser.add_argument("--user-id", default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    db_paths = shard_paths(args.db, args.shards)
+    if args.command == "rebalance":
+        archive_base = os.path.join(os.path.dirname(os.path.abspath(args.db)), "lina_archive.db")
+        moved = rebalance(args.db, args.shards, args.from_shards, archive_base, dry_run=args.dry_run)
+        action = "seriam movidas" if args.dry_run else "movidas"
+        print(f"✅ Rebalanceamento em {args.shards} shards: {moved['threads']} threads e "
+              f"{moved.get('archived', 0)} threads arquivadas {action}")
+    elif args.command == "list":
+        for index, path in enumerate(db_paths):
+            if not os.path.exists(path):
+                continue
+            conn = sqlite3.connect(path)
+            try:
+                for thread_id in iter_shard_thread_ids(conn, args.user_id):
+                    print(f"{index}\t{thread_id}")
+            finally:
+                conn.close()
+    else:
+        for entry in shard_stats(db_paths):
+            print(f"🗄️ shard {entry['shard']} ({entry['path']}): {entry['threads']} threads, "
+                  f"{entry['checkpoints']} checkpoints, {entry.get('size_bytes', 0)} bytes")
+
+
+if __name__ == "__main__":
+    main()
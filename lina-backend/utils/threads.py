@@ -0,0 +1,115 @@
+"""
+Helpers de thread_id e metadados de thread compartilhados pelos módulos do backend.
+"""
+
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# thread_{user_id}_{hex8} (ThreadManager.create_thread)
+# thread_{user_id}_{yymmdd}_{HHMMSS}_{hex8} (generate_thread_id)
+_THREAD_SUFFIX_RE = re.compile(r"(?:_\d{6}_\d{6})?_[0-9a-f]{8}$")
+
+
+def parse_user_id_from_thread_id(thread_id: Optional[str]) -> Optional[str]:
+    """Extrai o user_id embutido no thread_id (aceita user_id com underscores)"""
+    if not thread_id or not thread_id.startswith("thread_"):
+        return None
+    body = thread_id[len("thread_"):]
+    user_id = _THREAD_SUFFIX_RE.sub("", body)
+    if not user_id or user_id == body:
+        return None
+    return user_id
+
+
+class ThreadMetadataStore:
+    """Metadados das threads (título, contagem de mensagens) em tabela própria"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS thread_metadata (
+                    thread_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    title TEXT,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    model_tier TEXT,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+            # Bancos criados antes do roteamento de modelo não têm a coluna de override
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(thread_metadata)")}
+            if "model_tier" not in columns:
+                self.conn.execute("ALTER TABLE thread_metadata ADD COLUMN model_tier TEXT")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_thread_metadata_user ON thread_metadata (user_id, updated_at)")
+
+    def ensure(self, thread_id: str, user_id: Optional[str] = None, title: Optional[str] = None):
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO thread_metadata (thread_id, user_id, title, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (thread_id, user_id or parse_user_id_from_thread_id(thread_id), title, now, now),
+            )
+
+    def record_turn(self, thread_id: str, user_id: Optional[str] = None, messages: int = 2) -> Dict[str, Any]:
+        """Atualiza contagem/updated_at e retorna os metadados atuais"""
+        self.ensure(thread_id, user_id)
+        now = datetime.now().isoformat()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE thread_metadata SET message_count = message_count + ?, updated_at = ? WHERE thread_id = ?",
+                (messages, now, thread_id),
+            )
+        return self.get(thread_id)
+
+    def set_title(self, thread_id: str, title: str):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE thread_metadata SET title = ?, updated_at = ? WHERE thread_id = ?",
+                (title, datetime.now().isoformat(), thread_id),
+            )
+
+    def set_model_tier(self, thread_id: str, tier: Optional[str]):
+        """Fixa o tier de modelo da thread (None volta ao roteamento automático)"""
+        self.ensure(thread_id)
+        with self._lock:
+            self.conn.execute(
+                "UPDATE thread_metadata SET model_tier = ?, updated_at = ? WHERE thread_id = ?",
+                (tier, datetime.now().isoformat(), thread_id),
+            )
+
+    def get_model_tier(self, thread_id: Optional[str]) -> Optional[str]:
+        if not thread_id:
+            return None
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT model_tier FROM thread_metadata WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self.conn.execute("SELECT * FROM thread_metadata WHERE thread_id = ?", (thread_id,))
+            row = cursor.fetchone()
+            columns = [c[0] for c in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def list_by_user(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            cursor = self.conn.execute(
+                "SELECT * FROM thread_metadata WHERE user_id = ? ORDER BY updated_at DESC LIMIT ?", (user_id, limit)
+            )
+            rows = cursor.fetchall()
+            columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
@@ -0,0 +1,68 @@
+"""
+Spans leves de tempo por requisição.
+
+Cada chamada a `lina_api_wrapper` abre um RequestTimer guardado em um ContextVar;
+qualquer código no caminho da requisição (chat_node, checkpointer) registra
+etapas com `timed("nome")` sem precisar receber o timer como parâmetro.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+_current_timer: ContextVar[Optional["RequestTimer"]] = ContextVar("lina_request_timer", default=None)
+
+
+class RequestTimer:
+    """Acumula spans (nome, início relativo, duração) de uma requisição"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def record(self, name: str, start: float, end: float):
+        self.spans.append((name, start - self.started_at, max(0.0, end - start)))
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def as_dict(self) -> Dict[str, float]:
+        """Soma por etapa em milissegundos, na ordem em que apareceram"""
+        totals: Dict[str, float] = {}
+        for name, _, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        return {name: round(seconds * 1000, 2) for name, seconds in totals.items()}
+
+
+def start_request_timer() -> RequestTimer:
+    """Cria um timer e o torna o timer corrente do contexto"""
+    timer = RequestTimer()
+    _current_timer.set(timer)
+    return timer
+
+
+@contextmanager
+def timed(name: str):
+    """Registra um span no timer corrente; sem timer ativo não faz nada"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.span(name):
+        yield
+
+
+def record_span(name: str, start: float, end: float):
+    """Registra um span com marcas de perf_counter já medidas"""
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.record(name, start, end)
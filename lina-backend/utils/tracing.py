@@ -0,0 +1,237 @@
+"""
+Tracing amostrado e exportado fora do caminho da requisição.
+
+No fim de cada requisição o `Tracer` decide se guarda o trace (amostragem na
+cauda): sempre para erros e requisições acima de `slow_ms`, e para uma fração
+`sample_rate` das demais (sorteada no início, para que o tracing profundo do
+LangChain/LangSmith possa acompanhar a mesma decisão). Traces guardados viram
+registros com os spans do RequestTimer, identificados por thread_id/message_id,
+e vão para um buffer em memória; uma thread em background os envia em lotes
+para o exportador configurado.
+
+Exportadores: `file` (NDJSON local, padrão), `langsmith` (uma run por trace),
+`none`, ou `modulo:Classe` com um método `export(records)`.
+"""
+
+import atexit
+import importlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from utils.timing import RequestTimer
+
+
+class SpanExporter:
+    """Interface dos exportadores: recebe lotes de registros de trace"""
+
+    def export(self, records: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class NullExporter(SpanExporter):
+    def export(self, records: List[Dict[str, Any]]):
+        pass
+
+
+class FileExporter(SpanExporter):
+    """Acrescenta um trace por linha (NDJSON); rotaciona para `.1` ao passar de `max_bytes`"""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, records: List[Dict[str, Any]]):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+            os.replace(self.path, self.path + ".1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class LangSmithExporter(SpanExporter):
+    """Envia cada trace como uma run raiz no LangSmith (spans nos outputs)"""
+
+    def __init__(self, project_name: Optional[str] = None):
+        from langsmith import Client  # dependência do langchain-core
+
+        self.client = Client()
+        self.project_name = project_name or os.getenv("LANGSMITH_PROJECT", "lina-project-default")
+
+    def export(self, records: List[Dict[str, Any]]):
+        from datetime import datetime, timezone
+
+        for record in records:
+            started = datetime.fromtimestamp(record["started_at"], tz=timezone.utc)
+            ended = datetime.fromtimestamp(record["started_at"] + record["duration_ms"] / 1000, tz=timezone.utc)
+            self.client.create_run(
+                name=record["name"],
+                run_type="chain",
+                inputs={"thread_id": record["thread_id"], "message_id": record["message_id"]},
+                outputs={"spans": record["spans"]},
+                error=record.get("error"),
+                start_time=started,
+                end_time=ended,
+                project_name=self.project_name,
+                extra={"metadata": {**record["attributes"], "sample_reason": record["sample_reason"]}},
+            )
+
+
+def load_exporter(spec: str, default_path: str) -> SpanExporter:
+    """'file[:caminho]', 'langsmith', 'none' ou 'modulo:Classe'"""
+    if spec in ("", "none"):
+        return NullExporter()
+    if spec == "file" or spec.startswith("file:"):
+        return FileExporter(spec[len("file:"):] or default_path)
+    if spec == "langsmith":
+        return LangSmithExporter()
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class TraceContext:
+    """Estado de uma requisição em andamento"""
+
+    def __init__(self, timer: RequestTimer, head_sampled: bool):
+        self.trace_id = uuid.uuid4().hex
+        self.timer = timer
+        self.head_sampled = head_sampled
+        self.started_at = time.time()
+        self.attributes: Dict[str, Any] = {}
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+
+class Tracer:
+    """Amostragem (taxa + erros + lentas), buffer limitado e flush em background"""
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        sample_rate: float = 0.1,
+        slow_ms: float = 5000.0,
+        max_buffer: int = 1000,
+        batch_size: int = 50,
+        flush_interval: float = 2.0,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer: deque = deque(maxlen=max_buffer)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.started = 0
+        self.sampled: Dict[str, int] = {"rate": 0, "error": 0, "slow": 0}
+        self.dropped = 0
+        self.exported = 0
+        self.export_errors = 0
+
+    def start_trace(self, timer: RequestTimer) -> TraceContext:
+        """Abre o trace da requisição; a sorte da taxa é tirada aqui"""
+        self.started += 1
+        context = TraceContext(timer, random.random() < self.sample_rate)
+        return context
+
+    def finish_trace(self, context: TraceContext, name: str, error: Optional[str] = None) -> Optional[str]:
+        """Decide se o trace é guardado; retorna o motivo ou None se descartado"""
+        duration_ms = context.timer.elapsed() * 1000
+        if error:
+            reason = "error"
+        elif duration_ms >= self.slow_ms:
+            reason = "slow"
+        elif context.head_sampled:
+            reason = "rate"
+        else:
+            return None
+
+        record = {
+            "trace_id": context.trace_id,
+            "name": name,
+            "thread_id": context.attributes.get("thread_id"),
+            "message_id": context.attributes.get("message_id"),
+            "started_at": context.started_at,
+            "duration_ms": round(duration_ms, 2),
+            "sample_reason": reason,
+            "error": error,
+            "attributes": context.attributes,
+            "spans": [
+                {"name": span_name, "start_ms": round(start * 1000, 2), "duration_ms": round(duration * 1000, 2)}
+                for span_name, start, duration in context.timer.spans
+            ],
+        }
+        with self._lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1  # deque descarta o mais antigo
+            self.buffer.append(record)
+            self.sampled[reason] += 1
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return reason
+
+    def flush(self):
+        """Envia tudo que está no buffer, em lotes de `batch_size`"""
+        while True:
+            with self._lock:
+                batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            if not batch:
+                return
+            try:
+                self.exporter.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.export_errors += 1
+                print(f"[ERROR] Trace exporter error ({len(batch)} traces descartados): {e}")
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._flush_loop, name="lina-trace-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)  # não perder o que ainda está no buffer
+
+    def shutdown(self, timeout: float = 5.0):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self.flush()
+        self.exporter.shutdown()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buffered = len(self.buffer)
+        return {
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "exporter": type(self.exporter).__name__,
+            "started": self.started,
+            "sampled": dict(self.sampled),
+            "buffered": buffered,
+            "dropped": self.dropped,
+            "exported": self.exported,
+            "export_errors": self.export_errors,
+        }
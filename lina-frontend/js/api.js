@@ -16,6 +16,17 @@ class LinaAPI {
         this.userId = 'default_user'; // Por enquanto usuário fixo
     }
 
+    /**
+     * Gera uma Idempotency-Key para uma mensagem
+     * @returns {string}
+     */
+    newIdempotencyKey() {
+        if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+            return window.crypto.randomUUID();
+        }
+        return `${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+    }
+
     /**
      * Verifica se o backend está funcionando
      * @returns {Promise<boolean>}
@@ -99,18 +110,37 @@ class LinaAPI {
                 }
             };
 
+            // 🔁 Uma chave por mensagem: retries reaproveitam a resposta em vez de chamar o LLM de novo
+            const idempotencyKey = this.newIdempotencyKey();
+
             console.log('[API] 🧵 Enviando mensagem com thread:', { 
                 message, 
                 thread_id: useThreadId, 
+                idempotency_key: idempotencyKey,
                 payload 
             });
 
-            const response = await fetch(`${this.baseURL}/chat/invoke`, {
+            const request = () => fetch(`${this.baseURL}/chat/invoke`, {
                 method: 'POST',
-                headers: this.headers,
+                headers: { ...this.headers, 'Idempotency-Key': idempotencyKey },
                 body: JSON.stringify(payload)
             });
 
+            let response;
+            try {
+                response = await request();
+            } catch (networkError) {
+                // Falha de rede (ex.: conexão caiu): repetir uma vez com a mesma chave
+                console.warn('[API] 🔁 Falha de rede, repetindo com a mesma Idempotency-Key:', networkError);
+                response = await request();
+            }
+
+            // 🚦 Admissão: backend sobrecarregado, informar quando tentar novamente
+            if (response.status === 429) {
+                const retryAfter = response.headers.get('Retry-After') || '?';
+                throw new Error(`Lina está ocupada no momento. Tente novamente em ${retryAfter}s.`);
+            }
+
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}: ${response.statusText}`);
             }
@@ -423,6 +423,12 @@ class DebugPanel {
                             <div class="json-content">${this.escapeHtml(item.assistantResponse)}</div>
                         </div>
                         
+                        <!-- ⏱️ Quebra de tempo por etapa -->
+                        <div class="json-block">
+                            <div class="json-header">⏱️ Tempo por Etapa</div>
+                            <div class="json-content">${this.formatTimings(item.debugInfo.timings)}</div>
+                        </div>
+                        
                         <!-- Debug Info Completo -->
                         <div class="json-block">
                             <div class="json-header">🔍 Debug Info Completo</div>
@@ -503,7 +509,10 @@ class DebugPanel {
             '📤 Tokens Prompt': debugInfo.prompt_tokens || 'N/A', 
             '📥 Tokens Resposta': debugInfo.completion_tokens || 'N/A',
             '⏱️ Duração': `${debugInfo.duration || 'N/A'}s`,
+            '🚦 Fila': `${debugInfo.queue_wait ?? 0}s`,
+            '🔁 Replay': debugInfo.idempotent_replay ? 'Sim (retry)' : 'Não',
             '🤖 Modelo': debugInfo.model_name || 'N/A',
+            '🧭 Tier': debugInfo.model_tier ? `${debugInfo.model_tier} (${debugInfo.routing_reason || ''})` : 'N/A',
             '🆔 Message ID': debugInfo.message_id || 'N/A',
             '🧵 Thread ID': debugInfo.thread_id || 'N/A',
             '#️⃣ Sequência': debugInfo.message_sequence || 'N/A'
@@ -518,6 +527,41 @@ class DebugPanel {
         return formatted.trim();
     }
 
+    /**
+     * ⏱️ Formata a quebra de tempo por etapa (ms) com barra proporcional ao total
+     */
+    formatTimings(timings) {
+        if (!timings || Object.keys(timings).length === 0) return 'N/A';
+        
+        const total = timings.total || Object.values(timings).reduce((sum, ms) => sum + ms, 0);
+        const labels = {
+            parse_input: 'Parse do input',
+            rehydrate: 'Reidratação arquivo',
+            checkpoint_load: 'Leitura checkpoint',
+            routing: 'Roteamento modelo',
+            'enrich:memory': 'Enriq. memória',
+            prompt_build: 'Montagem do prompt',
+            llm_ttfb: 'LLM 1º byte',
+            llm_generation: 'LLM geração',
+            memory_index: 'Indexação memória',
+            checkpoint_write: 'Escrita checkpoint',
+            checkpoint_listeners: 'Listeners checkpoint',
+            graph_total: 'Grafo (total)',
+            fallback_chain: 'Chain fallback',
+            response_serialization: 'Serialização',
+            total: 'Total'
+        };
+        
+        let formatted = '';
+        Object.entries(timings).forEach(([stage, ms]) => {
+            const share = total > 0 ? Math.round((ms / total) * 20) : 0;
+            const bar = '█'.repeat(share) || '·';
+            formatted += `${(labels[stage] || stage).padEnd(20)} ${ms.toFixed(1).padStart(9)}ms ${bar}\n`;
+        });
+        
+        return formatted.trim();
+    }
+
     /**
      * 📝 CHECKPOINT 2.3b: Escapa HTML para segurança
      */